@@ -1,25 +1,211 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response, send_from_directory
+from flask import Flask, Blueprint, current_app, render_template, request, redirect, url_for, flash, session, jsonify, make_response, send_file, send_from_directory, Response, stream_with_context, g, has_request_context, has_app_context
+from flask.logging import default_handler
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
 import os
 from datetime import datetime
-from fpdf import FPDF
-import arabic_reshaper
-from bidi.algorithm import get_display
 import os.path
-from flask_migrate import Migrate
-import pandas as pd
+from sqlalchemy import and_, or_, text, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload, object_session, Session
 import zipfile
+import csv
+import io
+import time
+import uuid
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from collections import OrderedDict, namedtuple
+import bisect
+import itertools
+import heapq
+import unicodedata
+import base64
+import click
+from datetime import timedelta
+import json
+import re
+import sqlite3
+import logging
+import threading
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///inventory.db'
-app.config['UPLOAD_FOLDER'] = 'static/uploads'
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow אופציונלי - בלעדיו מוצגות התמונות המקוריות
+    Image = None
+
+db = SQLAlchemy()
+# הנתיבים, ה-hooks ופקודות ה-CLI נרשמים על ה-blueprint ומחוברים לאפליקציה ב-create_app.
+# ה-import עצמו לא פונה למסד הנתונים ולא טוען את pandas/fpdf - אלה נטענים בשימוש הראשון
+bp = Blueprint('main', __name__, cli_group=None)
+
+@event.listens_for(Engine, 'connect')
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    # מנועים שנוצרים מחוץ לאפליקציה (למשל check-query-plans בזיכרון) לא מקבלים את ההגדרות
+    if not isinstance(dbapi_connection, sqlite3.Connection) or not has_app_context():
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma, value in current_app.config['SQLITE_PRAGMAS'].items():
+        if value not in (None, ''):
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+    cursor.close()
+
+# לוגים מובנים - כל רשומה יוצאת כשורת JSON (או key=value במצב text) עם שדות נוספים מ-log_event
+class StructuredLogFormatter(logging.Formatter):
+    def __init__(self, json_output=True):
+        super().__init__()
+        self.json_output = json_output
+    
+    def format(self, record):
+        fields = getattr(record, 'fields', {})
+        if self.json_output:
+            entry = {'time': self.formatTime(record), 'level': record.levelname, 'message': record.getMessage()}
+            entry.update(fields)
+            if record.exc_info:
+                entry['exception'] = self.formatException(record.exc_info)
+            return json.dumps(entry, ensure_ascii=False, default=str)
+        line = f"{self.formatTime(record)} {record.levelname} {record.getMessage()}"
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+log_handler = logging.StreamHandler()  # אחד לכל תהליך, גם אם נוצרות כמה אפליקציות
+
+def log_event(level, message, **fields):
+    if has_request_context() and request.endpoint:
+        fields.setdefault('endpoint', request.endpoint)
+    current_app.logger.log(level, message, extra={'fields': fields})
+
+# מדדי ביצועים לכל בקשה: זמן כולל, מספר פקודות SQL וזמן SQL.
+# המדדים נשמרים בזיכרון של כל worker ונחשפים בפורמט Prometheus ב-/metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class RequestMetrics:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.latency = {}  # (endpoint, method) -> [מונים לכל bucket, סכום, מספר]
+        self.requests = {}  # (endpoint, method, status) -> מספר
+        self.sql_statements = {}  # endpoint -> מספר
+        self.sql_seconds = {}  # endpoint -> שניות
+        self.slow_queries = 0
+    
+    def observe(self, endpoint, method, status, seconds, sql_statements, sql_seconds):
+        with self.lock:
+            histogram = self.latency.setdefault((endpoint, method), [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.sql_statements[endpoint] = self.sql_statements.get(endpoint, 0) + sql_statements
+            self.sql_seconds[endpoint] = self.sql_seconds.get(endpoint, 0.0) + sql_seconds
+    
+    def slow_query(self):
+        with self.lock:
+            self.slow_queries += 1
+    
+    def render(self):
+        lines = [
+            '# HELP http_request_duration_seconds Request latency by endpoint.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        with self.lock:
+            for (endpoint, method), (counts, total, count) in sorted(self.latency.items()):
+                labels = f'endpoint="{endpoint}",method="{method}"'
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {bucket_count}')
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f'http_request_duration_seconds_sum{{{labels}}} {total}')
+                lines.append(f'http_request_duration_seconds_count{{{labels}}} {count}')
+            lines += ['# HELP http_requests_total Requests by endpoint and status.', '# TYPE http_requests_total counter']
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+            lines += ['# HELP db_statements_total SQL statements executed by endpoint.', '# TYPE db_statements_total counter']
+            for endpoint, count in sorted(self.sql_statements.items()):
+                lines.append(f'db_statements_total{{endpoint="{endpoint}"}} {count}')
+            lines += ['# HELP db_time_seconds_total Time spent in SQL by endpoint.', '# TYPE db_time_seconds_total counter']
+            for endpoint, seconds in sorted(self.sql_seconds.items()):
+                lines.append(f'db_time_seconds_total{{endpoint="{endpoint}"}} {seconds}')
+            lines += ['# HELP db_slow_queries_total SQL statements slower than SLOW_QUERY_MS.', '# TYPE db_slow_queries_total counter',
+                      f'db_slow_queries_total {self.slow_queries}']
+        return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics(LATENCY_BUCKETS)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context() and 'sql_statements' in g:
+        g.sql_statements += 1
+        g.sql_seconds += elapsed
+    if has_app_context() and elapsed * 1000 >= current_app.config['SLOW_QUERY_MS']:
+        request_metrics.slow_query()
+        log_event(logging.WARNING, 'slow query', duration_ms=round(elapsed * 1000, 1),
+                  statement=' '.join(statement.split())[:500])
+
+@event.listens_for(Engine, 'handle_error')
+def discard_query_timer(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_start'):
+        connection.info['query_start'].pop()
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_seconds = 0.0
+
+@bp.before_app_request
+def warm_search_index():
+    # הבקשה הראשונה של כל worker מתחילה לבנות את אינדקס החיפוש ברקע
+    if current_app.config['SEARCH_PREFIX_INDEX'] and search_index.version is None and not search_index.building:
+        search_index.schedule_rebuild()
+
+@bp.after_app_request
+def record_request_metrics(response):
+    if 'request_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unmatched'
+    request_metrics.observe(endpoint, request.method, response.status_code, elapsed, g.sql_statements, g.sql_seconds)
+    response.headers['Server-Timing'] = f'app;dur={elapsed * 1000:.1f}, db;dur={g.sql_seconds * 1000:.1f}'
+    if endpoint != 'static':
+        log_event(logging.INFO, 'request', method=request.method, path=request.path, status=response.status_code,
+                  duration_ms=round(elapsed * 1000, 1), sql_statements=g.sql_statements,
+                  sql_ms=round(g.sql_seconds * 1000, 1))
+    return response
+
+@bp.route('/metrics')
+def metrics():
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('unauthorized\n', status=401, mimetype='text/plain')
+    return Response(request_metrics.render(), mimetype='text/plain; version=0.0.4')
 
 # מודלים של מסד הנתונים
+# גרסת שורה למוצרים, וריאציות, קטגוריות ולקוחות - משמשת ל-ETag בנקודות הקצה של JSON.
+# ערך אקראי ולא מונה: מזהה שנמחק ונוצר מחדש (SQLite ממחזר מזהים) לא יחזור לגרסה קודמת.
+# העדכון ב-ORM נעשה ע"י version_id_col; default ו-onupdate מכסים גם INSERT/UPDATE מרוכזים
+# (ייבוא, עדכוני מחיר), שעוברים דרך Core
+def new_row_version(previous=None):
+    return uuid.uuid4().hex
+
+def row_version_column():
+    return db.Column(db.String(32), nullable=False, default=new_row_version, onupdate=new_row_version,
+                     server_default='0')
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -30,15 +216,24 @@ class Category(db.Model):
     name = db.Column(db.String(100), nullable=False)
     image = db.Column(db.String(200))
     products = db.relationship('Product', backref='category', lazy=True)
+    version = row_version_column()
+    __mapper_args__ = {'version_id_col': version, 'version_id_generator': new_row_version}
 
 class Product(db.Model):
+    # רשימת המוצרים מסוננת לפי קטגוריה וממוינת לפי שם או מחיר
+    __table_args__ = (
+        db.Index('ix_product_category_id_name', 'category_id', 'name'),
+        db.Index('ix_product_category_id_price_with_vat', 'category_id', 'price_with_vat'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, index=True)
     price_without_vat = db.Column(db.Float, nullable=False)
-    price_with_vat = db.Column(db.Float, nullable=False)
+    price_with_vat = db.Column(db.Float, nullable=False, index=True)
     image = db.Column(db.String(200))
-    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False, index=True)
     variations = db.relationship('ProductVariation', backref='product', lazy=True)
+    version = row_version_column()
+    __mapper_args__ = {'version_id_col': version, 'version_id_generator': new_row_version}
 
 class Customer(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -47,10 +242,14 @@ class Customer(db.Model):
     phone = db.Column(db.String(20))
     email = db.Column(db.String(120))
     orders = db.relationship('Order', backref='customer', lazy=True)
+    version = row_version_column()
+    __mapper_args__ = {'version_id_col': version, 'version_id_generator': new_row_version}
 
 class Order(db.Model):
+    # סינון לפי לקוח בהיסטוריית ההזמנות ממוין לפי תאריך
+    __table_args__ = (db.Index('ix_order_customer_id_date', 'customer_id', 'date'),)
     id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
     customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'))  # קשר ללקוח
     total_without_vat = db.Column(db.Float, nullable=False)
     total_with_vat = db.Column(db.Float, nullable=False)
@@ -58,8 +257,8 @@ class Order(db.Model):
 
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
     quantity = db.Column(db.Integer, nullable=False)
     price_without_vat = db.Column(db.Float, nullable=False)
     price_with_vat = db.Column(db.Float, nullable=False)
@@ -68,52 +267,1266 @@ class OrderItem(db.Model):
 # הוספת מודל חדש
 class ProductVariation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False)  # שם הווריאציה (למשל: "אבטיח", "מלון")
     price_without_vat = db.Column(db.Float, nullable=False)
     price_with_vat = db.Column(db.Float, nullable=False)
     image = db.Column(db.String(200))
+    version = row_version_column()
+    __mapper_args__ = {'version_id_col': version, 'version_id_generator': new_row_version}
+
+# סל הזמנות בצד השרת - בסשן נשמר רק מזהה הסל
+class Cart(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    items = db.relationship('CartItem', backref='cart', lazy=True, cascade='all, delete-orphan')
+
+class CartItem(db.Model):
+    # ב-UNIQUE ערכי NULL שונים זה מזה, ולכן מוצר בלי וריאציה צריך אינדקס חלקי משלו
+    __table_args__ = (
+        db.UniqueConstraint('cart_id', 'product_id', 'variation_id'),
+        db.Index('uq_cart_item_cart_id_product_id_no_variation', 'cart_id', 'product_id', unique=True,
+                 sqlite_where=db.text('variation_id IS NULL'), postgresql_where=db.text('variation_id IS NULL')),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    cart_id = db.Column(db.Integer, db.ForeignKey('cart.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    variation_id = db.Column(db.Integer, db.ForeignKey('product_variation.id'))
+    quantity = db.Column(db.Integer, nullable=False)
+    # המחיר בזמן ההוספה לסל
+    price_without_vat = db.Column(db.Float, nullable=False)
+    price_with_vat = db.Column(db.Float, nullable=False)
+
+# סיכומי מכירות יומיים - מתעדכנים בכל שמירה ומחיקה של הזמנה, כך שדוחות לא סורקים את OrderItem.
+# אין מפתח זר למוצר/קטגוריה/לקוח: הסיכום נשאר גם אחרי מחיקה שלהם
+class DailyProductSales(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue_without_vat = db.Column(db.Float, nullable=False, default=0)
+    revenue_with_vat = db.Column(db.Float, nullable=False, default=0)
+
+class DailyCategorySales(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    category_id = db.Column(db.Integer, primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue_without_vat = db.Column(db.Float, nullable=False, default=0)
+    revenue_with_vat = db.Column(db.Float, nullable=False, default=0)
+
+class DailyCustomerSales(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    customer_id = db.Column(db.Integer, primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue_without_vat = db.Column(db.Float, nullable=False, default=0)
+    revenue_with_vat = db.Column(db.Float, nullable=False, default=0)
+
+# מוני גרסה למטמונים: כל שינוי בקטלוג מעלה את הגרסה באותה טרנזקציה,
+# כך שכל ה-workers (וכל התהליכים) רואים מיד שהעמודים השמורים אצלם ישנים
+class CacheVersion(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+# שיעורי מע"מ לפי תאריך תחילה - בתוקף השיעור האחרון שתאריך התחילה שלו כבר הגיע.
+# כשאין שיעור בתוקף משתמשים ב-VAT_RATE מההגדרות
+class VatRate(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    rate = db.Column(db.Float, nullable=False)  # אחוזים, למשל 18
+    effective_from = db.Column(db.DateTime, nullable=False, index=True)
+
+# היסטוריית מחירים: כל שינוי מחירים מרוכז נרשם פעם אחת ב-PriceChange, ולכל מוצר או וריאציה שהשתנו
+# נשמרת שורה ב-PriceHistory עם המחיר שהיה בתוקף עד השינוי. המחיר הנוכחי נשאר רק בטבלת המוצר/הווריאציה.
+# אין מפתח זר למוצר: ההיסטוריה נשארת גם אחרי מחיקה
+class PriceChange(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    effective_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    details = db.Column(db.Text, nullable=False)  # JSON של ההתאמה וההיקף, כפי שנשלחו
+    products = db.Column(db.Integer, nullable=False, default=0)
+    variations = db.Column(db.Integer, nullable=False, default=0)
+
+class PriceHistory(db.Model):
+    __table_args__ = (db.Index('ix_price_history_product_id_change_id', 'product_id', 'change_id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    change_id = db.Column(db.Integer, db.ForeignKey('price_change.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, nullable=False)
+    variation_id = db.Column(db.Integer)  # None - המחיר של המוצר עצמו
+    price_with_vat = db.Column(db.Float, nullable=False)
+    price_without_vat = db.Column(db.Float, nullable=False)
+
+# אינדקס חיפוש טקסט מלא (SQLite FTS5) על שמות מוצרים ווריאציות.
+# שורה אחת לכל שם: rowid חיובי = מזהה מוצר, rowid שלילי = מזהה וריאציה (כשלילי).
+# האינדקס מתעדכן אוטומטית ע"י טריגרים, כך שגם מחיקות/ייבוא בכמויות נשארים מסונכרנים,
+# והכנסה של מוצר או וריאציה היא הוספת שורה בלבד (בלי לכתוב מחדש שורות קיימות).
+SEARCH_INDEX_DDL = [
+    # גרסה קודמת של האינדקס (שורה אחת לכל מוצר)
+    "DROP TRIGGER IF EXISTS product_search_ai",
+    "DROP TRIGGER IF EXISTS product_search_au",
+    "DROP TRIGGER IF EXISTS product_search_ad",
+    "DROP TRIGGER IF EXISTS product_search_vi",
+    "DROP TRIGGER IF EXISTS product_search_vu",
+    "DROP TRIGGER IF EXISTS product_search_vd",
+    "DROP TABLE IF EXISTS product_search",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS catalog_search USING fts5(
+        name, product_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS catalog_search_ai AFTER INSERT ON product BEGIN
+        INSERT INTO catalog_search(rowid, name, product_id) VALUES (new.id, new.name, new.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS catalog_search_au AFTER UPDATE OF name ON product BEGIN
+        UPDATE catalog_search SET name = new.name WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS catalog_search_ad AFTER DELETE ON product BEGIN
+        DELETE FROM catalog_search WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS catalog_search_vi AFTER INSERT ON product_variation BEGIN
+        INSERT INTO catalog_search(rowid, name, product_id) VALUES (-new.id, new.name, new.product_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS catalog_search_vu AFTER UPDATE OF name, product_id ON product_variation BEGIN
+        UPDATE catalog_search SET name = new.name, product_id = new.product_id WHERE rowid = -new.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS catalog_search_vd AFTER DELETE ON product_variation BEGIN
+        DELETE FROM catalog_search WHERE rowid = -old.id;
+    END""",
+]
+
+search_index_enabled = None  # None - עוד לא נבדק בתהליך הזה
+
+def fts_enabled():
+    """האם אינדקס FTS5 קיים במסד הנתונים. נבדק פעם אחת לכל תהליך; נוצר ב-flask init-db."""
+    global search_index_enabled
+    if search_index_enabled is None:
+        search_index_enabled = db.engine.dialect.name == 'sqlite' and db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'catalog_search'"
+        )).first() is not None
+    return search_index_enabled
+
+def ensure_search_index():
+    """יוצר את אינדקס החיפוש והטריגרים אם חסרים. מחזיר False אם FTS5 לא זמין."""
+    global search_index_enabled
+    if db.engine.dialect.name != 'sqlite':
+        search_index_enabled = False
+        return False
+    try:
+        existed = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'catalog_search'"
+        )).first() is not None
+        for statement in SEARCH_INDEX_DDL:
+            db.session.execute(text(statement))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning(f"אינדקס החיפוש אינו זמין, חוזר לחיפוש LIKE: {e}")
+        search_index_enabled = False
+        return False
+    search_index_enabled = True
+    if not existed:
+        # מסד נתונים קיים - ממלאים את האינדקס מהנתונים הנוכחיים
+        rebuild_search_index()
+    return True
+
+def rebuild_search_index():
+    db.session.execute(text("DELETE FROM catalog_search"))
+    db.session.execute(text(
+        "INSERT INTO catalog_search(rowid, name, product_id) SELECT id, name, id FROM product"
+    ))
+    db.session.execute(text(
+        "INSERT INTO catalog_search(rowid, name, product_id) SELECT -id, name, product_id FROM product_variation"
+    ))
+    db.session.commit()
+
+def build_match_terms(query):
+    # כל מילה הופכת לחיפוש תחילית; מרכאות ותווים מיוחדים של FTS מוסרים
+    return [f'"{term}"*' for term in re.findall(r'\w+', query)]
+
+def matching_products_sql(terms):
+    """(SQL, פרמטרים) של מזהי המוצרים שכל מילה מתאימה לשם שלהם או לשם אחת הווריאציות שלהם.
+
+    כל שם הוא שורה נפרדת באינדקס, ולכן MATCH אחד על כל המילים לא ימצא "שוקולד מריר" כשמילה אחת
+    בשם המוצר והשנייה בשם וריאציה - כל מילה נבדקת לחוד, והתוצאות נחתכות לפי מוצר."""
+    sql = ' INTERSECT '.join(
+        f'SELECT product_id FROM catalog_search WHERE catalog_search MATCH :term{i}' for i in range(len(terms))
+    )
+    return sql, {f'term{i}': term for i, term in enumerate(terms)}
+
+def search_products_filter(query, use_index=None):
+    """תנאי סינון למוצרים התואמים לחיפוש - דרך האינדקס אם קיים, אחרת LIKE.
+    use_index=None - לפי fts_enabled() של מסד הנתונים של האפליקציה."""
+    terms = build_match_terms(query)
+    if use_index is None:
+        use_index = fts_enabled()
+    if terms and use_index:
+        sql, params = matching_products_sql(terms)
+        return Product.id.in_(
+            text(sql).bindparams(**params).columns(db.column('product_id', db.Integer))
+        )
+    return Product.name.ilike(f'%{query}%')
+
+def search_product_ids(query, limit):
+    """מזהי מוצרים לפי רלוונטיות (שם המוצר משוקלל מעל שמות הווריאציות)."""
+    terms = build_match_terms(query)
+    if not terms:
+        return []
+    sql, params = matching_products_sql(terms)
+    # bm25 שלילי - ככל שקטן יותר התאמה טובה יותר; התאמה בשם וריאציה נחלשת פי 5.
+    # הדירוג לפי כל השמות של המוצר שמתאימים לאחת המילים לפחות
+    rows = db.session.execute(text(f"""
+        SELECT product_id FROM catalog_search
+        WHERE catalog_search MATCH :any_term AND product_id IN ({sql})
+        GROUP BY product_id
+        ORDER BY min(CASE WHEN rowid > 0 THEN rank ELSE rank * 0.2 END)
+        LIMIT :limit
+    """), {'any_term': ' OR '.join(terms), 'limit': limit, **params})
+    return [row[0] for row in rows]
+
+# אינדקס תחיליות בזיכרון להשלמה האוטומטית ב-/search-products - בלי פנייה למסד הנתונים בכל הקשה.
+# כל שם (מוצר או וריאציה) מפורק למילים מנורמלות. לכל מילה רשימת מופעים ממוינת לפי דירוג קבוע
+# (מוצר לפני וריאציה, מילה מוקדמת בשם לפני מאוחרת, שם קצר לפני ארוך, ואז לפי א"ב), כך שתחילית רחבה
+# נענית במיזוג של ראשי הרשימות ולא בסריקה של כל ההתאמות.
+# שינויים דרך ה-ORM מתעדכנים במקום אחרי ה-commit; פעולות מרוכזות (ייבוא, מחיקת הכל)
+# ושינויים מ-workers אחרים (לפי גרסת הקטלוג) גורמים לבנייה מחדש ברקע. עד שהאינדקס מעודכן -
+# החיפוש חוזר למסד הנתונים
+# סימנים מצטרפים לטיניים, ניקוד וטעמים
+SEARCH_DIACRITICS = re.compile('[\u0300-\u036f\u0591-\u05c7]')
+
+def normalize_search_text(value):
+    # אותיות קטנות והסרת ניקוד/סימנים, כמו remove_diacritics של FTS
+    return SEARCH_DIACRITICS.sub('', unicodedata.normalize('NFKD', (value or '').casefold()))
+
+def tokenize_search_text(value):
+    return re.findall(r'\w+', normalize_search_text(value))
+
+SearchHit = namedtuple('SearchHit', 'id name price_with_vat image version')
+
+class PrefixIndex:
+    def __init__(self):
+        self.check_interval = 0
+        self.lock = threading.RLock()
+        self._reset({}, {}, {}, {})
+        self.version = None  # גרסת הקטלוג שהאינדקס משקף; None - עוד לא נבנה
+        self.generation = 0  # עולה בכל סימון כלא מעודכן, כדי שבנייה שהתחילה לפני השינוי לא תיחשב טרייה
+        self.stale = False
+        self.building = False
+        self.checked_at = 0.0
+
+    def init_app(self, app):
+        self.check_interval = app.config['SEARCH_INDEX_CHECK_SECONDS']
+
+    def _reset(self, postings, documents, products, product_documents):
+        self.postings = postings  # מילה -> [(וריאציה?, מיקום המילה, אורך השם, השם, מפתח מסמך)] ממוין
+        self.vocabulary = sorted(postings)
+        # מפתח מסמך (מזהה מוצר, או מינוס מזהה וריאציה) -> (מזהה מוצר, " מילה מילה", שם, וריאציה?)
+        self.documents = documents
+        self.products = products  # מזהה מוצר -> SearchHit
+        self.product_documents = product_documents  # מזהה מוצר -> מפתחות המסמכים שלו (השם ושמות הווריאציות)
+
+    def _add_document(self, doc_key, product_id, name, is_variation, postings=None, product_documents=None):
+        if product_documents is None:
+            product_documents = self.product_documents
+        product_documents.setdefault(product_id, set()).add(doc_key)
+        tokens = tokenize_search_text(name)
+        for position, token in enumerate(tokens):
+            entry = (is_variation, position, len(name), name, doc_key)
+            if postings is not None:
+                postings.setdefault(token, []).append(entry)  # בנייה מלאה - ממוין בסוף
+            else:
+                if token not in self.postings:
+                    self.postings[token] = []
+                    bisect.insort(self.vocabulary, token)
+                bisect.insort(self.postings[token], entry)
+        # המילים כמחרוזת אחת עם רווח לפני כל מילה: בדיקת תחילית היא חיפוש של " תחילית"
+        return product_id, ' ' + ' '.join(tokens), name, is_variation
+
+    def _remove_document(self, doc_key):
+        document = self.documents.pop(doc_key, None)
+        if document is None:
+            return
+        product_id, text, name, is_variation = document
+        keys = self.product_documents[product_id]
+        keys.discard(doc_key)
+        if not keys:
+            del self.product_documents[product_id]
+        for position, token in enumerate(text.split()):
+            token_postings = self.postings[token]
+            del token_postings[bisect.bisect_left(token_postings, (is_variation, position, len(name), name, doc_key))]
+            if not token_postings:
+                del self.postings[token]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+
+    def load(self, version, products, variations, generation):
+        """בנייה מלאה מתוך (id, name, price_with_vat, image, version) של מוצרים ו-(id, product_id, name) של וריאציות."""
+        postings, documents, hits, product_documents = {}, {}, {}, {}
+        for product in products:
+            hits[product[0]] = SearchHit(*product)
+            documents[product[0]] = self._add_document(product[0], product[0], product[1], 0, postings, product_documents)
+        for variation_id, product_id, name in variations:
+            documents[-variation_id] = self._add_document(-variation_id, product_id, name, 1, postings, product_documents)
+        for token_postings in postings.values():
+            token_postings.sort()
+        with self.lock:
+            self._reset(postings, documents, hits, product_documents)
+            self.version = version
+            self.stale = self.generation != generation
+            self.checked_at = time.monotonic()
+
+    def put_product(self, product_id, name, price_with_vat, image, version):
+        self._remove_document(product_id)
+        self.documents[product_id] = self._add_document(product_id, product_id, name, 0)
+        self.products[product_id] = SearchHit(product_id, name, price_with_vat, image, version)
+
+    def remove_product(self, product_id):
+        self._remove_document(product_id)
+        self.products.pop(product_id, None)
+
+    def put_variation(self, variation_id, product_id, name):
+        self._remove_document(-variation_id)
+        self.documents[-variation_id] = self._add_document(-variation_id, product_id, name, 1)
+
+    def remove_variation(self, variation_id):
+        self._remove_document(-variation_id)
+
+    def apply(self, changes, bulk, version):
+        """נקרא אחרי commit. שינויים מה-ORM מוחלים במקום רק אם האינדקס היה מעודכן עד הגרסה הקודמת."""
+        with self.lock:
+            if self.version is None:
+                return
+            if bulk or version is None or self.version != version - 1:
+                self.mark_stale()
+                return
+            for change in changes:
+                getattr(self, change[0])(*change[1:])
+            self.version = version
+
+    def mark_stale(self):
+        with self.lock:
+            self.stale = True
+            self.generation += 1
+
+    def ready(self):
+        """האם אפשר לענות מהזיכרון. אם האינדקס חסר או ישן - מתזמן בנייה ברקע ומחזיר False."""
+        if self.version is not None and not self.stale:
+            now = time.monotonic()
+            if now - self.checked_at < self.check_interval:
+                return True
+            self.checked_at = now
+            if catalog_version() == self.version:
+                return True
+            self.mark_stale()
+        self.schedule_rebuild()
+        return False
+
+    def schedule_rebuild(self):
+        with self.lock:
+            if self.building:
+                return
+            self.building = True
+        threading.Thread(target=self._rebuild_in_background, args=(current_app._get_current_object(),),
+                         name='search-index', daemon=True).start()
+
+    def _rebuild_in_background(self, app):
+        try:
+            with app.app_context():
+                self.rebuild()
+        except Exception:
+            app.logger.exception('search index rebuild failed')
+        finally:
+            self.building = False
+
+    def rebuild(self):
+        generation = self.generation
+        start = time.perf_counter()
+        # שלוש הקריאות באותה טרנזקציה - תמונת מצב עקבית של הגרסה והשורות
+        version = catalog_version()
+        products = db.session.execute(db.select(
+            Product.id, Product.name, Product.price_with_vat, Product.image, Product.version
+        )).all()
+        variations = db.session.execute(db.select(
+            ProductVariation.id, ProductVariation.product_id, ProductVariation.name
+        )).all()
+        db.session.rollback()
+        self.load(version, products, variations, generation)
+        log_event(logging.INFO, 'search index built', products=len(products), variations=len(variations),
+                  duration_ms=round((time.perf_counter() - start) * 1000, 1))
 
-# יצירת מסד הנתונים והמשתמש הראשון
+    def search(self, query, limit):
+        """עד limit מוצרים שלכל אחת ממילות החיפוש יש מילה שמתחילה בה - בשם המוצר או בשם אחת הווריאציות."""
+        terms = tokenize_search_text(query)
+        if not terms:
+            return []
+        with self.lock:
+            # המילה עם הכי מעט מופעים מובילה; השאר נבדקות על כל השמות של המוצרים שהיא מוצאת
+            spans = {}
+            for term in set(terms):
+                low = bisect.bisect_left(self.vocabulary, term)
+                high = bisect.bisect_left(self.vocabulary, term + '\U0010ffff', low)
+                spans[term] = self.vocabulary[low:high]
+            driver = min(spans, key=lambda term: sum(len(self.postings[token]) for token in spans[term]))
+            needles = [' ' + term for term in terms if term != driver]
+            # התאמה מלאה למילה לפני התאמת תחילית, ובתוך כל אחת לפי הדירוג הקבוע
+            exact = [self.postings[driver]] if driver in self.postings else []
+            prefixed = [self.postings[token] for token in spans[driver] if token != driver]
+            candidates = itertools.chain(*exact, heapq.merge(*prefixed) if len(prefixed) > 1 else itertools.chain(*prefixed))
+            results, seen = [], set()
+            for entry in candidates:
+                product_id = self.documents[entry[-1]][0]
+                if product_id in seen or product_id not in self.products:
+                    continue
+                texts = [self.documents[key][1] for key in self.product_documents[product_id]]
+                if all(any(needle in text for text in texts) for needle in needles):
+                    seen.add(product_id)
+                    results.append(self.products[product_id])
+                    if len(results) == limit:
+                        break
+            return results
+
+search_index = PrefixIndex()
+
+# מעקב אחרי שינויים במוצרים ובווריאציות בכל session, והחלה על האינדקס אחרי commit
+def record_search_change(target, change):
+    session_ = object_session(target)
+    if session_ is not None:
+        session_.info.setdefault('search_index_changes', []).append(change)
+
+@event.listens_for(Product, 'after_insert')
+@event.listens_for(Product, 'after_update')
+def track_product_change(mapper, connection, target):
+    record_search_change(target, ('put_product', target.id, target.name, target.price_with_vat, target.image, target.version))
+
+@event.listens_for(Product, 'after_delete')
+def track_product_delete(mapper, connection, target):
+    record_search_change(target, ('remove_product', target.id))
+
+@event.listens_for(ProductVariation, 'after_insert')
+@event.listens_for(ProductVariation, 'after_update')
+def track_variation_change(mapper, connection, target):
+    record_search_change(target, ('put_variation', target.id, target.product_id, target.name))
+
+@event.listens_for(ProductVariation, 'after_delete')
+def track_variation_delete(mapper, connection, target):
+    record_search_change(target, ('remove_variation', target.id))
+
+@event.listens_for(Session, 'do_orm_execute')
+def track_bulk_catalog_change(orm_execute_state):
+    # INSERT/UPDATE/DELETE מרוכזים לא עוברים דרך אירועי ה-mapper
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ in (Product, ProductVariation):
+            orm_execute_state.session.info['search_index_bulk'] = True
+
+@event.listens_for(Session, 'after_commit')
+def apply_search_changes(session_):
+    changes = session_.info.pop('search_index_changes', [])
+    bulk = session_.info.pop('search_index_bulk', False)
+    version = session_.info.pop('catalog_version', None)
+    if changes or bulk or version is not None:
+        search_index.apply(changes, bulk, version)
+
+@event.listens_for(Session, 'after_rollback')
+def discard_search_changes(session_):
+    for key in ('search_index_changes', 'search_index_bulk', 'catalog_version'):
+        session_.info.pop(key, None)
+
+# יצירת מסד הנתונים והמשתמש הראשון. רץ במפורש (flask init-db) ולא בכל עליית תהליך
 def init_db():
-    with app.app_context():
-        # יצירת טבלאות חדשות בלבד (לא מוחק קיימות)
-        db.create_all()
-        
-        # בדיקה אם יש משתמש במערכת
-        if not User.query.first():
-            # יצירת משתמש ראשון
-            admin_user = User(
-                username='admin',
-                password=generate_password_hash('admin123')
-            )
-            try:
-                db.session.add(admin_user)
-                db.session.commit()
-                print("משתמש מנהל נוצר בהצלחה")
-            except Exception as e:
-                print(f"שגיאה ביצירת משתמש: {e}")
-                db.session.rollback()
-
-# בדיקה אם מסד הנתונים קיים
-if not os.path.exists('instance/inventory.db'):
+    # יצירת טבלאות חדשות בלבד (לא מוחק קיימות)
+    db.create_all()
+    ensure_search_index()
+    
+    # בדיקה אם יש משתמש במערכת
+    if not User.query.first():
+        # יצירת משתמש ראשון
+        admin_user = User(
+            username='admin',
+            password=generate_password_hash('admin123')
+        )
+        try:
+            db.session.add(admin_user)
+            db.session.commit()
+            current_app.logger.info("משתמש מנהל נוצר בהצלחה")
+        except Exception as e:
+            current_app.logger.error(f"שגיאה ביצירת משתמש: {e}")
+            db.session.rollback()
+
+@bp.cli.command('init-db')
+def init_db_command():
+    """יוצר טבלאות חסרות, את אינדקס החיפוש ומשתמש ראשון. עובד גם כשמסד הנתונים מוגדר ב-DATABASE_URL."""
     init_db()
-else:
-    # אם מסד הנתונים קיים, רק מוסיף טבלאות חדשות
-    with app.app_context():
-        db.create_all()
+    print("מסד הנתונים מוכן")
+
+@bp.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """בונה מחדש את אינדקס החיפוש מכל המוצרים והווריאציות."""
+    if not ensure_search_index():
+        print("FTS5 אינו זמין במסד הנתונים הזה")
+        return
+    rebuild_search_index()
+    print("אינדקס החיפוש נבנה מחדש")
+
+@bp.cli.command('purge-carts')
+@click.option('--days', default=30, show_default=True, help='מחיקת סלים שלא עודכנו מספר ימים זה')
+def purge_carts_command(days):
+    """מוחק סלי הזמנות נטושים."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    stale_carts = db.session.query(Cart.id).filter(Cart.updated_at < cutoff)
+    CartItem.query.filter(CartItem.cart_id.in_(stale_carts)).delete(synchronize_session=False)
+    deleted = Cart.query.filter(Cart.updated_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    print(f"נמחקו {deleted} סלים")
+
+def product_listing_check(search_query='', category_filter='', sort_by='name', cursor=None):
+    """השאילתה שרשימת המוצרים מריצה בפועל (כולל ה-JOIN של joinedload ותת-השאילתה של החיפוש)."""
+    query, columns, descending = product_listing(search_query, category_filter, sort_by, use_index=True)
+    return keyset_query(query, columns, cursor, current_app.config['CATALOG_PAGE_SIZE'], descending).statement
 
-# וידוא שתיקיית ההעלאות קיימת
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'])
-    print(f"נוצרה תיקיית העלאות: {app.config['UPLOAD_FOLDER']}")
+def query_plan_checks():
+    """השאילתות החמות של הנתיבים: (שם, שאילתה). משמש את check-query-plans."""
+    since = datetime(2026, 1, 1)
+    checks = [
+        (f'products: {sort_by}{" + category" if category else ""}', product_listing_check(category_filter=category, sort_by=sort_by))
+        for sort_by in ('name', 'price_asc', 'price_desc') for category in ('', '1')
+    ]
+    return checks + [
+        ('products: name keyset page', product_listing_check(cursor=encode_cursor(['מוצר 5', 10]))),
+        ('products: category + name keyset page', product_listing_check(category_filter='1', cursor=encode_cursor(['מוצר 5', 10]))),
+        ('products: search', product_listing_check(search_query='מוצר 12')),
+        ('products: variations selectinload', db.select(ProductVariation).where(ProductVariation.product_id.in_([1, 2, 3]))),
+        ('delete_product: ordered check', db.select(OrderItem).where(OrderItem.product_id == 1)),
+        ('delete_category: products in category', db.select(Product).where(Product.category_id == 1).limit(1)),
+        ('get_variations', db.select(ProductVariation).where(ProductVariation.product_id == 1)),
+        ('price_cart: products by id', db.select(Product).where(Product.id.in_([1, 2, 3]))),
+        ('cart: items of cart', db.select(CartItem).where(CartItem.cart_id == 1)),
+        ('purge-carts: stale carts', db.select(Cart.id).where(Cart.updated_at < since)),
+        ('orders_history: newest first', db.select(Order).order_by(Order.date.desc(), Order.id.desc()).limit(26)),
+        ('orders_history: date range', db.select(Order).where(Order.date >= since, Order.date < since + timedelta(days=7))
+            .order_by(Order.date.desc(), Order.id.desc()).limit(26)),
+        ('orders_history: customer', db.select(Order).where(Order.customer_id == 1)
+            .order_by(Order.date.desc(), Order.id.desc()).limit(26)),
+        ('orders_history: items selectinload', db.select(OrderItem).where(OrderItem.order_id.in_([1, 2, 3]))),
+        ('export_orders_pdf: ids by date', db.select(Order.id).where(Order.date >= since).order_by(Order.date, Order.id)),
+        ('vat_rate: rate in effect', db.select(VatRate.rate).where(VatRate.effective_from <= since)
+            .order_by(VatRate.effective_from.desc()).limit(1)),
+        ('price_history: product', db.select(PriceHistory).where(PriceHistory.product_id == 1)
+            .order_by(PriceHistory.change_id.desc())),
+        ('reprice: variations of category', db.select(ProductVariation.id).where(
+            ProductVariation.product_id.in_(db.select(Product.id).where(Product.category_id == 1)))),
+    ]
+
+def seed_query_plan_database(conn, scale):
+    """ממלא מסד נתונים ריק בנתונים סינתטיים ומריץ ANALYZE, כדי שהמתכנן יבחר כמו בייצור."""
+    categories = max(1, scale // 100)
+    factor = 1 + current_app.config['VAT_RATE'] / 100
+    for statement in SEARCH_INDEX_DDL:  # הטריגרים ממלאים את האינדקס יחד עם המוצרים
+        conn.exec_driver_sql(statement)
+    conn.execute(db.insert(Category), [{'name': f'קטגוריה {i}'} for i in range(categories)])
+    conn.execute(db.insert(Product), [
+        {'name': f'מוצר {i}', 'price_with_vat': i % 100 + 1, 'price_without_vat': (i % 100 + 1) / factor,
+         'category_id': i % categories + 1}
+        for i in range(scale)
+    ])
+    conn.execute(db.insert(ProductVariation), [
+        {'product_id': i % scale + 1, 'name': f'וריאציה {i}', 'price_with_vat': 5, 'price_without_vat': 5 / factor}
+        for i in range(scale)
+    ])
+    conn.execute(db.insert(Customer), [{'name': f'לקוח {i}'} for i in range(max(1, scale // 20))])
+    conn.execute(db.insert(Order), [
+        {'date': datetime(2025, 1, 1) + timedelta(hours=i), 'customer_id': i % max(1, scale // 20) + 1,
+         'total_without_vat': 100, 'total_with_vat': 100 * factor}
+        for i in range(scale)
+    ])
+    conn.execute(db.insert(OrderItem), [
+        {'order_id': i % scale + 1, 'product_id': i % scale + 1, 'quantity': 1,
+         'price_without_vat': 1, 'price_with_vat': factor, 'product_name': f'מוצר {i}'}
+        for i in range(scale * 3)
+    ])
+    conn.execute(db.insert(Cart), [{'updated_at': datetime(2025, 1, 1) + timedelta(hours=i)} for i in range(scale // 10 + 1)])
+    conn.execute(db.insert(CartItem), [
+        {'cart_id': i % (scale // 10 + 1) + 1, 'product_id': i + 1, 'quantity': 1, 'price_without_vat': 1, 'price_with_vat': factor}
+        for i in range(scale // 5)
+    ])
+    conn.exec_driver_sql('ANALYZE')
+
+# SCAN בלי USING INDEX = סריקה מלאה של הטבלה; USE TEMP B-TREE = מיון (או DISTINCT/GROUP BY) שלא נעשה לפי אינדקס
+FULL_SCAN_PATTERN = re.compile(r'^SCAN (TABLE )?(\w+)( AS \w+)?$')
+TEMP_SORT_PATTERN = re.compile(r'^USE TEMP B-TREE')
+# בחיפוש ממוינות רק התוצאות של MATCH - אין אינדקס שיכול לספק את הסדר שלהן
+TEMP_SORT_ALLOWED = {'products: search'}
+
+def explain_query_plans(conn):
+    """(שם, תוכנית, בעיות) לכל שאילתה מ-query_plan_checks, על חיבור SQLite שמולא ב-seed_query_plan_database.
+    בעיה היא סריקה מלאה של טבלה או מיון בלי אינדקס. משמש את check-query-plans ואת tests/test_query_plans.py."""
+    results = []
+    for name, statement in query_plan_checks():
+        sql = str(statement.compile(conn, compile_kwargs={'literal_binds': True}))
+        plan = [row[3] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}')]
+        problems = [detail for detail in plan if FULL_SCAN_PATTERN.match(detail)
+                    or (TEMP_SORT_PATTERN.match(detail) and name not in TEMP_SORT_ALLOWED)]
+        results.append((name, plan, problems))
+    return results
+
+@bp.cli.command('check-query-plans')
+@click.option('--scale', default=2000, show_default=True, help='מספר המוצרים/הזמנות במסד הנתונים הזמני')
+def check_query_plans_command(scale):
+    """מריץ EXPLAIN QUERY PLAN על השאילתות החמות ונכשל אם אחת מהן סורקת טבלה שלמה או ממיינת בלי אינדקס."""
+    engine = db.create_engine('sqlite://')
+    failures = 0
+    with engine.connect() as conn:
+        db.metadata.create_all(conn)
+        seed_query_plan_database(conn, scale)
+        for name, plan, problems in explain_query_plans(conn):
+            status = 'FAIL' if problems else 'ok'
+            failures += bool(problems)
+            print(f"{status:4} {name}: {'; '.join(plan)}")
+    engine.dispose()
+    if failures:
+        print(f"{failures} שאילתות סורקות טבלה שלמה או ממיינות בלי אינדקס")
+        raise SystemExit(1)
+    print("כל השאילתות משתמשות באינדקסים")
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
+# רשימת הקבצים בתיקיות הסטטיות (static/images, static/uploads, thumbs) נשמרת בזיכרון,
+# כדי שבדיקות קיום בזמן רינדור לא יפנו לדיסק - על מערכת קבצים ברשת כל stat יקר.
+# כתיבות דרך האפליקציה מעדכנות את הרשימה מיד; שינויים מבחוץ (worker אחר, CLI, העתקה ידנית)
+# מתגלים לפי mtime של התיקייה, שנבדק לכל היותר פעם ב-STATIC_MANIFEST_CHECK_SECONDS
+class FileManifest:
+    def __init__(self):
+        self.check_interval = 0
+        self.lock = threading.Lock()
+        self.listings = {}  # תיקייה -> (mtime, שמות הקבצים, זמן הבדיקה האחרונה)
+
+    def init_app(self, app):
+        self.check_interval = app.config['STATIC_MANIFEST_CHECK_SECONDS']
+
+    def _scan(self, directory):
+        try:
+            return {entry.name for entry in os.scandir(directory) if entry.is_file()}
+        except FileNotFoundError:
+            return set()
+
+    def _listing(self, directory):
+        now = time.monotonic()
+        with self.lock:
+            cached = self.listings.get(directory)
+            if cached is not None and now - cached[2] < self.check_interval:
+                return cached[1]
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if cached is not None and cached[0] == mtime:
+                names = cached[1]
+            else:
+                names = self._scan(directory)
+            self.listings[directory] = (mtime, names, now)
+            return names
+
+    def exists(self, path):
+        directory, name = os.path.split(os.path.abspath(path))
+        return name in self._listing(directory)
+
+    def _update(self, path, present):
+        directory, name = os.path.split(os.path.abspath(path))
+        with self.lock:
+            cached = self.listings.get(directory)
+            if cached is None:
+                return
+            if present:
+                cached[1].add(name)
+            else:
+                cached[1].discard(name)
+
+    def add(self, path):
+        self._update(path, True)
+
+    def discard(self, path):
+        self._update(path, False)
+
+    def clear(self):
+        with self.lock:
+            self.listings.clear()
+
+static_files = FileManifest()
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-@app.route('/login', methods=['GET', 'POST'])
+# תמונות מוקטנות: לכל קובץ X בתיקיית ההעלאות נוצרים thumbs/X.jpg ו-thumbs/X.webp
+THUMBNAIL_FORMATS = [
+    ('jpg', {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True}),
+    ('webp', {'format': 'WEBP', 'quality': 80, 'method': 4}),
+]
+
+_thumbnail_pool = None
+
+def get_thumbnail_pool():
+    # נוצר בשימוש הראשון - כך שכל worker של gunicorn מקבל מאגר משלו אחרי ה-fork
+    global _thumbnail_pool
+    if _thumbnail_pool is None:
+        _thumbnail_pool = ThreadPoolExecutor(max_workers=current_app.config['THUMBNAIL_WORKERS'],
+                                             thread_name_prefix='thumbnails')
+    return _thumbnail_pool
+
+def thumbnail_path(filename, extension):
+    return os.path.join(current_app.config['THUMBNAIL_FOLDER'], f'{filename}.{extension}')
+
+def build_thumbnails(filename):
+    """יוצר את התמונות המוקטנות של קובץ שהועלה. הכתיבה אטומית, כך שתמונה חלקית לא מוגשת."""
+    os.makedirs(current_app.config['THUMBNAIL_FOLDER'], exist_ok=True)
+    size = current_app.config['THUMBNAIL_SIZE']
+    with Image.open(os.path.join(current_app.config['UPLOAD_FOLDER'], filename)) as source:
+        image = ImageOps.exif_transpose(source)  # תמונות טלפון שמורות לעיתים מסובבות
+        image.thumbnail((size, size))
+        if image.mode != 'RGB':
+            # שקיפות מוחלפת ברקע לבן
+            rgba = image.convert('RGBA')
+            image = Image.new('RGB', rgba.size, 'white')
+            image.paste(rgba, mask=rgba.getchannel('A'))
+        for extension, options in THUMBNAIL_FORMATS:
+            path = thumbnail_path(filename, extension)
+            image.save(path + '.tmp', **options)
+            os.replace(path + '.tmp', path)
+            static_files.add(path)
+
+def build_thumbnails_logged(app, filename):
+    with app.app_context():
+        try:
+            build_thumbnails(filename)
+        except Exception:
+            app.logger.exception('thumbnail failed', extra={'fields': {'image': filename}})
+
+def queue_thumbnails(filename):
+    """שולח יצירת תמונות מוקטנות לרקע. הבקשה לא ממתינה - עד שהן מוכנות מוצג המקור."""
+    if Image is None or not filename:
+        return None
+    return get_thumbnail_pool().submit(build_thumbnails_logged, current_app._get_current_object(), filename)
+
+def remove_upload(filename):
+    """מוחק קובץ שהועלה יחד עם התמונות המוקטנות שלו."""
+    paths = [os.path.join(current_app.config['UPLOAD_FOLDER'], filename)]
+    paths += [thumbnail_path(filename, extension) for extension, _ in THUMBNAIL_FORMATS]
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+        static_files.discard(path)
+
+# מאגר תמונות לפי תוכן: שם הקובץ הוא ה-sha256 שלו, כך שתמונה זהה נשמרת פעם אחת
+# והתוכן בכתובת נתונה לעולם לא משתנה
+CONTENT_ADDRESSED_NAME = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]+(\.(jpg|webp))?$')
+IMAGE_COLUMNS = (Product.image, ProductVariation.image, Category.image)
+RESERVED_UPLOADS = {'logo.png'}
+
+def is_content_addressed(filename):
+    return CONTENT_ADDRESSED_NAME.match(os.path.basename(filename)) is not None
+
+def store_upload(stream, original_name):
+    """שומר קובץ במאגר לפי ה-hash של התוכן ומחזיר את שמו. קובץ שכבר קיים לא נכתב שוב."""
+    extension = original_name.rsplit('.', 1)[1].lower()
+    if extension == 'jpeg':
+        extension = 'jpg'
+    temp_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f'.upload-{uuid.uuid4().hex}.tmp')
+    digest = hashlib.sha256()
+    try:
+        with open(temp_path, 'wb') as temp:
+            for chunk in iter(lambda: stream.read(64 * 1024), b''):
+                digest.update(chunk)
+                temp.write(chunk)
+        filename = f'{digest.hexdigest()}.{extension}'
+        path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+        if os.path.exists(path):
+            # הקובץ כבר במאגר - רענון זמן השינוי מגן עליו ממחיקה מקבילה (ראו release_uploads)
+            os.utime(path)
+            log_event(logging.DEBUG, 'upload deduplicated', image=filename)
+        else:
+            os.replace(temp_path, path)
+            static_files.add(path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    if not os.path.exists(thumbnail_path(filename, 'webp')):
+        queue_thumbnails(filename)
+    return filename
+
+def save_upload(file):
+    return store_upload(file.stream, file.filename)
+
+def image_reference_counts():
+    """מספר ההפניות לכל קובץ ממוצרים, וריאציות וקטגוריות."""
+    counts = {}
+    for column in IMAGE_COLUMNS:
+        rows = db.session.query(column, db.func.count()).filter(column.isnot(None)).group_by(column)
+        for filename, count in rows:
+            counts[filename] = counts.get(filename, 0) + count
+    return counts
+
+def image_in_use(filename):
+    return any(
+        db.session.query(column).filter(column == filename).first() is not None
+        for column in IMAGE_COLUMNS
+    )
+
+def upload_is_recent(filename):
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+    return os.path.exists(path) and time.time() - os.path.getmtime(path) < current_app.config['UPLOAD_GC_GRACE_SECONDS']
+
+def release_uploads(*filenames):
+    """נקרא אחרי commit שהסיר הפניות לתמונות - מוחק את אלו שאף שורה כבר לא מפנה אליהן.
+    קבצים שהועלו לאחרונה נשארים: ייתכן שבקשה אחרת שעוד לא ביצעה commit מפנה אליהם.
+    אותם ינקה gc-uploads."""
+    for filename in set(filter(None, filenames)):
+        if filename in RESERVED_UPLOADS or image_in_use(filename) or upload_is_recent(filename):
+            continue
+        try:
+            remove_upload(filename)
+            log_event(logging.INFO, 'upload released', image=filename)
+        except OSError:
+            current_app.logger.exception('upload release failed', extra={'fields': {'image': filename}})
+
+@bp.route('/uploads/<path:filename>')
+def uploaded_file(filename):
+    if not is_content_addressed(filename):
+        # שמות ישנים עלולים להחליף תוכן - הדפדפן מאמת מול השרת בכל טעינה
+        return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
+    response = send_from_directory(current_app.config['UPLOAD_FOLDER'], filename,
+                                   max_age=current_app.config['UPLOAD_CACHE_MAX_AGE'])
+    response.cache_control.immutable = True
+    return response
+
+def thumbnail_urls(filename):
+    """כתובות התמונה המוקטנת ({'src', 'webp'}), או של המקור אם היא עוד לא נוצרה."""
+    if not filename:
+        return {'src': None, 'webp': None}
+    if static_files.exists(thumbnail_path(filename, 'jpg')):
+        webp = None
+        if static_files.exists(thumbnail_path(filename, 'webp')):
+            webp = url_for('main.uploaded_file', filename=f'thumbs/{filename}.webp')
+        return {'src': url_for('main.uploaded_file', filename=f'thumbs/{filename}.jpg'), 'webp': webp}
+    if 'pending_thumbnails' in g:
+        g.pending_thumbnails.add(filename)  # עמוד קטלוג שנשמר במטמון ירונדר מחדש כשהיא תיווצר
+    return {'src': url_for('main.uploaded_file', filename=filename), 'webp': None}
+
+@bp.cli.command('rehash-uploads')
+def rehash_uploads_command():
+    """ממיר תמונות בשמות ישנים (לפי זמן או שם מקורי) לשמות לפי תוכן, ומאחד כפילויות."""
+    renamed = {}
+    for filename in sorted(image_reference_counts()):
+        path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+        if is_content_addressed(filename) or not os.path.exists(path) or '.' not in filename:
+            continue
+        with open(path, 'rb') as source:
+            renamed[filename] = store_upload(source, filename)
+    for old, new in renamed.items():
+        for column in IMAGE_COLUMNS:
+            db.session.query(column.class_).filter(column == old).update({column: new}, synchronize_session=False)
+    bump_catalog_version()
+    db.session.commit()
+    for old in renamed:
+        remove_upload(old)
+    print(f"הומרו {len(renamed)} קבצים ל-{len(set(renamed.values()))} קבצים לפי תוכן")
+
+@bp.cli.command('gc-uploads')
+@click.option('--dry-run', is_flag=True, help='הצגת הקבצים שיימחקו בלי למחוק')
+def gc_uploads_command(dry_run):
+    """מוחק תמונות ותמונות מוקטנות שאף מוצר, וריאציה או קטגוריה לא מפנים אליהן."""
+    referenced = image_reference_counts()
+    folder = current_app.config['UPLOAD_FOLDER']
+    grace = current_app.config['UPLOAD_GC_GRACE_SECONDS']
+    now = time.time()
+    orphans = []
+    for entry in os.scandir(folder):
+        if not entry.is_file() or entry.name in RESERVED_UPLOADS or entry.name in referenced:
+            continue
+        if now - entry.stat().st_mtime >= grace:
+            orphans.append(entry.path)
+    if os.path.isdir(current_app.config['THUMBNAIL_FOLDER']):
+        for entry in os.scandir(current_app.config['THUMBNAIL_FOLDER']):
+            source = entry.name.rsplit('.', 1)[0]
+            if entry.is_file() and source not in referenced and now - entry.stat().st_mtime >= grace:
+                orphans.append(entry.path)
+    freed = sum(os.path.getsize(path) for path in orphans)
+    if not dry_run:
+        for path in orphans:
+            os.remove(path)
+            static_files.discard(path)
+    action = 'יימחקו' if dry_run else 'נמחקו'
+    print(f"{action} {len(orphans)} קבצים ({freed / 1024:.0f} KB). בשימוש: {len(referenced)} קבצים, "
+          f"{sum(referenced.values())} הפניות")
+    for path in orphans if dry_run else []:
+        print(f"  {path}")
+
+@bp.cli.command('build-thumbnails')
+@click.option('--force', is_flag=True, help='יצירה מחדש גם לתמונות שכבר יש להן תמונה מוקטנת')
+def build_thumbnails_command(force):
+    """יוצר תמונות מוקטנות לכל התמונות של מוצרים, וריאציות וקטגוריות."""
+    if Image is None:
+        print("Pillow אינו מותקן - לא ניתן ליצור תמונות מוקטנות")
+        return
+    pending = [
+        filename for filename in sorted(image_reference_counts())
+        if os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], filename))
+        and (force or not os.path.exists(thumbnail_path(filename, 'webp')))
+    ]
+    wait([queue_thumbnails(filename) for filename in pending])
+    print(f"נוצרו תמונות מוקטנות ל-{len(pending)} קבצים")
+
+# עימוד לפי מפתח (keyset) - הסמן מקודד את ערכי המיון של השורה האחרונה בעמוד
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, columns):
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(values, list) or len(values) != len(columns):
+        return None
+    # המרת תאריכים חזרה מ-ISO
+    for i, column in enumerate(columns):
+        if isinstance(column.type, db.DateTime) and values[i] is not None:
+            try:
+                values[i] = datetime.fromisoformat(values[i])
+            except (TypeError, ValueError):
+                return None
+    return values
+
+def keyset_query(query, columns, cursor=None, page_size=50, descending=False):
+    """השאילתה של עמוד אחד: התנאי שאחרי הסמן, המיון ו-LIMIT של page_size + 1."""
+    values = decode_cursor(cursor, columns)
+    if values is not None:
+        # (a, b) > (x, y)  =>  a > x OR (a = x AND b > y)
+        conditions = []
+        for i, column in enumerate(columns):
+            equal_prefix = [columns[j] == values[j] for j in range(i)]
+            step = column < values[i] if descending else column > values[i]
+            conditions.append(and_(*equal_prefix, step))
+        query = query.filter(or_(*conditions))
+
+    order = [c.desc() if descending else c.asc() for c in columns]
+    return query.order_by(*order).limit(page_size + 1)
+
+def keyset_page(query, columns, cursor=None, page_size=50, descending=False):
+    """מחזיר (פריטים, סמן לעמוד הבא) עבור שאילתה ממוינת לפי columns.
+
+    העמודה האחרונה ב-columns חייבת להיות ייחודית (בדרך כלל id) כדי שהסדר יהיה חד משמעי.
+    """
+    rows = keyset_query(query, columns, cursor, page_size, descending).all()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, c.key) for c in columns])
+    return rows, next_cursor
+
+def get_cart(create=False):
+    """מחזיר את הסל של הסשן הנוכחי (או None), ויוצר אחד חדש אם create=True."""
+    # סלים ישנים שנשמרו כולם בעוגיה - לא נשמרים יותר
+    session.pop('cart', None)
+    
+    cart = None
+    if 'cart_id' in session:
+        cart = db.session.get(Cart, session['cart_id'])
+    if cart is None and create:
+        cart = Cart(user_id=session.get('user_id'))
+        db.session.add(cart)
+        db.session.flush()
+        session['cart_id'] = cart.id
+    return cart
+
+def get_cart_item(cart, product_id, variation_id):
+    return CartItem.query.filter_by(
+        cart_id=cart.id,
+        product_id=product_id,
+        variation_id=variation_id
+    ).first()
+
+def clear_session_cart():
+    cart = get_cart()
+    if cart:
+        CartItem.query.filter_by(cart_id=cart.id).delete()
+        cart.updated_at = datetime.utcnow()
+        db.session.commit()
+
+def price_cart(cart):
+    """מחשב את שורות הסל וסיכומיו.
+
+    כל המוצרים והווריאציות נטענים בשאילתת IN אחת לכל סוג, כך שמספר השאילתות
+    קבוע ללא תלות במספר השורות בסל.
+    """
+    priced = {'items': [], 'total_without_vat': 0, 'total_with_vat': 0}
+    if cart is None:
+        return priced
+    
+    lines = CartItem.query.filter_by(cart_id=cart.id).order_by(CartItem.id).all()
+    product_ids = {line.product_id for line in lines}
+    variation_ids = {line.variation_id for line in lines if line.variation_id}
+    
+    products = {}
+    if product_ids:
+        products = {p.id: p for p in Product.query.filter(Product.id.in_(product_ids))}
+    variations = {}
+    if variation_ids:
+        variations = {v.id: v for v in ProductVariation.query.filter(ProductVariation.id.in_(variation_ids))}
+    
+    for line in lines:
+        product = products.get(line.product_id)
+        if not product:
+            # המוצר נמחק מאז שנוסף לסל
+            continue
+        
+        quantity = line.quantity
+        line_total_without_vat = line.price_without_vat * quantity
+        line_total_with_vat = line.price_with_vat * quantity
+        
+        priced['total_without_vat'] += line_total_without_vat
+        priced['total_with_vat'] += line_total_with_vat
+        priced['items'].append({
+            'product': product,
+            'variation': variations.get(line.variation_id),
+            'quantity': quantity,
+            'price_with_vat': line.price_with_vat,
+            'price_without_vat': line.price_without_vat,
+            'total_without_vat': line_total_without_vat,
+            'total_with_vat': line_total_with_vat
+        })
+    return priced
+
+def parse_variation_id(data):
+    variation_id = (data or {}).get('variation_id')
+    return int(variation_id) if variation_id else None
+
+def get_page_size(default_key, max_key):
+    try:
+        page_size = int(request.args.get('per_page', current_app.config[default_key]))
+    except ValueError:
+        page_size = current_app.config[default_key]
+    return max(1, min(page_size, current_app.config[max_key]))
+
+# מטמון עמודי קטלוג: התוכן המרונדר של products/categories/category_products נשמר לפי
+# (עמוד, גרסת הקטלוג, פרמטרי הבקשה). בזיכרון - LRU חסום; אם הוגדר CATALOG_CACHE_DIR
+# גם על הדיסק, כך ש-worker אחד מרנדר וכולם משתמשים. גרסה חדשה הופכת את כל הרשומות הישנות ללא רלוונטיות.
+# על הדיסק נשמרות עד CATALOG_CACHE_DISK_ENTRIES רשומות - הישנות ביותר (לפי mtime, שמתעדכן בכל קריאה) נמחקות
+class FragmentCache:
+    TEMP_FILE_MAX_AGE = 300  # שניות - קובץ זמני ישן מזה שייך לכתיבה שלא הסתיימה
+
+    def __init__(self):
+        self.max_entries = 0
+        self.max_disk_entries = 0
+        self.directory = None
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.max_entries = app.config['CATALOG_CACHE_SIZE']
+        self.max_disk_entries = app.config['CATALOG_CACHE_DISK_ENTRIES']
+        self.directory = app.config['CATALOG_CACHE_DIR']
+
+    def _disk_path(self, version, key):
+        digest = hashlib.sha1(json.dumps(key, ensure_ascii=False).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f'{version}-{digest}.json')
+
+    def _disk_entries(self):
+        """(גרסה, רשומה) לכל עמוד גמור בתיקיית המטמון. קבצים זמניים נמחקים רק כשהם ישנים -
+        ייתכן ש-worker אחר עוד כותב אליהם ויעשה להם os.replace בכל רגע."""
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return []
+        versioned = []
+        stale_before = time.time() - self.TEMP_FILE_MAX_AGE
+        for entry in entries:
+            if entry.name.endswith('.tmp'):
+                try:
+                    if entry.stat().st_mtime < stale_before:
+                        self._remove(entry.path)  # כתיבה שנקטעה (worker שנפל באמצע)
+                except OSError:
+                    pass
+                continue
+            prefix = entry.name.split('-', 1)[0]
+            if prefix.isdigit() and entry.name.endswith('.json'):
+                versioned.append((int(prefix), entry))
+        return versioned
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # worker אחר כבר מחק
+
+    def _switch_version(self, version):
+        # נקרא עם ה-lock. רשומות של גרסה קודמת לעולם לא ייקראו שוב. worker שעוד רואה
+        # גרסה ישנה (קרא אותה לפני ה-commit של השינוי) לא מוחק את הרשומות של הגרסה החדשה
+        if self.version is not None and version <= self.version:
+            return
+        self.version = version
+        self.entries.clear()
+        if self.directory:
+            for entry_version, entry in self._disk_entries():
+                if entry_version < version:
+                    self._remove(entry.path)
+
+    def _trim_disk(self):
+        entries = self._disk_entries()
+        if len(entries) <= self.max_disk_entries:
+            return
+        by_age = []
+        for _, entry in entries:
+            try:
+                by_age.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                pass
+        by_age.sort()
+        for _, path in by_age[:len(by_age) - self.max_disk_entries]:
+            self._remove(path)
+
+    def get(self, version, key):
+        with self.lock:
+            self._switch_version(version)
+            value = self.entries.get(key) if version == self.version else None
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+        if self.directory:
+            path = self._disk_path(version, key)
+            try:
+                with open(path, encoding='utf-8') as cached:
+                    value = json.load(cached)
+                os.utime(path)  # סדר ה-LRU על הדיסק
+            except (OSError, ValueError):
+                value = None
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(version, key, value)
+        return value
+
+    def _store(self, version, key, value):
+        if version != self.version:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def set(self, version, key, value):
+        with self.lock:
+            self._switch_version(version)
+            self._store(version, key, value)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._disk_path(version, key)
+            temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as cached:
+                json.dump(value, cached, ensure_ascii=False)
+            os.replace(temp_path, path)
+            self._trim_disk()
+
+catalog_cache = FragmentCache()
+
+def catalog_version():
+    return db.session.execute(
+        db.select(CacheVersion.version).where(CacheVersion.name == 'catalog')
+    ).scalar() or 0
+
+def bump_catalog_version(connection=None):
+    """מעלה את גרסת הקטלוג. נקרא לפני ה-commit של כל שינוי במוצרים, וריאציות או קטגוריות,
+    כך שהגרסה החדשה נראית יחד עם השינוי עצמו."""
+    executor = connection if connection is not None else db.session
+    bind = connection if connection is not None else db.session.get_bind()
+    if bind.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    statement = insert(CacheVersion).values(name='catalog', version=1)
+    statement = statement.on_conflict_do_update(
+        index_elements=['name'],
+        set_={'version': CacheVersion.version + 1}
+    ).returning(CacheVersion.version)
+    version = executor.execute(statement).scalar()
+    if connection is None:
+        # אינדקס החיפוש מחיל את השינויים של ה-session רק אם הם הגרסה הבאה אחרי זו שהוא מכיר
+        db.session.info['catalog_version'] = version
+    return version
+
+def render_catalog_page(template, key, build):
+    """מרנדר עמוד קטלוג. build() מחזיר את משתני העמוד (כולל catalog_html) ונקרא רק כשאין
+    עותק שמור לגרסה הנוכחית של הקטלוג, או כשנוצרה תמונה מוקטנת לתמונה שהעותק הציג במקור
+    (יצירת תמונות מוקטנות לא מעלה את גרסת הקטלוג). המסגרת (base.html) מרונדרת בכל בקשה."""
+    version = catalog_version()
+    page = catalog_cache.get(version, key)
+    if page is None or thumbnails_ready(page.get('pending_thumbnails', ())):
+        g.pending_thumbnails = set()
+        page = build()
+        page['pending_thumbnails'] = sorted(g.pop('pending_thumbnails'))
+        catalog_cache.set(version, key, page)
+    return render_template(template, **page)
+
+def thumbnails_ready(filenames):
+    """האם נוצרה תמונה מוקטנת לאחת התמונות שהעמוד השמור הציג במקור."""
+    return any(static_files.exists(thumbnail_path(filename, 'jpg')) for filename in filenames)
+
+# ETag לנקודות הקצה של JSON: נגזר מגרסאות השורות שבתשובה, כך שאפשר להחזיר 304
+# בלי לבנות את ה-JSON. הדפדפן שומר את התשובה ושולח If-None-Match לבד בכל fetch.
+# table - הטבלה שהשורות שייכות לה (גם כשהן לא אובייקטי מודל, כמו SearchHit)
+def rows_etag(table, rows, *extra):
+    parts = [(row.id, row.version) for row in rows]
+    return hashlib.sha1(json.dumps([table, parts, extra], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def conditional_json(etag, build):
+    """304 אם ללקוח כבר יש את הגרסה הזו, אחרת ה-JSON ש-build() מחזיר - בשני המקרים עם ETag."""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    # private + no-cache: הדפדפן שומר, אבל מאמת מול השרת בכל שימוש
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def content_etag_json(payload):
+    """לתשובות שאינן נבנות משורות עם גרסה (דוחות) - ETag לפי התוכן."""
+    response = jsonify(payload)
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def parse_id_list(name):
+    """רשימת מזהים מפרמטר כמו ids=1,2,3 (בסדר המקורי, בלי כפילויות), או None אם היא לא תקינה."""
+    try:
+        ids = [int(value) for value in request.args.get(name, '').split(',') if value.strip()]
+    except ValueError:
+        return None
+    return list(dict.fromkeys(ids))
+
+def get_batch_ids(*names):
+    """(שם הפרמטר, מזהים, תשובת שגיאה) לבקשת batch - הפרמטר הראשון מ-names שנשלח."""
+    for name in names:
+        if request.args.get(name):
+            ids = parse_id_list(name)
+            if ids is None:
+                return name, None, jsonify({'success': False, 'message': 'רשימת מזהים לא תקינה'})
+            if len(ids) > current_app.config['BATCH_MAX_IDS']:
+                return name, None, jsonify({'success': False, 'message': f"ניתן לבקש עד {current_app.config['BATCH_MAX_IDS']} מזהים"})
+            return name, ids, None
+    return None, None, jsonify({'success': False, 'message': 'לא נבחרו מזהים'})
+
+def in_requested_order(rows, ids, key=lambda row: row.id):
+    position = {row_id: index for index, row_id in enumerate(ids)}
+    return sorted(rows, key=lambda row: position[key(row)])
+
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
@@ -130,72 +1543,369 @@ def login():
             return render_template('login.html')
         
         session['user_id'] = user.id
-        return redirect(url_for('products'))
+        return redirect(url_for('main.products'))
     
     return render_template('login.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     session.pop('user_id', None)
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
-@app.route('/')
-@app.route('/products')
+def product_listing(search_query, category_filter, sort_by, use_index=None):
+    """(שאילתה, עמודות מיון, descending) של רשימת המוצרים - ל-keyset_page, ול-check-query-plans."""
+    # שליפת המוצרים עם פילטרים - קטגוריה ווריאציות נטענות מראש במספר קבוע של שאילתות
+    products_query = Product.query.options(
+        joinedload(Product.category),
+        selectinload(Product.variations)
+    )
+    
+    if search_query:
+        products_query = products_query.filter(search_products_filter(search_query, use_index))
+    
+    if category_filter:
+        products_query = products_query.filter(Product.category_id == category_filter)
+    
+    # מיון - תמיד עם id בסוף כדי שהעימוד יהיה יציב
+    if sort_by == 'price_asc':
+        return products_query, [Product.price_with_vat, Product.id], False
+    if sort_by == 'price_desc':
+        return products_query, [Product.price_with_vat, Product.id], True
+    return products_query, [Product.name, Product.id], False  # sort_by == 'name'
+
+@bp.route('/')
+@bp.route('/products')
 def products():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     # קבלת פרמטרים לחיפוש וסינון
     search_query = request.args.get('search', '')
     category_filter = request.args.get('category', '')
     sort_by = request.args.get('sort', 'name')
     
-    # שליפת המוצרים עם פילטרים
-    products_query = Product.query
+    cursor = request.args.get('cursor', '')
+    page_size = get_page_size('CATALOG_PAGE_SIZE', 'CATALOG_MAX_PAGE_SIZE')
     
-    if search_query:
-        products_query = products_query.filter(Product.name.ilike(f'%{search_query}%'))
+    def build():
+        products_query, columns, descending = product_listing(search_query, category_filter, sort_by)
+        products, next_cursor = keyset_page(products_query, columns, cursor, page_size, descending)
+        categories = Category.query.all()
+        
+        return {'catalog_html': render_template('catalog/products.html', 
+                                                products=products, 
+                                                categories=categories,
+                                                search_query=search_query,
+                                                category_filter=category_filter,
+                                                sort_by=sort_by,
+                                                cursor=cursor,
+                                                next_cursor=next_cursor,
+                                                page_size=page_size)}
+    
+    key = ('products', search_query, category_filter, sort_by, cursor, page_size, request.args.get('per_page'))
+    return render_catalog_page('products.html', key, build)
+
+# מע"מ ושינויי מחירים מרוכזים
+def vat_rate(connection=None):
+    """שיעור המע"מ שבתוקף עכשיו, באחוזים."""
+    statement = (
+        db.select(VatRate.rate)
+        .where(VatRate.effective_from <= datetime.utcnow())
+        .order_by(VatRate.effective_from.desc())
+        .limit(1)
+    )
+    rate = (connection if connection is not None else db.session).execute(statement).scalar()
+    return current_app.config['VAT_RATE'] if rate is None else rate
+
+def vat_factor(connection=None):
+    return 1 + vat_rate(connection) / 100
+
+REPRICE_ADJUSTMENTS = ('percent', 'amount')
+REPRICE_BASES = ('with_vat', 'without_vat')
+
+def parse_vat_rate(value):
+    """(שיעור מע"מ באחוזים, None) או (None, הודעת שגיאה). משותף ל-/vat-rates ול-flask set-vat-rate."""
+    try:
+        rate = float(value)
+    except (TypeError, ValueError):
+        return None, 'שיעור מע"מ לא תקין'
+    if not 0 <= rate < 100:
+        return None, 'שיעור המע"מ חייב להיות בין 0 ל-100'
+    return rate, None
+
+def parse_reprice_request(data):
+    """(הגדרת השינוי, None) או (None, הודעת שגיאה).
+
+    adjustment: percent (אחוז שינוי) או amount (סכום להוספה, שלילי להורדה), value: הערך,
+    basis: המחיר שעליו חל השינוי - with_vat (ואז המחיר ללא מע"מ מחושב ממנו) או without_vat.
+    היקף: category_id, product_ids ו-q (כמו החיפוש בקטלוג); בלי אף אחד מהם - כל הקטלוג.
+    value=0 רק מחשב מחדש את המחיר השני לפי שיעור המע"מ שבתוקף.
+    """
+    adjustment = data.get('adjustment', 'percent')
+    basis = data.get('basis', 'with_vat')
+    if adjustment not in REPRICE_ADJUSTMENTS:
+        return None, 'סוג שינוי לא תקין (percent או amount)'
+    if basis not in REPRICE_BASES:
+        return None, 'בסיס מחיר לא תקין (with_vat או without_vat)'
+    try:
+        value = float(data.get('value'))
+        category_id = int(data['category_id']) if data.get('category_id') not in (None, '') else None
+        product_ids = list(dict.fromkeys(int(product_id) for product_id in data.get('product_ids') or []))
+    except (TypeError, ValueError):
+        return None, 'ערך מספרי לא תקין'
+    if adjustment == 'percent' and value <= -100:
+        return None, 'אחוז השינוי חייב להיות גדול מ-100-'
+    include_variations = data.get('include_variations', True)
+    if not isinstance(include_variations, bool):
+        # bool('false') הוא True - מקבלים רק true/false של JSON
+        return None, 'include_variations חייב להיות true או false'
+    return {
+        'adjustment': adjustment,
+        'value': value,
+        'basis': basis,
+        'category_id': category_id,
+        'product_ids': product_ids,
+        'query': (data.get('q') or '').strip() or None,
+        'include_variations': include_variations,
+    }, None
+
+def reprice_targets(spec):
+    """(שם, מודל, תנאי ההיקף) לכל טבלה שהשינוי חל עליה. וריאציות נבחרות לפי המוצר שלהן."""
+    conditions = []
+    if spec['category_id'] is not None:
+        conditions.append(Product.category_id == spec['category_id'])
+    if spec['product_ids']:
+        conditions.append(Product.id.in_(spec['product_ids']))
+    if spec['query']:
+        conditions.append(search_products_filter(spec['query']))
+    targets = [('products', Product, conditions)]
+    if spec['include_variations']:
+        scope = [ProductVariation.product_id.in_(db.select(Product.id).where(*conditions))] if conditions else []
+        targets.append(('variations', ProductVariation, scope))
+    return targets
+
+def repriced_columns(model, spec, factor):
+    """המחירים החדשים (כולל מע"מ, ללא מע"מ) כביטויי SQL על המחירים הנוכחיים של כל שורה."""
+    base = model.price_with_vat if spec['basis'] == 'with_vat' else model.price_without_vat
+    if spec['adjustment'] == 'percent':
+        adjusted = base * (1 + spec['value'] / 100)
+    else:
+        adjusted = base + spec['value']
+    # המחיר שהוזן (הבסיס) מעוגל לאגורות, השני מחושב ממנו - כמו בהוספה ועריכה של מוצר
+    adjusted = db.func.round(adjusted, 2)
+    if spec['basis'] == 'with_vat':
+        return adjusted, adjusted / factor
+    return adjusted * factor, adjusted
+
+def preview_reprice(spec, factor, sample_size=0):
+    """לכל טבלה: מספר השורות בהיקף, כמה מהן יגיעו למחיר 0 או שלילי, ועד sample_size שורות לדוגמה."""
+    preview = {}
+    for name, model, conditions in reprice_targets(spec):
+        new_with, new_without = repriced_columns(model, spec, factor)
+        count, invalid = db.session.execute(
+            db.select(db.func.count(), db.func.coalesce(db.func.sum(db.case((new_with <= 0, 1), else_=0)), 0))
+            .select_from(model)
+            .where(*conditions)
+        ).one()
+        sample = []
+        if sample_size:
+            rows = db.session.execute(
+                db.select(model.id, model.name, model.price_with_vat, model.price_without_vat, new_with, new_without)
+                .where(*conditions)
+                .order_by(model.id)
+                .limit(sample_size)
+            )
+            sample = [{
+                'id': row[0],
+                'name': row[1],
+                'price_with_vat': row[2],
+                'price_without_vat': row[3],
+                'new_price_with_vat': row[4],
+                'new_price_without_vat': row[5],
+            } for row in rows]
+        preview[name] = {'count': count, 'invalid': invalid, 'sample': sample}
+    return preview
+
+def apply_reprice(spec, factor, user_id=None):
+    """מחיל את השינוי - לכל טבלה INSERT ... SELECT אחד להיסטוריה ו-UPDATE אחד למחירים,
+    בלי לטעון שורות ל-ORM. ה-commit על הקורא."""
+    change = PriceChange(user_id=user_id, details=json.dumps(spec, ensure_ascii=False))
+    db.session.add(change)
+    db.session.flush()
+    for name, model, conditions in reprice_targets(spec):
+        new_with, new_without = repriced_columns(model, spec, factor)
+        if model is Product:
+            keys = [Product.id, db.null()]
+        else:
+            keys = [ProductVariation.product_id, ProductVariation.id]
+        db.session.execute(db.insert(PriceHistory).from_select(
+            ['change_id', 'product_id', 'variation_id', 'price_with_vat', 'price_without_vat'],
+            db.select(db.literal(change.id), *keys, model.price_with_vat, model.price_without_vat).where(*conditions)
+        ))
+        updated = db.session.execute(
+            db.update(model).where(*conditions).values(price_with_vat=new_with, price_without_vat=new_without),
+            execution_options={'synchronize_session': False}
+        ).rowcount
+        setattr(change, name, updated)
+    bump_catalog_version()
+    return change
+
+def reprice_rejection(preview):
+    """הודעת שגיאה אם אי אפשר להחיל את השינוי, אחרת None."""
+    invalid = sum(target['invalid'] for target in preview.values())
+    if invalid:
+        return f'השינוי יוריד {invalid} מחירים ל-0 או פחות - לא בוצע שינוי'
+    if not preview['products']['count']:
+        return 'לא נמצאו מוצרים לעדכון'
+    return None
+
+@bp.route('/reprice', methods=['POST'])
+def reprice():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'נדרשת התחברות'})
     
-    if category_filter:
-        products_query = products_query.filter(Product.category_id == category_filter)
+    data = request.get_json(silent=True) or {}
+    spec, error = parse_reprice_request(data)
+    if error is not None:
+        return jsonify({'success': False, 'message': error}), 400
+    
+    dry_run = bool(data.get('dry_run'))
+    factor = vat_factor()
+    preview = preview_reprice(spec, factor, current_app.config['REPRICE_PREVIEW_ROWS'] if dry_run else 0)
+    error = reprice_rejection(preview)
+    if dry_run:
+        # תצוגה מקדימה - אותם ביטויים כמו בעדכון עצמו, בלי לכתוב דבר
+        return jsonify({'success': error is None, 'dry_run': True, 'message': error, 'vat_rate': vat_rate(), **preview})
+    if error is not None:
+        return jsonify({'success': False, 'message': error})
     
-    # מיון
-    if sort_by == 'price_asc':
-        products_query = products_query.order_by(Product.price_with_vat.asc())
-    elif sort_by == 'price_desc':
-        products_query = products_query.order_by(Product.price_with_vat.desc())
-    else:  # sort_by == 'name'
-        products_query = products_query.order_by(Product.name.asc())
-    
-    products = products_query.all()
-    categories = Category.query.all()
-    
-    return render_template('products.html', 
-                         products=products, 
-                         categories=categories,
-                         search_query=search_query,
-                         category_filter=category_filter,
-                         sort_by=sort_by)
-
-@app.route('/add-product', methods=['POST'])
+    try:
+        change = apply_reprice(spec, factor, session['user_id'])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'אירעה שגיאה בעדכון המחירים: {str(e)}'})
+    
+    return jsonify({
+        'success': True,
+        'dry_run': False,
+        'change_id': change.id,
+        'products': change.products,
+        'variations': change.variations,
+        'message': f'עודכנו מחירים של {change.products} מוצרים ו-{change.variations} וריאציות'
+    })
+
+@bp.route('/price-history/<int:product_id>')
+def price_history(product_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'נדרשת התחברות'})
+    
+    # כל שורה היא המחיר שהיה בתוקף עד השינוי (replaced_at); המחיר הנוכחי נמצא במוצר עצמו
+    rows = db.session.execute(
+        db.select(PriceHistory, PriceChange.effective_at)
+        .join(PriceChange, PriceHistory.change_id == PriceChange.id)
+        .where(PriceHistory.product_id == product_id)
+        .order_by(PriceHistory.change_id.desc(), PriceHistory.variation_id)
+    ).all()
+    return jsonify([{
+        'change_id': entry.change_id,
+        'variation_id': entry.variation_id,
+        'price_with_vat': entry.price_with_vat,
+        'price_without_vat': entry.price_without_vat,
+        'replaced_at': effective_at.isoformat(),
+    } for entry, effective_at in rows])
+
+@bp.route('/vat-rates', methods=['GET', 'POST'])
+def vat_rates():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'נדרשת התחברות'})
+    
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        rate, error = parse_vat_rate(data.get('rate'))
+        if error is not None:
+            return jsonify({'success': False, 'message': error}), 400
+        try:
+            effective_from = datetime.strptime(data['effective_from'], '%Y-%m-%d') if data.get('effective_from') else datetime.utcnow()
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'תאריך לא תקין'}), 400
+        # מחירים קיימים לא משתנים מעצמם - לעדכון שלהם /reprice עם value=0
+        db.session.add(VatRate(rate=rate, effective_from=effective_from))
+        db.session.commit()
+    
+    rates = VatRate.query.order_by(VatRate.effective_from.desc()).all()
+    return jsonify({
+        'success': True,
+        'current': vat_rate(),
+        'rates': [{'id': r.id, 'rate': r.rate, 'effective_from': r.effective_from.isoformat()} for r in rates]
+    })
+
+@bp.cli.command('set-vat-rate')
+@click.argument('rate', type=float)
+@click.option('--from', 'effective_from', type=click.DateTime(formats=['%Y-%m-%d']), help='תאריך תחילה (ברירת מחדל: עכשיו)')
+def set_vat_rate_command(rate, effective_from):
+    """מוסיף שיעור מע"מ (באחוזים). מחירים קיימים לא משתנים - לעדכון שלהם flask reprice --percent 0."""
+    rate, error = parse_vat_rate(rate)
+    if error is not None:
+        raise click.BadParameter(error, param_hint='RATE')
+    db.session.add(VatRate(rate=rate, effective_from=effective_from or datetime.utcnow()))
+    db.session.commit()
+    print(f"שיעור המע\"מ שבתוקף: {vat_rate()}%")
+
+@bp.cli.command('reprice')
+@click.option('--percent', type=float, help='שינוי באחוזים')
+@click.option('--amount', type=float, help='סכום להוספה (שלילי להורדה)')
+@click.option('--basis', type=click.Choice(REPRICE_BASES), default='with_vat', show_default=True,
+              help='המחיר שעליו חל השינוי; השני מחושב לפי המע"מ שבתוקף')
+@click.option('--category', 'category_id', type=int, help='רק מוצרים בקטגוריה')
+@click.option('--query', help='רק מוצרים שתואמים לחיפוש')
+@click.option('--no-variations', is_flag=True, help='בלי לשנות מחירי וריאציות')
+@click.option('--dry-run', is_flag=True, help='הצגת השינוי בלי לבצע אותו')
+def reprice_command(percent, amount, basis, category_id, query, no_variations, dry_run):
+    """משנה מחירים של מוצרים ווריאציות ב-UPDATE אחד לכל טבלה ורושם היסטוריית מחירים."""
+    if (percent is None) == (amount is None):
+        raise click.UsageError('יש לציין --percent או --amount')
+    spec, error = parse_reprice_request({
+        'adjustment': 'percent' if percent is not None else 'amount',
+        'value': percent if percent is not None else amount,
+        'basis': basis,
+        'category_id': category_id,
+        'q': query,
+        'include_variations': not no_variations,
+    })
+    if error is not None:
+        raise click.UsageError(error)
+    factor = vat_factor()
+    preview = preview_reprice(spec, factor, current_app.config['REPRICE_PREVIEW_ROWS'] if dry_run else 0)
+    for name, target in preview.items():
+        print(f"{name}: {target['count']} שורות")
+        for row in target['sample']:
+            print(f"  {row['id']:>8} {row['name']}: {row['price_with_vat']:.2f} -> {row['new_price_with_vat']:.2f}")
+    error = reprice_rejection(preview)
+    if error is not None:
+        print(error)
+        raise SystemExit(1)
+    if dry_run:
+        return
+    change = apply_reprice(spec, factor)
+    db.session.commit()
+    print(f"שינוי {change.id}: עודכנו {change.products} מוצרים ו-{change.variations} וריאציות")
+
+@bp.route('/add-product', methods=['POST'])
 def add_product():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     name = request.form['name']
     price_with_vat = float(request.form['price_with_vat'])
-    price_without_vat = price_with_vat / 1.18  # חישוב מחיר ללא מע"מ
+    price_without_vat = price_with_vat / vat_factor()  # חישוב מחיר ללא מע"מ
     category_id = int(request.form['category_id'])
     
     image_filename = None
     if 'image' in request.files:
         file = request.files['image']
         if file and allowed_file(file.filename):
-            # יצירת שם קובץ ייחודי עם חותמת זמן ומזהה מוצר
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"product_{timestamp}_{secure_filename(file.filename)}"
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            image_filename = filename
+            image_filename = save_upload(file)
 
     product = Product(
         name=name,
@@ -206,18 +1916,19 @@ def add_product():
     )
     
     db.session.add(product)
+    bump_catalog_version()
     db.session.commit()
     
-    return redirect(url_for('products'))
+    return redirect(url_for('main.products'))
 
-@app.route('/add-to-cart/<int:product_id>', methods=['POST'])
+@bp.route('/add-to-cart/<int:product_id>', methods=['POST'])
 def add_to_cart(product_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
     
     data = request.get_json()
     quantity = int(data.get('quantity', 1))
-    variation_id = data.get('variation_id')
+    variation_id = parse_variation_id(data)
     price_with_vat = data.get('price_with_vat')
     price_without_vat = data.get('price_without_vat')
     
@@ -230,125 +1941,101 @@ def add_to_cart(product_id):
     if product.variations and not variation_id:
         return jsonify({'success': False, 'message': 'נא לבחור וריאציה'})
     
-    if 'cart' not in session:
-        session['cart'] = []
+    cart = get_cart(create=True)
     
-    cart_item = {
-        'product_id': product_id,
-        'quantity': quantity,
-        'variation_id': variation_id,
-        'price_with_vat': price_with_vat if variation_id else product.price_with_vat,
-        'price_without_vat': price_without_vat if variation_id else product.price_without_vat
-    }
-    
-    cart = session['cart']
-    # מוסיף את המוצר לסל מספר פעמים לפי הכמות שנבחרה
-    for _ in range(quantity):
-        cart.append(cart_item)
+    # שורה אחת לכל צירוף מוצר+וריאציה, הכמות מצטברת
+    cart_item = get_cart_item(cart, product_id, variation_id)
+    if cart_item:
+        cart_item.quantity += quantity
+    else:
+        cart_item = CartItem(
+            cart_id=cart.id,
+            product_id=product_id,
+            variation_id=variation_id,
+            quantity=quantity,
+            price_with_vat=price_with_vat if variation_id else product.price_with_vat,
+            price_without_vat=price_without_vat if variation_id else product.price_without_vat
+        )
+        db.session.add(cart_item)
     
-    session['cart'] = cart
+    cart.updated_at = datetime.utcnow()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # בקשה מקבילה לאותו סל הוסיפה את השורה בינתיים - מוסיפים לכמות שלה
+        db.session.rollback()
+        cart = get_cart()
+        get_cart_item(cart, product_id, variation_id).quantity += quantity
+        cart.updated_at = datetime.utcnow()
+        db.session.commit()
     
     return jsonify({
         'success': True, 
         'message': f'{quantity} יחידות נוספו להזמנה בהצלחה'
     })
 
-@app.route('/categories')
+@bp.route('/categories')
 def categories():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
-    categories = Category.query.all()
-    return render_template('categories.html', categories=categories)
+        return redirect(url_for('main.login'))
+    
+    def build():
+        categories = Category.query.all()
+        return {'catalog_html': render_template('catalog/categories.html', categories=categories)}
+    
+    return render_catalog_page('categories.html', ('categories',), build)
 
-@app.route('/add-category', methods=['POST'])
+@bp.route('/add-category', methods=['POST'])
 def add_category():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     name = request.form['name']
     
     # וודא שתיקיית ההעלאות קיימת
-    if not os.path.exists(app.config['UPLOAD_FOLDER']):
-        os.makedirs(app.config['UPLOAD_FOLDER'])
+    if not os.path.exists(current_app.config['UPLOAD_FOLDER']):
+        os.makedirs(current_app.config['UPLOAD_FOLDER'])
     
     image_filename = None
     if 'image' in request.files:
         file = request.files['image']
         if file and allowed_file(file.filename):
-            # יצירת שם קובץ ייחודי עם חותמת זמן
-            filename = f"category_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{secure_filename(file.filename)}"
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            image_filename = filename
+            image_filename = save_upload(file)
 
     try:
         category = Category(name=name, image=image_filename)
         db.session.add(category)
+        bump_catalog_version()
         db.session.commit()
         flash('הקטגוריה נוצרה בהצלחה', 'success')
     except Exception as e:
         flash('אירעה שגיאה ביצירת הקטגוריה', 'error')
-        return redirect(url_for('categories'))
+        return redirect(url_for('main.categories'))
     
-    return redirect(url_for('categories'))
+    return redirect(url_for('main.categories'))
 
-@app.route('/category/<int:category_id>')
+@bp.route('/category/<int:category_id>')
 def category_products(category_id):
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
-    category = Category.query.get_or_404(category_id)
-    return render_template('category_products.html', category=category)
+    
+    def build():
+        category = Category.query.get_or_404(category_id)
+        return {'catalog_html': render_template('catalog/category_products.html', category=category),
+                'category_name': category.name}
+    
+    return render_catalog_page('category_products.html', ('category_products', category_id), build)
 
-@app.route('/cart')
+@bp.route('/cart')
 def cart():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    if 'cart' not in session:
-        session['cart'] = []
-    
-    cart_items = []
-    total_without_vat = 0
-    total_with_vat = 0
-    
-    # מקבץ פריטים זהים בסל
-    cart_items_dict = {}
-    for item in session['cart']:
-        key = (item['product_id'], item.get('variation_id'))
-        if key not in cart_items_dict:
-            cart_items_dict[key] = {
-                'product_id': item['product_id'],
-                'variation_id': item.get('variation_id'),
-                'quantity': 0,
-                'price_with_vat': item['price_with_vat'],
-                'price_without_vat': item['price_without_vat']
-            }
-        cart_items_dict[key]['quantity'] += 1
-    
-    # יצירת רשימת פריטים עם מחירים נכונים
-    for key, item_data in cart_items_dict.items():
-        product = Product.query.get(item_data['product_id'])
-        if product:
-            variation = None
-            if item_data['variation_id']:
-                variation = ProductVariation.query.get(item_data['variation_id'])
-            
-            quantity = item_data['quantity']
-            price_with_vat = item_data['price_with_vat']
-            price_without_vat = item_data['price_without_vat']
-            
-            total_without_vat += price_without_vat * quantity
-            total_with_vat += price_with_vat * quantity
-            
-            cart_items.append({
-                'product': product,
-                'variation': variation,
-                'quantity': quantity,
-                'price_with_vat': price_with_vat,
-                'price_without_vat': price_without_vat,
-                'total_without_vat': price_without_vat * quantity,
-                'total_with_vat': price_with_vat * quantity
-            })
+        return redirect(url_for('main.login'))
+    
+    priced = price_cart(get_cart())
+    cart_items = priced['items']
+    total_without_vat = priced['total_without_vat']
+    total_with_vat = priced['total_with_vat']
     
     customers = Customer.query.order_by(Customer.name).all()
     return render_template('cart.html', 
@@ -357,165 +2044,363 @@ def cart():
                          total_with_vat=total_with_vat,
                          customers=customers)
 
-@app.route('/update-cart/<int:product_id>', methods=['POST'])
+@bp.route('/update-cart/<int:product_id>', methods=['POST'])
 def update_cart(product_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
     
     data = request.get_json()
     quantity = int(data['quantity'])
+    variation_id = parse_variation_id(data)
     
-    cart = []
-    for _ in range(quantity):
-        cart.append(product_id)
+    if quantity < 1:
+        return jsonify({'success': False, 'message': 'כמות חייבת להיות לפחות 1'})
     
-    session['cart'] = cart
+    cart = get_cart()
+    cart_item = get_cart_item(cart, product_id, variation_id) if cart else None
+    if not cart_item:
+        return jsonify({'success': False, 'message': 'המוצר לא נמצא בסל'})
+    
+    cart_item.quantity = quantity
+    cart.updated_at = datetime.utcnow()
+    db.session.commit()
     return jsonify({'success': True, 'message': 'הכמות עודכנה בהצלחה'})
 
-@app.route('/remove-from-cart/<int:product_id>', methods=['POST'])
+@bp.route('/remove-from-cart/<int:product_id>', methods=['POST'])
 def remove_from_cart(product_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
     
-    cart = session['cart']
-    cart = [p for p in cart if p != product_id]
-    session['cart'] = cart
+    variation_id = parse_variation_id(request.get_json(silent=True))
+    
+    cart = get_cart()
+    cart_item = get_cart_item(cart, product_id, variation_id) if cart else None
+    if cart_item:
+        db.session.delete(cart_item)
+        cart.updated_at = datetime.utcnow()
+        db.session.commit()
     
     return jsonify({'success': True, 'message': 'המוצר הוסר בהצלחה'})
 
-@app.route('/clear-cart', methods=['POST'])
+@bp.route('/clear-cart', methods=['POST'])
 def clear_cart():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
     
-    session['cart'] = []
+    clear_session_cart()
     return jsonify({'success': True, 'message': 'סל ההזמנות נוקה בהצלחה'})
 
-@app.route('/export-pdf')
-def export_pdf():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
+# מטמונים ברמת התהליך עבור יצירת PDF - נשמרים בין בקשות
+PDF_TEXT_CACHE_SIZE = 4096
+_pdf_font_cache = {}
+_pdf_image_cache = {}
+
+def new_pdf():
+    """FPDF חדש עם פונט DejaVu רשום. מדדי הפונט נטענים פעם אחת לכל תהליך."""
+    from fpdf import FPDF
+    pdf = FPDF()
+    font_path = os.path.join(current_app.root_path, 'fonts', 'DejaVuSansCondensed.ttf')
+    
+    if font_path not in _pdf_font_cache:
+        pdf.add_font('DejaVu', '', font_path, uni=True)
+        font = dict(pdf.fonts['dejavu'])
+        # קובץ ה-pkl של fpdf שומר נתיב מוחלט מהמחשב שבו נוצר
+        font['ttffile'] = font_path
+        font_files = {name: dict(info) for name, info in pdf.font_files.items()}
+        font_files['dejavu']['ttffile'] = font_path
+        _pdf_font_cache[font_path] = (font, font_files)
+        pdf.fonts.clear()
+        pdf.font_files.clear()
+    
+    font, font_files = _pdf_font_cache[font_path]
+    # subset ו-n משתנים בזמן כתיבת המסמך, לכן כל PDF מקבל עותק משלו
+    pdf.fonts['dejavu'] = dict(font, i=len(pdf.fonts) + 1, subset=list(font['subset']))
+    pdf.font_files.update({name: dict(info) for name, info in font_files.items()})
+    return pdf
+
+def add_pdf_image(pdf, path, **kwargs):
+    """כמו pdf.image, אבל התמונה מפוענחת פעם אחת לכל תהליך (עד שהקובץ משתנה)."""
+    key = (path, os.path.getmtime(path))
+    info = _pdf_image_cache.get(key)
+    if info is not None:
+        # fpdf מוחק את 'data' מהרשומה בזמן הפלט, לכן מעבירים עותק
+        pdf.images[path] = dict(info, i=len(pdf.images) + 1)
+    pdf.image(path, **kwargs)
+    if info is None:
+        _pdf_image_cache.clear()
+        _pdf_image_cache[key] = dict(pdf.images[path])
+
+@lru_cache(maxsize=PDF_TEXT_CACHE_SIZE)
+def shape_text(text):
+    """עיצוב טקסט עברי/ערבי להצגה ב-PDF (reshape + bidi), עם מטמון LRU."""
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+    return get_display(arabic_reshaper.reshape(text))
+
+# (מודל, עמודת המפתח) לכל טבלת סיכום
+SALES_ROLLUPS = [
+    (DailyProductSales, 'product_id'),
+    (DailyCategorySales, 'category_id'),
+    (DailyCustomerSales, 'customer_id'),
+]
+
+def add_to_rollup(model, key, rows):
+    """מוסיף את הערכים ב-rows לשורות הסיכום (INSERT ... ON CONFLICT DO UPDATE), בפקודה אחת."""
+    if not rows:
+        return
+    if db.session.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    statement = insert(model)
+    values = [column for column in rows[0] if column not in ('day', key)]
+    statement = statement.on_conflict_do_update(
+        index_elements=['day', key],
+        set_={column: getattr(model, column) + statement.excluded[column] for column in values}
+    )
+    db.session.execute(statement, rows)
+
+def update_sales_rollups(order, items, sign=1):
+    """מעדכן את סיכומי המכירות של יום ההזמנה. sign=-1 מבטל הזמנה שנמחקה.
+
+    הקטגוריה נלקחת מהמוצר כפי שהוא עכשיו - אם מוצר עבר קטגוריה, rebuild-sales-rollups מיישר את ההיסטוריה.
+    """
+    day = (order.date or datetime.utcnow()).date()
+    categories = dict(db.session.query(Product.id, Product.category_id)
+                      .filter(Product.id.in_({item.product_id for item in items})))
+    
+    totals = {model: {} for model, _ in SALES_ROLLUPS}
+    for item in items:
+        units = sign * item.quantity
+        without_vat = sign * item.price_without_vat * item.quantity
+        with_vat = sign * item.price_with_vat * item.quantity
+        keys = [(DailyProductSales, item.product_id), (DailyCategorySales, categories.get(item.product_id)),
+                (DailyCustomerSales, order.customer_id)]
+        for model, key_value in keys:
+            if key_value is None:
+                continue
+            entry = totals[model].setdefault(key_value, {'units': 0, 'revenue_without_vat': 0.0, 'revenue_with_vat': 0.0})
+            entry['units'] += units
+            entry['revenue_without_vat'] += without_vat
+            entry['revenue_with_vat'] += with_vat
+    
+    for model, key in SALES_ROLLUPS:
+        rows = [dict(entry, day=day, **{key: key_value}) for key_value, entry in totals[model].items()]
+        if model is DailyCustomerSales:
+            for row in rows:
+                row['orders'] = sign
+        add_to_rollup(model, key, rows)
+        if sign < 0:
+            # שורות שהתאפסו אחרי מחיקה
+            model.query.filter(model.day == day, model.units <= 0).delete(synchronize_session=False)
+
+def rebuild_sales_rollups():
+    """בונה מחדש את כל סיכומי המכירות מההזמנות, בשאילתת INSERT ... SELECT אחת לכל טבלה."""
+    day = db.func.date(Order.date)
+    units = db.func.sum(OrderItem.quantity)
+    without_vat = db.func.sum(OrderItem.price_without_vat * OrderItem.quantity)
+    with_vat = db.func.sum(OrderItem.price_with_vat * OrderItem.quantity)
+    sources = {
+        DailyProductSales: db.select(day, OrderItem.product_id, units, without_vat, with_vat)
+            .join(Order, OrderItem.order_id == Order.id)
+            .group_by(day, OrderItem.product_id),
+        DailyCategorySales: db.select(day, Product.category_id, units, without_vat, with_vat)
+            .join(Order, OrderItem.order_id == Order.id)
+            .join(Product, OrderItem.product_id == Product.id)
+            .group_by(day, Product.category_id),
+        DailyCustomerSales: db.select(day, Order.customer_id, db.func.count(db.distinct(Order.id)), units, without_vat, with_vat)
+            .join(Order, OrderItem.order_id == Order.id)
+            .where(Order.customer_id.isnot(None))
+            .group_by(day, Order.customer_id),
+    }
+    for model, key in SALES_ROLLUPS:
+        db.session.execute(db.delete(model))
+        columns = ['day', key] + (['orders'] if model is DailyCustomerSales else []) + ['units', 'revenue_without_vat', 'revenue_with_vat']
+        db.session.execute(db.insert(model).from_select(columns, sources[model]))
+    db.session.commit()
+
+@bp.cli.command('rebuild-sales-rollups')
+def rebuild_sales_rollups_command():
+    """בונה מחדש את סיכומי המכירות היומיים מכל ההזמנות."""
+    rebuild_sales_rollups()
+    print(f"סיכומי המכירות נבנו מחדש: {DailyProductSales.query.count()} שורות מוצר-יום")
+
+def save_new_order(customer, cart_items, total_without_vat, total_with_vat):
+    order = Order(
+        customer_id=customer.id,
+        total_without_vat=total_without_vat,
+        total_with_vat=total_with_vat
+    )
+    db.session.add(order)
     
-    export_type = request.args.get('type', 'warehouse')
-    order_id = request.args.get('order_id')  # מזהה הזמנה קיימת
-    is_warehouse = export_type == 'warehouse'
+    for item in cart_items:
+        order_item = OrderItem(
+            order=order,
+            product_id=item['product'].id,
+            quantity=item['quantity'],
+            price_without_vat=item['total_without_vat'] / item['quantity'],
+            price_with_vat=item['total_with_vat'] / item['quantity'],
+            product_name=item['product'].name + (f" ({item['variation'].name})" if item.get('variation') else "")
+        )
+        db.session.add(order_item)
     
-    if order_id:
-        # מייצא הזמנה קיימת
-        order = Order.query.get_or_404(order_id)
-        customer = order.customer
-        cart_items = []
-        
-        for item in order.items:
-            cart_items.append({
-                'product': Product(name=item.product_name),
-                'quantity': item.quantity,
-                'total_without_vat': item.price_without_vat * item.quantity,
-                'total_with_vat': item.price_with_vat * item.quantity
-            })
-        
-        total_without_vat = order.total_without_vat
-        total_with_vat = order.total_with_vat
-        
-        # אין צורך לשמור את ההזמנה כי היא כבר קיימת
-        save_order = False
-    else:
-        # יצירת הזמנה חדשה
-        customer_id = request.args.get('customer_id')
-        if not customer_id:
-            return jsonify({'success': False, 'message': 'לא נבחר לקוח'})
-        
-        customer = Customer.query.get_or_404(customer_id)
-        
-        if 'cart' not in session:
-            session['cart'] = []
-        
-        cart_items = []
-        total_without_vat = 0
-        total_with_vat = 0
-        
-        # מקבץ פריטים זהים בסל
-        cart_items_dict = {}
-        for item in session['cart']:
-            key = (item['product_id'], item.get('variation_id'))
-            if key not in cart_items_dict:
-                cart_items_dict[key] = {
-                    'product_id': item['product_id'],
-                    'variation_id': item.get('variation_id'),
-                    'quantity': 0,
-                    'price_with_vat': item['price_with_vat'],
-                    'price_without_vat': item['price_without_vat']
-                }
-            cart_items_dict[key]['quantity'] += 1
-        
-        # יצירת רשימת פריטים עם מחירים נכונים
-        for key, item_data in cart_items_dict.items():
-            product = Product.query.get(item_data['product_id'])
-            if product:
-                variation = None
-                if item_data['variation_id']:
-                    variation = ProductVariation.query.get(item_data['variation_id'])
-                
-                quantity = item_data['quantity']
-                price_with_vat = item_data['price_with_vat']
-                price_without_vat = item_data['price_without_vat']
-                
-                total_without_vat += price_without_vat * quantity
-                total_with_vat += price_with_vat * quantity
-                
-                cart_items.append({
-                    'product': product,
-                    'variation': variation,
-                    'quantity': quantity,
-                    'total_without_vat': price_without_vat * quantity,
-                    'total_with_vat': price_with_vat * quantity
-                })
-        
-        # צריך לשמור הזמנה חדשה
-        save_order = True
+    # הסיכומים מתעדכנים באותה טרנזקציה של ההזמנה
+    db.session.flush()
+    update_sales_rollups(order, order.items)
+    db.session.commit()
+    return order
+
+# תור משימות PDF - הרינדור רץ במאגר תהליכים מקומי, והתוצאה נשמרת כקובץ
+# כך שכל worker יכול להחזיר סטטוס והורדה למשימה שנשלחה מ-worker אחר
+_pdf_pool = None
+_pdf_pending = {}  # job_id -> Future של משימות שנשלחו מהתהליך הזה
+_pdf_worker_app = None  # האפליקציה בתוך תהליך הרינדור
+
+def init_pdf_worker(config):
+    global _pdf_worker_app
+    _pdf_worker_app = create_app(config)
+
+def in_pdf_worker(function, *args):
+    """רץ בתהליך הרינדור - כל משימה שנשלחת למאגר עוברת כאן כדי לקבל app context."""
+    with _pdf_worker_app.app_context():
+        return function(*args)
+
+def get_pdf_pool():
+    global _pdf_pool
+    if _pdf_pool is None:
+        _pdf_pool = ProcessPoolExecutor(max_workers=current_app.config['PDF_JOB_WORKERS'],
+                                        initializer=init_pdf_worker, initargs=(dict(current_app.config),))
+    return _pdf_pool
+
+def reset_pdf_pool(pool):
+    """משחרר מאגר שקרס (למשל תהליך שנהרג), כך שהקריאה הבאה תיצור מאגר חדש."""
+    global _pdf_pool
+    pool.shutdown(wait=False, cancel_futures=True)
+    if _pdf_pool is pool:
+        _pdf_pool = None
+
+def submit_to_pdf_pool(function, *args):
+    pool = get_pdf_pool()
+    try:
+        return pool.submit(in_pdf_worker, function, *args)
+    except BrokenProcessPool:
+        current_app.logger.warning('PDF pool broken, starting a new one')
+        reset_pdf_pool(pool)
+        return get_pdf_pool().submit(in_pdf_worker, function, *args)
+
+def pdf_pool_result(future, function, *args):
+    """תוצאת המשימה; אם המאגר קרס בזמן הרינדור מנסים פעם אחת נוספת במאגר חדש."""
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        return submit_to_pdf_pool(function, *args).result()
+
+def pdf_job_path(job_id, suffix):
+    return os.path.join(current_app.config['PDF_JOB_FOLDER'], f'{job_id}{suffix}')
+
+def pdf_job_slot_available():
+    for job_id, future in list(_pdf_pending.items()):
+        if future.done():
+            del _pdf_pending[job_id]
+    return len(_pdf_pending) < current_app.config['PDF_JOB_MAX_PENDING']
+
+def purge_expired_pdf_jobs():
+    folder = current_app.config['PDF_JOB_FOLDER']
+    if not os.path.isdir(folder):
+        return
+    cutoff = time.time() - current_app.config['PDF_JOB_TTL']
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def run_pdf_job(pdf_path, order_data, is_warehouse):
+    """רץ בתהליך נפרד - כותב את ה-PDF (או הודעת שגיאה) לקובץ."""
+    try:
+        pdf_output = render_order_pdf(order_data, is_warehouse)
+    except Exception as e:
+        with open(pdf_path + '.error', 'w', encoding='utf-8') as f:
+            f.write(str(e))
+        return
+    # כתיבה אטומית כדי שהורדה לא תקבל קובץ חלקי
+    with open(pdf_path + '.tmp', 'wb') as f:
+        f.write(pdf_output)
+    os.replace(pdf_path + '.tmp', pdf_path)
+
+def submit_pdf_job(order_data, is_warehouse, filename):
+    purge_expired_pdf_jobs()
+    os.makedirs(current_app.config['PDF_JOB_FOLDER'], exist_ok=True)
     
-    # יצירת PDF
-    pdf = FPDF()
-    pdf.add_page()
+    job_id = uuid.uuid4().hex
+    with open(pdf_job_path(job_id, '.json'), 'w', encoding='utf-8') as f:
+        json.dump({'filename': filename, 'created': time.time()}, f)
     
-    # הגדרת פונט
-    font_path = os.path.join(app.root_path, 'fonts', 'DejaVuSansCondensed.ttf')
-    pdf.add_font('DejaVu', '', font_path, uni=True)
+    _pdf_pending[job_id] = submit_to_pdf_pool(
+        run_pdf_job, pdf_job_path(job_id, '.pdf'), order_data, is_warehouse
+    )
+    return job_id
+
+def get_pdf_job(job_id):
+    """מחזיר (סטטוס, פרטי המשימה) או (None, None) אם המשימה לא קיימת או פגה."""
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return None, None
+    try:
+        with open(pdf_job_path(job_id, '.json'), encoding='utf-8') as f:
+            job = json.load(f)
+    except (OSError, ValueError):
+        return None, None
+    if time.time() - job['created'] > current_app.config['PDF_JOB_TTL']:
+        return None, None
+    if os.path.exists(pdf_job_path(job_id, '.pdf')):
+        return 'done', job
+    if os.path.exists(pdf_job_path(job_id, '.pdf.error')):
+        with open(pdf_job_path(job_id, '.pdf.error'), encoding='utf-8') as f:
+            job['error'] = f.read()
+        return 'failed', job
+    return 'pending', job
+
+def draw_order(pdf, order_data, is_warehouse):
+    """מצייר הזמנה אחת על עמוד חדש ב-pdf.
+
+    order_data הוא מילון פשוט (ללא אובייקטי ORM) כדי שאפשר יהיה להעביר אותו לתהליך אחר:
+    customer (name/address/phone), lines (name/quantity/total_without_vat/total_with_vat),
+    total_without_vat ו-total_with_vat.
+    """
+    customer = order_data['customer']
+    pdf.add_page()
     pdf.set_font('DejaVu', '', 12)
     
     # לוגו בצד ימין
     try:
-        # בדיקה בתיקיית static/images
-        logo_path = os.path.join(app.root_path, 'static', 'images', 'logo.png')
-        if not os.path.exists(logo_path):
-            # בדיקה בתיקיית uploads
-            logo_path = os.path.join(app.root_path, app.config['UPLOAD_FOLDER'], 'logo.png')
-        
-        if os.path.exists(logo_path):
-            pdf.image(logo_path, x=10, y=10, w=50)
+        logo_path = find_logo_path()
+        if logo_path:
+            add_pdf_image(pdf, logo_path, x=10, y=10, w=50)
         else:
-            print(f"קובץ הלוגו לא נמצא בנתיבים: {os.path.join(app.root_path, 'static', 'images', 'logo.png')} או {os.path.join(app.root_path, app.config['UPLOAD_FOLDER'], 'logo.png')}")
+            current_app.logger.warning(f"קובץ הלוגו לא נמצא בנתיבים: {' או '.join(logo_candidates())}")
     except Exception as e:
-        print(f"שגיאה בטעינת הלוגו: {e}")
+        current_app.logger.error(f"שגיאה בטעינת הלוגו: {e}")
     
     # תאריך בצד שמאל עליון
     pdf.set_xy(150, 10)
     current_date = datetime.now().strftime('%d/%m/%Y')
-    pdf.cell(50, 10, get_display(arabic_reshaper.reshape(f'תאריך: {current_date}')), align='L')
+    pdf.cell(50, 10, shape_text(f'תאריך: {current_date}'), align='L')
     
     # פרטי לקוח מתחת ללוגו
     pdf.set_xy(10, 40)
     pdf.set_font('DejaVu', '', 14)
-    pdf.cell(0, 10, get_display(arabic_reshaper.reshape(f'לכבוד: {customer.name}')), ln=True, align='R')
-    if customer.address:
-        pdf.cell(0, 10, get_display(arabic_reshaper.reshape(f'כתובת: {customer.address}')), ln=True, align='R')
-    if customer.phone:
-        pdf.cell(0, 10, get_display(arabic_reshaper.reshape(f'טלפון: {customer.phone}')), ln=True, align='R')
+    pdf.cell(0, 10, shape_text(f'לכבוד: {customer["name"]}'), ln=True, align='R')
+    if customer.get('address'):
+        pdf.cell(0, 10, shape_text(f'כתובת: {customer["address"]}'), ln=True, align='R')
+    if customer.get('phone'):
+        pdf.cell(0, 10, shape_text(f'טלפון: {customer["phone"]}'), ln=True, align='R')
     pdf.ln(10)
     
     # כותרת הזמנה
     pdf.set_font('DejaVu', '', 16)
-    pdf.cell(0, 10, get_display(arabic_reshaper.reshape('הזמנה')), ln=True, align='C')
+    pdf.cell(0, 10, shape_text('הזמנה'), ln=True, align='C')
     pdf.ln(10)
     
     # טבלת מוצרים
@@ -543,7 +2428,7 @@ def export_pdf():
     current_x = x_start
     for header, width in zip(headers, col_widths):
         pdf.set_x(current_x)
-        pdf.cell(width, 8, get_display(arabic_reshaper.reshape(header)), border=1, align='C', fill=True)
+        pdf.cell(width, 8, shape_text(header), border=1, align='C', fill=True)
         current_x += width
     pdf.ln()
 
@@ -552,24 +2437,20 @@ def export_pdf():
         current_x = x_start
         for subheader, width in zip(subheaders, col_widths):
             pdf.set_x(current_x)
-            pdf.cell(width, 8, get_display(arabic_reshaper.reshape(subheader)), border=1, align='C', fill=True)
+            pdf.cell(width, 8, shape_text(subheader), border=1, align='C', fill=True)
             current_x += width
         pdf.ln()
 
     # תוכן הטבלה
-    for item in cart_items:
+    for item in order_data['lines']:
         current_x = x_start
         
         if is_warehouse:
             price_per_unit_without_vat = item['total_without_vat'] / item['quantity']
             price_per_unit_with_vat = item['total_with_vat'] / item['quantity']
             
-            product_name = item['product'].name
-            if item.get('variation'):
-                product_name += f" ({item['variation'].name})"
-            
             cells = [
-                product_name,
+                item['name'],
                 str(item['quantity']),
                 f"₪{price_per_unit_without_vat:.2f}",
                 f"₪{price_per_unit_with_vat:.2f}",
@@ -577,74 +2458,296 @@ def export_pdf():
             ]
         else:
             # גרסת לקוח - רק שם מוצר וכמות
-            product_name = item['product'].name
-            if item.get('variation'):
-                product_name += f" ({item['variation'].name})"
-            
             cells = [
-                product_name,
+                item['name'],
                 str(item['quantity'])
             ]
         
         # הדפסת תאים בשורה
         for cell, width in zip(cells, col_widths):
             pdf.set_x(current_x)
-            pdf.cell(width, 10, get_display(arabic_reshaper.reshape(cell)), border=1, align='C')
+            pdf.cell(width, 10, shape_text(cell), border=1, align='C')
             current_x += width
         pdf.ln()
     
     # סיכום - רק בגרסת מחסן
     if is_warehouse:
+        total_without_vat = order_data['total_without_vat']
+        total_with_vat = order_data['total_with_vat']
         pdf.ln(10)
         pdf.set_x(120)
-        pdf.cell(40, 10, get_display(arabic_reshaper.reshape('סה"כ ללא מע"מ:')), align='R')
-        pdf.cell(30, 10, get_display(arabic_reshaper.reshape(f'₪{total_without_vat:.2f}')), align='L')
+        pdf.cell(40, 10, shape_text('סה"כ ללא מע"מ:'), align='R')
+        pdf.cell(30, 10, shape_text(f'₪{total_without_vat:.2f}'), align='L')
         pdf.ln()
         
         pdf.set_x(120)
-        pdf.cell(40, 10, get_display(arabic_reshaper.reshape('מע"מ:')), align='R')
-        pdf.cell(30, 10, get_display(arabic_reshaper.reshape(f'₪{(total_with_vat - total_without_vat):.2f}')), align='L')
+        pdf.cell(40, 10, shape_text('מע"מ:'), align='R')
+        pdf.cell(30, 10, shape_text(f'₪{(total_with_vat - total_without_vat):.2f}'), align='L')
         pdf.ln()
         
         pdf.set_x(120)
         pdf.set_font('DejaVu', '', 14)
-        pdf.cell(40, 10, get_display(arabic_reshaper.reshape('סה"כ כולל מע"מ:')), align='R')
-        pdf.cell(30, 10, get_display(arabic_reshaper.reshape(f'₪{total_with_vat:.2f}')), align='L')
+        pdf.cell(40, 10, shape_text('סה"כ כולל מע"מ:'), align='R')
+        pdf.cell(30, 10, shape_text(f'₪{total_with_vat:.2f}'), align='L')
+
+def render_order_pdf(order_data, is_warehouse):
+    """מחזיר את קובץ ה-PDF של הזמנה כ-bytes."""
+    pdf = new_pdf()
+    draw_order(pdf, order_data, is_warehouse)
+    return pdf.output(dest='S').encode('latin-1')
+
+def order_pdf_data(customer, cart_items, total_without_vat, total_with_vat):
+    lines = []
+    for item in cart_items:
+        name = item['product'].name
+        if item.get('variation'):
+            name += f" ({item['variation'].name})"
+        lines.append({
+            'name': name,
+            'quantity': item['quantity'],
+            'total_without_vat': item['total_without_vat'],
+            'total_with_vat': item['total_with_vat']
+        })
+    return {
+        'customer': {'name': customer.name, 'address': customer.address, 'phone': customer.phone},
+        'lines': lines,
+        'total_without_vat': total_without_vat,
+        'total_with_vat': total_with_vat
+    }
+
+def saved_order_pdf_data(order):
+    """נתוני PDF של הזמנה שמורה (השמות והמחירים כפי שנשמרו בזמן ההזמנה)."""
+    customer = order.customer
+    return {
+        'customer': {'name': customer.name, 'address': customer.address, 'phone': customer.phone},
+        'lines': [{
+            'name': item.product_name,
+            'quantity': item.quantity,
+            'total_without_vat': item.price_without_vat * item.quantity,
+            'total_with_vat': item.price_with_vat * item.quantity
+        } for item in order.items],
+        'total_without_vat': order.total_without_vat,
+        'total_with_vat': order.total_with_vat
+    }
+
+def render_orders_pdf(orders_data, is_warehouse):
+    """PDF אחד עם עמוד (או יותר) לכל הזמנה."""
+    pdf = new_pdf()
+    for order_data in orders_data:
+        draw_order(pdf, order_data, is_warehouse)
+    return pdf.output(dest='S').encode('latin-1')
+
+class ZipStream:
+    """יעד כתיבה ל-zipfile שמאפשר להזרים ארכיון תוך כדי יצירתו.
+
+    zipfile תומך ביעד שאינו seekable, ולכן מה שנכתב אפשר לשלוח ללקוח מיד
+    ולשחרר מהזיכרון.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def parse_date_arg(name):
+    value = request.args.get(name, '').strip()
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return None
+
+def iter_order_chunks(order_ids):
+    """טוען הזמנות בקבוצות, עם הפריטים והלקוחות בשאילתות מרוכזות."""
+    chunk_size = current_app.config['ORDER_EXPORT_CHUNK_SIZE']
+    for start in range(0, len(order_ids), chunk_size):
+        chunk = order_ids[start:start + chunk_size]
+        orders = (Order.query
+                  .options(selectinload(Order.items), joinedload(Order.customer))
+                  .filter(Order.id.in_(chunk))
+                  .all())
+        by_id = {order.id: order for order in orders}
+        yield [by_id[order_id] for order_id in chunk if order_id in by_id]
+        db.session.expunge_all()
+
+@bp.route('/export-orders-pdf')
+def export_orders_pdf():
+    if 'user_id' not in session:
+        return redirect(url_for('main.login'))
+    
+    is_warehouse = request.args.get('type', 'warehouse') == 'warehouse'
+    output_format = request.args.get('format', 'pdf')
+    
+    # בחירת הזמנות לפי רשימת מזהים או טווח תאריכים
+    ids_query = db.session.query(Order.id)
+    order_ids_arg = request.args.get('order_ids', '').strip()
+    date_from = parse_date_arg('date_from')
+    date_to = parse_date_arg('date_to')
+    if order_ids_arg:
+        try:
+            order_ids = [int(order_id) for order_id in order_ids_arg.split(',') if order_id.strip()]
+        except ValueError:
+            return jsonify({'success': False, 'message': 'רשימת הזמנות לא תקינה'})
+        ids_query = ids_query.filter(Order.id.in_(order_ids))
+    elif date_from or date_to:
+        if date_from:
+            ids_query = ids_query.filter(Order.date >= date_from)
+        if date_to:
+            ids_query = ids_query.filter(Order.date < date_to + timedelta(days=1))
+    else:
+        return jsonify({'success': False, 'message': 'יש לבחור הזמנות או טווח תאריכים'})
+    
+    order_ids = [row[0] for row in ids_query.order_by(Order.date, Order.id)]
+    if not order_ids:
+        return jsonify({'success': False, 'message': 'לא נמצאו הזמנות'})
+    
+    export_name = f"orders_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    
+    if output_format == 'zip':
+        def generate():
+            stream = ZipStream()
+            # קבצי PDF כבר דחוסים - אין טעם לדחוס שוב
+            with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as zipf:
+                for orders in iter_order_chunks(order_ids):
+                    orders_data = [saved_order_pdf_data(order) for order in orders]
+                    # רינדור במקביל במאגר התהליכים, הכתיבה לארכיון לפי הסדר
+                    futures = [submit_to_pdf_pool(render_order_pdf, data, is_warehouse) for data in orders_data]
+                    for order, data, future in zip(orders, orders_data, futures):
+                        pdf_output = pdf_pool_result(future, render_order_pdf, data, is_warehouse)
+                        zipf.writestr(f'order_{order.id}.pdf', pdf_output)
+                        yield stream.drain()
+            yield stream.drain()
+        
+        response = Response(stream_with_context(generate()), mimetype='application/zip')
+        response.headers['Content-Disposition'] = f'attachment; filename={export_name}.zip'
+        return response
+    
+    # מסמך אחד - fpdf בונה את כל המסמך בזיכרון (אין כתיבה הדרגתית), לכן הרינדור נעשה בתהליך נפרד
+    # ומספר ההזמנות מוגבל; טווחים גדולים יותר מייצאים כ-ZIP, שמוזרם הזמנה אחרי הזמנה
+    max_orders = current_app.config['ORDER_EXPORT_PDF_MAX_ORDERS']
+    if len(order_ids) > max_orders:
+        return jsonify({
+            'success': False,
+            'message': f'נבחרו {len(order_ids)} הזמנות - קובץ PDF אחד מוגבל ל-{max_orders}. '
+                       f'לטווח גדול יותר יש לייצא קובץ לכל הזמנה (format=zip)'
+        }), 400
+    orders_data = []
+    for orders in iter_order_chunks(order_ids):
+        orders_data.extend(saved_order_pdf_data(order) for order in orders)
+    future = submit_to_pdf_pool(render_orders_pdf, orders_data, is_warehouse)
+    pdf_output = pdf_pool_result(future, render_orders_pdf, orders_data, is_warehouse)
+    
+    response = make_response(pdf_output)
+    response.headers['Content-Type'] = 'application/pdf'
+    response.headers['Content-Disposition'] = f'attachment; filename={export_name}.pdf'
+    return response
+
+@bp.route('/export-pdf')
+def export_pdf():
+    if 'user_id' not in session:
+        return redirect(url_for('main.login'))
+    
+    export_type = request.args.get('type', 'warehouse')
+    order_id = request.args.get('order_id')  # מזהה הזמנה קיימת
+    is_warehouse = export_type == 'warehouse'
+    
+    if order_id:
+        # מייצא הזמנה קיימת
+        order = Order.query.get_or_404(order_id)
+        order_data = saved_order_pdf_data(order)
+        
+        # אין צורך לשמור את ההזמנה כי היא כבר קיימת
+        save_order = False
+    else:
+        # יצירת הזמנה חדשה
+        customer_id = request.args.get('customer_id')
+        if not customer_id:
+            return jsonify({'success': False, 'message': 'לא נבחר לקוח'})
+        
+        customer = Customer.query.get_or_404(customer_id)
+        
+        priced = price_cart(get_cart())
+        cart_items = priced['items']
+        total_without_vat = priced['total_without_vat']
+        total_with_vat = priced['total_with_vat']
+        order_data = order_pdf_data(customer, cart_items, total_without_vat, total_with_vat)
+        
+        # צריך לשמור הזמנה חדשה
+        save_order = True
+    
+    filename = 'warehouse_order.pdf' if is_warehouse else 'customer_order.pdf'
+    
+    if request.args.get('async') == '1':
+        # מצב אסינכרוני - שומרים את ההזמנה עכשיו ומחזירים מזהה משימה
+        if not pdf_job_slot_available():
+            return jsonify({'success': False, 'message': 'יותר מדי קבצי PDF בהכנה, נסה שוב בעוד רגע'}), 503
+        if save_order:
+            save_new_order(customer, cart_items, total_without_vat, total_with_vat)
+        job_id = submit_pdf_job(order_data, is_warehouse, filename)
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status_url': url_for('main.pdf_job_status', job_id=job_id),
+            'download_url': url_for('main.pdf_job_download', job_id=job_id)
+        }), 202
     
     # שמירה והחזרה
-    pdf_output = pdf.output(dest='S').encode('latin-1')
+    pdf_output = render_order_pdf(order_data, is_warehouse)
     response = make_response(pdf_output)
     response.headers['Content-Type'] = 'application/pdf'
     
     # שם קובץ שונה לכל סוג
-    filename = 'warehouse_order.pdf' if is_warehouse else 'customer_order.pdf'
     response.headers['Content-Disposition'] = f'attachment; filename={filename}'
     
     # שמירת ההזמנה במסד הנתונים רק אם זו הזמנה חדשה
     if save_order:
-        order = Order(
-            customer_id=customer.id,
-            total_without_vat=total_without_vat,
-            total_with_vat=total_with_vat
-        )
-        db.session.add(order)
-        
-        for item in cart_items:
-            order_item = OrderItem(
-                order=order,
-                product_id=item['product'].id,
-                quantity=item['quantity'],
-                price_without_vat=item['total_without_vat'] / item['quantity'],
-                price_with_vat=item['total_with_vat'] / item['quantity'],
-                product_name=item['product'].name + (f" ({item['variation'].name})" if item.get('variation') else "")
-            )
-            db.session.add(order_item)
-        
-        db.session.commit()
+        save_new_order(customer, cart_items, total_without_vat, total_with_vat)
     
     return response
 
-@app.route('/finish-order', methods=['POST'])
+@bp.route('/pdf-jobs/<job_id>')
+def pdf_job_status(job_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'נדרשת התחברות'})
+    
+    status, job = get_pdf_job(job_id)
+    if status is None:
+        return jsonify({'success': False, 'message': 'המשימה לא נמצאה או שפג תוקפה'}), 404
+    
+    result = {'success': True, 'status': status}
+    if status == 'done':
+        result['download_url'] = url_for('main.pdf_job_download', job_id=job_id)
+    elif status == 'failed':
+        result['message'] = f'אירעה שגיאה ביצירת ה-PDF: {job["error"]}'
+    return jsonify(result)
+
+@bp.route('/pdf-jobs/<job_id>/download')
+def pdf_job_download(job_id):
+    if 'user_id' not in session:
+        return redirect(url_for('main.login'))
+    
+    status, job = get_pdf_job(job_id)
+    if status != 'done':
+        return jsonify({'success': False, 'message': 'הקובץ אינו מוכן'}), 404
+    
+    return send_file(
+        pdf_job_path(job_id, '.pdf'),
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=job['filename']
+    )
+
+@bp.route('/finish-order', methods=['POST'])
 def finish_order():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
@@ -660,13 +2763,13 @@ def finish_order():
     if not customer:
         return jsonify({'success': False, 'message': 'לקוח לא נמצא'})
     
-    session['cart'] = []
+    clear_session_cart()
     return jsonify({
         'success': True, 
         'message': 'ההזמנה הושלמה בהצלחה והסל נוקה'
     })
 
-@app.route('/edit-product/<int:product_id>', methods=['POST'])
+@bp.route('/edit-product/<int:product_id>', methods=['POST'])
 def edit_product(product_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
@@ -676,56 +2779,49 @@ def edit_product(product_id):
     try:
         product.name = request.form['name']
         price_with_vat = float(request.form['price_with_vat'])
-        product.price_without_vat = price_with_vat / 1.18  # חישוב מחיר ללא מע"מ
+        product.price_without_vat = price_with_vat / vat_factor()  # חישוב מחיר ללא מע"מ
         product.price_with_vat = price_with_vat
         product.category_id = int(request.form['category_id'])
         
+        old_image = product.image
         if 'image' in request.files:
             file = request.files['image']
             if file and allowed_file(file.filename):
-                # מחיקת התמונה הישנה אם קיימת
-                if product.image:
-                    old_image_path = os.path.join(app.config['UPLOAD_FOLDER'], product.image)
-                    if os.path.exists(old_image_path):
-                        os.remove(old_image_path)
-                
-                # יצירת שם קובץ ייחודי עם חותמת זמן ומזהה מוצר
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = f"product_{product_id}_{timestamp}_{secure_filename(file.filename)}"
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                product.image = filename
+                product.image = save_upload(file)
         
+        bump_catalog_version()
         db.session.commit()
+        # התמונה הישנה נמחקת רק אם אף שורה אחרת לא משתמשת בה
+        if old_image != product.image:
+            release_uploads(old_image)
         return jsonify({'success': True, 'message': 'המוצר עודכן בהצלחה'})
     
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': 'אירעה שגיאה בעדכון המוצר'})
 
-@app.route('/delete-product/<int:product_id>', methods=['POST'])
+@bp.route('/delete-product/<int:product_id>', methods=['POST'])
 def delete_product(product_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
     
     product = Product.query.get_or_404(product_id)
-    print(f"DEBUG: Trying to delete product {product_id}")
     
     try:
-        # בדיקה אם המוצר קיים בהזמנות
-        order_items = OrderItem.query.filter_by(product_id=product_id).all()  # שינוי ל-all() במקום first()
-        print(f"DEBUG: Found {len(order_items)} order items for product {product_id}")
+        # בדיקה אם המוצר קיים בהזמנות - מספיקה שורה אחת
+        ordered = db.session.query(OrderItem.id).filter_by(product_id=product_id).first() is not None
         
-        if order_items:
-            print(f"DEBUG: Order items details: {[{'order_id': item.order_id, 'quantity': item.quantity} for item in order_items]}")
+        if ordered:
+            log_event(logging.INFO, 'product delete refused: ordered', product_id=product_id)
             return jsonify({
                 'success': False, 
                 'message': 'לא ניתן למחוק מוצר שקיים בהזמנות. יש למחוק קודם את ההזמנות הרלוונטיות'
             })
         
         # בדיקה אם המוצר נמצא בסל הקניות הנוכחי
-        if 'cart' in session:
-            cart_items = [item for item in session['cart'] if item['product_id'] == product_id]
-            print(f"DEBUG: Found {len(cart_items)} cart items for product {product_id}")
+        cart = get_cart()
+        if cart:
+            cart_items = CartItem.query.filter_by(cart_id=cart.id, product_id=product_id).count()
             if cart_items:
                 return jsonify({
                     'success': False,
@@ -733,30 +2829,27 @@ def delete_product(product_id):
                 })
         
         # מחיקת כל הווריאציות של המוצר
-        variations = ProductVariation.query.filter_by(product_id=product_id).all()
-        print(f"DEBUG: Found {len(variations)} variations for product {product_id}")
-        ProductVariation.query.filter_by(product_id=product_id).delete()
-        
-        # מחיקת תמונת המוצר אם קיימת
-        if product.image:
-            image_path = os.path.join(app.config['UPLOAD_FOLDER'], product.image)
-            print(f"DEBUG: Checking for image at {image_path}")
-            if os.path.exists(image_path):
-                os.remove(image_path)
-                print("DEBUG: Image deleted")
+        images = [product.image] + [
+            row[0] for row in db.session.query(ProductVariation.image).filter_by(product_id=product_id)
+        ]
+        deleted_variations = ProductVariation.query.filter_by(product_id=product_id).delete()
         
         # מחיקת המוצר עצמו
         db.session.delete(product)
+        bump_catalog_version()
         db.session.commit()
-        print("DEBUG: Product deleted successfully")
+        
+        # מחיקת התמונות שכבר אין מי שמשתמש בהן
+        release_uploads(*images)
+        log_event(logging.INFO, 'product deleted', product_id=product_id, variations=deleted_variations)
         return jsonify({'success': True, 'message': 'המוצר נמחק בהצלחה'})
     
     except Exception as e:
-        print(f"DEBUG: Error = {str(e)}")
+        current_app.logger.exception('product delete failed', extra={'fields': {'product_id': product_id}})
         db.session.rollback()
         return jsonify({'success': False, 'message': f'אירעה שגיאה במחיקת המוצר: {str(e)}'})
 
-@app.route('/edit-category/<int:category_id>', methods=['POST'])
+@bp.route('/edit-category/<int:category_id>', methods=['POST'])
 def edit_category(category_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
@@ -766,27 +2859,23 @@ def edit_category(category_id):
     try:
         category.name = request.form['name']
         
+        old_image = category.image
         if 'image' in request.files:
             file = request.files['image']
             if file and allowed_file(file.filename):
-                # מחיקת התמונה הישנה אם קיימת
-                if category.image:
-                    old_image_path = os.path.join(app.config['UPLOAD_FOLDER'], category.image)
-                    if os.path.exists(old_image_path):
-                        os.remove(old_image_path)
-                
-                filename = secure_filename(file.filename)
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                category.image = filename
+                category.image = save_upload(file)
         
+        bump_catalog_version()
         db.session.commit()
+        if old_image != category.image:
+            release_uploads(old_image)
         return jsonify({'success': True, 'message': 'הקטגוריה עודכנה בהצלחה'})
     
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': 'אירעה שגיאה בעדכון הקטגוריה'})
 
-@app.route('/delete-category/<int:category_id>', methods=['POST'])
+@bp.route('/delete-category/<int:category_id>', methods=['POST'])
 def delete_category(category_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
@@ -801,52 +2890,83 @@ def delete_category(category_id):
                 'message': 'לא ניתן למחוק קטגוריה שמכילה מוצרים. יש להסיר תחילה את כל המוצרים מהקטגוריה'
             })
         
-        # מחיקת תמונת הקטגוריה אם קיימת
-        if category.image:
-            image_path = os.path.join(app.config['UPLOAD_FOLDER'], category.image)
-            if os.path.exists(image_path):
-                os.remove(image_path)
-        
+        image = category.image
         db.session.delete(category)
+        bump_catalog_version()
         db.session.commit()
+        
+        # מחיקת תמונת הקטגוריה אם אין מי שמשתמש בה
+        release_uploads(image)
         return jsonify({'success': True, 'message': 'הקטגוריה נמחקה בהצלחה'})
     
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': 'אירעה שגיאה במחיקת הקטגוריה'})
 
-@app.route('/get-product/<int:product_id>')
+@bp.route('/get-product/<int:product_id>')
 def get_product(product_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
     
     product = Product.query.get_or_404(product_id)
-    return jsonify({
+    return conditional_json(rows_etag(Product.__tablename__, [product]), lambda: {
         'name': product.name,
         'price_without_vat': product.price_without_vat,
         'price_with_vat': product.price_with_vat,
         'category_id': product.category_id
     })
 
-@app.route('/get-category/<int:category_id>')
+def product_json(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'price_without_vat': product.price_without_vat,
+        'price_with_vat': product.price_with_vat,
+        'category_id': product.category_id,
+        'image': product.image,
+        'thumbnail': thumbnail_urls(product.image)['src']
+    }
+
+@bp.route('/get-products')
+def get_products():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'נדרשת התחברות'})
+    
+    _, ids, error = get_batch_ids('ids')
+    if error is not None:
+        return error
+    
+    # שאילתה אחת לכל הרשימה; מזהים שלא נמצאו פשוט לא מופיעים בתשובה
+    products = in_requested_order(Product.query.filter(Product.id.in_(ids)).all(), ids)
+    thumbnails = [thumbnail_urls(product.image)['src'] for product in products]
+    return conditional_json(rows_etag(Product.__tablename__, products, thumbnails), lambda: [product_json(product) for product in products])
+
+@bp.route('/get-category/<int:category_id>')
 def get_category(category_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
     
     category = Category.query.get_or_404(category_id)
-    return jsonify({
+    return conditional_json(rows_etag(Category.__tablename__, [category]), lambda: {
         'name': category.name
     })
 
 def check_file_exists(filename):
-    full_path = os.path.join(app.root_path, 'static', filename)
-    return os.path.exists(full_path)
+    return static_files.exists(os.path.join(current_app.root_path, 'static', filename))
+
+def logo_candidates():
+    # קודם static/images, אחר כך הלוגו שהועלה דרך האפליקציה
+    return [os.path.join(current_app.root_path, 'static', 'images', 'logo.png'),
+            os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'], 'logo.png')]
+
+def find_logo_path():
+    return next((path for path in logo_candidates() if static_files.exists(path)), None)
 
-@app.context_processor
+@bp.app_context_processor
 def utility_processor():
-    return dict(check_file_exists=check_file_exists)
+    return dict(check_file_exists=check_file_exists, thumbnail_urls=thumbnail_urls, vat_factor=vat_factor)
 
-@app.route('/search-products')
+@bp.route('/search-products')
 def search_products():
     if 'user_id' not in session:
         return jsonify([])
@@ -855,33 +2975,75 @@ def search_products():
     if len(query) < 2:
         return jsonify([])
     
-    # חיפוש מוצרים שמתחילים או מכילים את מחרוזת החיפוש
-    products = Product.query.filter(Product.name.ilike(f'%{query}%')).limit(5).all()
+    # חיפוש מוצרים לפי תחילית מילה, ממוינים לפי רלוונטיות
+    if current_app.config['SEARCH_PREFIX_INDEX'] and search_index.ready():
+        products = search_index.search(query, 5)
+    elif fts_enabled():
+        product_ids = search_product_ids(query, 5)
+        found = {p.id: p for p in Product.query.filter(Product.id.in_(product_ids)).all()}
+        products = [found[pid] for pid in product_ids if pid in found]
+    else:
+        products = Product.query.filter(Product.name.ilike(f'%{query}%')).limit(5).all()
     
-    return jsonify([{
+    thumbnails = [thumbnail_urls(p.image)['src'] for p in products]
+    return conditional_json(rows_etag(Product.__tablename__, products, thumbnails), lambda: [{
         'id': p.id,
         'name': p.name,
         'price_with_vat': p.price_with_vat,
-        'image': p.image
-    } for p in products])
+        'image': p.image,
+        'thumbnail': thumbnail
+    } for p, thumbnail in zip(products, thumbnails)])
 
-@app.route('/orders-history')
+@bp.route('/orders-history')
 def orders_history():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
+    
+    # סינון לפי טווח תאריכים ולקוח
+    date_from = parse_date_arg('date_from')
+    date_to = parse_date_arg('date_to')
+    customer_query = request.args.get('customer', '').strip()
+    customer_id = request.args.get('customer_id', type=int)
+    
+    cursor = request.args.get('cursor', '')
+    page_size = get_page_size('ORDERS_PAGE_SIZE', 'ORDERS_MAX_PAGE_SIZE')
     
-    orders = Order.query.order_by(Order.date.desc()).all()
-    return render_template('orders_history.html', orders=orders)
+    # לקוח ופריטים נטענים מראש - מספר קבוע של שאילתות לכל עמוד
+    orders_query = Order.query.options(
+        joinedload(Order.customer),
+        selectinload(Order.items)
+    )
+    if date_from:
+        orders_query = orders_query.filter(Order.date >= date_from)
+    if date_to:
+        orders_query = orders_query.filter(Order.date < date_to + timedelta(days=1))
+    if customer_id:
+        orders_query = orders_query.filter(Order.customer_id == customer_id)
+    elif customer_query:
+        orders_query = orders_query.filter(Order.customer_id.in_(
+            db.select(Customer.id).where(Customer.name.ilike(f'%{customer_query}%'))
+        ))
+    
+    orders, next_cursor = keyset_page(orders_query, [Order.date, Order.id], cursor, page_size, descending=True)
+    
+    return render_template('orders_history.html', orders=orders,
+                         today=datetime.utcnow().strftime('%Y-%m-%d'),
+                         date_from=request.args.get('date_from', ''),
+                         date_to=request.args.get('date_to', ''),
+                         customer_query=customer_query,
+                         customer_id=customer_id,
+                         cursor=cursor,
+                         next_cursor=next_cursor)
 
-@app.route('/customers')
+@bp.route('/customers')
 def customers():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     customers = Customer.query.order_by(Customer.name).all()
     return render_template('customers.html', customers=customers)
 
-@app.route('/add-customer', methods=['POST'])
+@bp.route('/add-customer', methods=['POST'])
 def add_customer():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
@@ -912,21 +3074,36 @@ def add_customer():
         db.session.rollback()
         return jsonify({'success': False, 'message': 'אירעה שגיאה בהוספת הלקוח'})
 
-@app.route('/get-customer/<int:customer_id>')
+@bp.route('/get-customer/<int:customer_id>')
 def get_customer(customer_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
     
     customer = Customer.query.get_or_404(customer_id)
-    return jsonify({
+    return conditional_json(rows_etag(Customer.__tablename__, [customer]), lambda: customer_json(customer))
+
+def customer_json(customer):
+    return {
         'id': customer.id,
         'name': customer.name,
         'address': customer.address,
         'phone': customer.phone,
         'email': customer.email
-    })
+    }
+
+@bp.route('/get-customers')
+def get_customers():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'נדרשת התחברות'})
+    
+    _, ids, error = get_batch_ids('ids')
+    if error is not None:
+        return error
+    
+    customers = in_requested_order(Customer.query.filter(Customer.id.in_(ids)).all(), ids)
+    return conditional_json(rows_etag(Customer.__tablename__, customers), lambda: [customer_json(customer) for customer in customers])
 
-@app.route('/add-variation/<int:product_id>', methods=['POST'])
+@bp.route('/add-variation/<int:product_id>', methods=['POST'])
 def add_variation(product_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
@@ -945,16 +3122,14 @@ def add_variation(product_id):
                 'message': 'נא למלא את כל השדות הנדרשים'
             })
         
-        price_with_vat = price_without_vat * 1.18  # מע"מ 18%
+        price_with_vat = price_without_vat * vat_factor()
         
         # טיפול בתמונה
         image_filename = None
         if 'image' in request.files:
             file = request.files['image']
             if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                image_filename = filename
+                image_filename = save_upload(file)
 
         # יצירת הווריאציה
         variation = ProductVariation(
@@ -966,6 +3141,7 @@ def add_variation(product_id):
         )
         
         db.session.add(variation)
+        bump_catalog_version()
         db.session.commit()
         
         return jsonify({
@@ -982,57 +3158,90 @@ def add_variation(product_id):
         
     except Exception as e:
         db.session.rollback()
-        print(f"Error adding variation: {str(e)}")  # לוג של השגיאה
+        current_app.logger.exception('add variation failed', extra={'fields': {'product_id': product_id}})
         return jsonify({
             'success': False, 
             'message': f'אירעה שגיאה בהוספת הווריאציה: {str(e)}'
         }), 400
 
-@app.route('/get-variations/<int:product_id>')
+@bp.route('/get-variations/<int:product_id>')
 def get_variations(product_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
     
     product = Product.query.get_or_404(product_id)
-    variations = [{
+    variations = product.variations
+    thumbnails = [thumbnail_urls(v.image)['src'] for v in variations]
+    return conditional_json(rows_etag(ProductVariation.__tablename__, variations, thumbnails), lambda: [{
         'id': v.id,
         'name': v.name,
         'price_without_vat': v.price_without_vat,
         'price_with_vat': v.price_with_vat,
-        'image': v.image
-    } for v in product.variations]
+        'image': v.image,
+        'thumbnail': thumbnail
+    } for v, thumbnail in zip(variations, thumbnails)])
+
+@bp.route('/get-variations')
+def get_variations_batch():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'נדרשת התחברות'})
+    
+    # ids - מזהי וריאציות; product_ids - כל הווריאציות של המוצרים המבוקשים
+    name, ids, error = get_batch_ids('ids', 'product_ids')
+    if error is not None:
+        return error
     
-    return jsonify(variations)
+    if name == 'ids':
+        variations = in_requested_order(ProductVariation.query.filter(ProductVariation.id.in_(ids)).all(), ids)
+    else:
+        variations = ProductVariation.query.filter(ProductVariation.product_id.in_(ids)).order_by(ProductVariation.id).all()
+        variations = in_requested_order(variations, ids, key=lambda v: v.product_id)
+    thumbnails = [thumbnail_urls(v.image)['src'] for v in variations]
+    return conditional_json(rows_etag(ProductVariation.__tablename__, variations, thumbnails), lambda: [{
+        'id': v.id,
+        'product_id': v.product_id,
+        'name': v.name,
+        'price_without_vat': v.price_without_vat,
+        'price_with_vat': v.price_with_vat,
+        'image': v.image,
+        'thumbnail': thumbnail
+    } for v, thumbnail in zip(variations, thumbnails)])
 
-@app.route('/delete-all-products', methods=['POST'])
+@bp.route('/delete-all-products', methods=['POST'])
 def delete_all_products():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
     
     try:
-        # מחיקת כל הווריאציות קודם (בגלל המפתח הזר)
+        # מחיקת שורות סל שמפנות למוצרים, ואז כל הווריאציות (בגלל המפתח הזר)
+        CartItem.query.delete()
         ProductVariation.query.delete()
         
         # מחיקת כל המוצרים
         Product.query.delete()
         
+        bump_catalog_version()
         db.session.commit()
         return jsonify({'success': True, 'message': 'כל המוצרים נמחקו בהצלחה'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': f'שגיאה במחיקת המוצרים: {str(e)}'})
 
-@app.route('/delete-order/<int:order_id>', methods=['POST'])
+@bp.route('/delete-order/<int:order_id>', methods=['POST'])
 def delete_order(order_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
     
     try:
+        order = Order.query.get_or_404(order_id)
+        
+        # הורדת ההזמנה מסיכומי המכירות
+        update_sales_rollups(order, order.items, sign=-1)
+        
         # מחיקת כל פריטי ההזמנה
         OrderItem.query.filter_by(order_id=order_id).delete()
         
         # מחיקת ההזמנה עצמה
-        order = Order.query.get_or_404(order_id)
         db.session.delete(order)
         db.session.commit()
         
@@ -1041,7 +3250,207 @@ def delete_order(order_id):
         db.session.rollback()
         return jsonify({'success': False, 'message': f'אירעה שגיאה במחיקת ההזמנה: {str(e)}'})
 
-@app.route('/import-products', methods=['POST'])
+# קיבוץ בדוחות המכירות: (טבלת סיכום, עמודת המפתח, מודל לשם)
+SALES_REPORT_GROUPS = {
+    'product': (DailyProductSales, 'product_id', Product),
+    'category': (DailyCategorySales, 'category_id', Category),
+    'customer': (DailyCustomerSales, 'customer_id', Customer),
+}
+
+def sales_report_range(model):
+    """תנאי טווח התאריכים מהבקשה (date_from, date_to כולל)."""
+    conditions = []
+    date_from = parse_date_arg('date_from')
+    date_to = parse_date_arg('date_to')
+    if date_from:
+        conditions.append(model.day >= date_from.date())
+    if date_to:
+        conditions.append(model.day <= date_to.date())
+    return conditions
+
+@bp.route('/reports/sales')
+def sales_report():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'נדרשת התחברות'})
+    
+    group = request.args.get('group', 'product')
+    if group not in SALES_REPORT_GROUPS:
+        return jsonify({'success': False, 'message': 'קיבוץ לא מוכר'})
+    model, key, named_model = SALES_REPORT_GROUPS[group]
+    limit = max(1, min(request.args.get('limit', 50, type=int), 1000))
+    
+    key_column = getattr(model, key)
+    revenue = db.func.sum(model.revenue_with_vat)
+    rows = db.session.execute(
+        db.select(key_column, named_model.name, db.func.sum(model.units), db.func.sum(model.revenue_without_vat), revenue)
+        .outerjoin(named_model, named_model.id == key_column)
+        .where(*sales_report_range(model))
+        .group_by(key_column, named_model.name)
+        .order_by(revenue.desc())
+        .limit(limit)
+    ).all()
+    
+    return content_etag_json({
+        'success': True,
+        'group': group,
+        'rows': [
+            {'id': key_value, 'name': name, 'units': units,
+             'revenue_without_vat': round(without_vat, 2), 'revenue_with_vat': round(with_vat, 2)}
+            for key_value, name, units, without_vat, with_vat in rows
+        ]
+    })
+
+@bp.route('/reports/sales/daily')
+def sales_report_daily():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'נדרשת התחברות'})
+    
+    # סיכום לפי יום מטבלת הלקוחות, שבה יש גם מספר הזמנות
+    model = DailyCustomerSales
+    rows = db.session.execute(
+        db.select(model.day, db.func.sum(model.orders), db.func.sum(model.units),
+                  db.func.sum(model.revenue_without_vat), db.func.sum(model.revenue_with_vat))
+        .where(*sales_report_range(model))
+        .group_by(model.day)
+        .order_by(model.day)
+    ).all()
+    
+    return content_etag_json({
+        'success': True,
+        'rows': [
+            {'day': day.isoformat(), 'orders': orders, 'units': units,
+             'revenue_without_vat': round(without_vat, 2), 'revenue_with_vat': round(with_vat, 2)}
+            for day, orders, units, without_vat, with_vat in rows
+        ]
+    })
+
+IMPORT_MAX_REPORTED_ERRORS = 100
+
+def clean_text_column(series):
+    """ממיר עמודת טקסט מ-pandas לרשימת ערכי פייתון (None במקום NaN)."""
+    import pandas as pd
+    return [None if pd.isna(value) else str(value) for value in series]
+
+def insert_products(product_rows):
+    """מכניס מוצרים ב-executemany ומחזיר את המזהים שלהם לפי סדר השורות."""
+    if db.session.get_bind().dialect.name != 'sqlite':
+        # PostgreSQL מחזיר את המזהים ממוינים לפי סדר הפרמטרים בתוך ה-INSERT המרוכז עצמו
+        return db.session.scalars(
+            db.insert(Product).returning(Product.id, sort_by_parameter_order=True),
+            product_rows
+        ).all()
+    # ב-SQLite אין עמודת sentinel, ו-RETURNING ממוין נופל ל-INSERT נפרד לכל שורה. לכן executemany
+    # בלי RETURNING: מרגע ה-INSERT הראשון ה-transaction מחזיק את נעילת הכתיבה של כל מסד הנתונים
+    # עד ה-commit, ולכן המזהים של הקבוצה הם len(product_rows) המזהים האחרונים, לפי הסדר
+    db.session.execute(db.insert(Product), product_rows)
+    return db.session.scalars(
+        db.select(Product.id).order_by(Product.id.desc()).limit(len(product_rows))
+    ).all()[::-1]
+
+def import_products_frame(df, default_category_id):
+    """מייבא מוצרים (וריאציות) מ-DataFrame. מחזיר (מספר מוצרים שיובאו, שגיאות לפי שורה).
+
+    כל הבדיקות מתבצעות על עמודות שלמות, הקטגוריות נבדקות בשאילתה אחת,
+    וההכנסה נעשית ב-executemany בקבוצות של IMPORT_CHUNK_SIZE עם commit לכל קבוצה.
+    """
+    import pandas as pd
+    row_errors = {}
+    
+    def reject(mask, message):
+        for index in df.index[mask]:
+            row_errors.setdefault(index, message)
+    
+    names = df['name'].astype('string').str.strip()
+    reject(names.isna() | (names == ''), 'חסר שם מוצר')
+    
+    prices = pd.to_numeric(df['price_with_vat'], errors='coerce')
+    reject(prices.isna() | (prices < 0), 'מחיר לא תקין')
+    
+    # שימוש ב-category_id מהקובץ אם קיים, אחרת מהטופס
+    default_category = pd.to_numeric(pd.Series([default_category_id]), errors='coerce').iloc[0]
+    if 'category_id' in df.columns:
+        categories = pd.to_numeric(df['category_id'], errors='coerce').fillna(default_category)
+    else:
+        categories = pd.Series(default_category, index=df.index, dtype='float64')
+    
+    # בדיקה שהקטגוריות קיימות - שאילתה אחת לכל הקובץ
+    referenced = [int(c) for c in categories.dropna().unique()]
+    existing = set()
+    if referenced:
+        existing = {row[0] for row in db.session.query(Category.id).filter(Category.id.in_(referenced))}
+    reject(categories.isna(), 'לא נבחרה קטגוריה')
+    reject(categories.notna() & ~categories.isin(existing), 'הקטגוריה לא קיימת')
+    
+    # עמודות הווריאציות מחושבות פעם אחת: variation_N_name / _price_with_vat / _image
+    variation_bases = [col[:-5] for col in df.columns if col.startswith('variation_') and col.endswith('_name')]
+    variation_frames = []
+    for position, base in enumerate(variation_bases):
+        variation_names = df[f'{base}_name'].astype('string').str.strip()
+        has_variation = variation_names.notna() & (variation_names != '')
+        if f'{base}_price_with_vat' in df.columns:
+            variation_prices = pd.to_numeric(df[f'{base}_price_with_vat'], errors='coerce')
+        else:
+            variation_prices = pd.Series(float('nan'), index=df.index)
+        reject(has_variation & (variation_prices.isna() | (variation_prices < 0)), f'מחיר לא תקין בעמודה {base}_price_with_vat')
+        
+        variation_frames.append(pd.DataFrame({
+            'row': df.index[has_variation],
+            'position': position,
+            'name': variation_names[has_variation],
+            'price_with_vat': variation_prices[has_variation],
+            'image': df[f'{base}_image'][has_variation] if f'{base}_image' in df.columns else None
+        }))
+    
+    valid = ~df.index.isin(list(row_errors))
+    valid_rows = df.index[valid]
+    products = pd.DataFrame({
+        'name': names[valid],
+        'price_with_vat': prices[valid],
+        'category_id': categories[valid],
+        'image': df['image'][valid] if 'image' in df.columns else None
+    }, index=valid_rows)
+    factor = vat_factor()
+    products['price_without_vat'] = products['price_with_vat'] / factor  # חישוב מחיר ללא מע"מ
+    
+    variations = None
+    if variation_frames:
+        variations = pd.concat(variation_frames)
+        variations = variations[variations['row'].isin(valid_rows)].sort_values(['row', 'position'])
+        variations['price_without_vat'] = variations['price_with_vat'] / factor
+    
+    chunk_size = current_app.config['IMPORT_CHUNK_SIZE']
+    for start in range(0, len(products), chunk_size):
+        chunk = products.iloc[start:start + chunk_size]
+        product_rows = [
+            {'name': name, 'price_with_vat': price_with_vat, 'price_without_vat': price_without_vat,
+             'category_id': int(category), 'image': image}
+            for name, price_with_vat, price_without_vat, category, image in zip(
+                clean_text_column(chunk['name']), chunk['price_with_vat'].tolist(),
+                chunk['price_without_vat'].tolist(), chunk['category_id'].tolist(),
+                clean_text_column(chunk['image']))
+        ]
+        product_ids = insert_products(product_rows)
+        
+        if variations is not None:
+            ids_by_row = dict(zip(chunk.index, product_ids))
+            chunk_variations = variations[variations['row'].isin(chunk.index)]
+            if len(chunk_variations):
+                db.session.execute(db.insert(ProductVariation), [
+                    {'product_id': ids_by_row[row], 'name': name, 'price_with_vat': price_with_vat,
+                     'price_without_vat': price_without_vat, 'image': image}
+                    for row, name, price_with_vat, price_without_vat, image in zip(
+                        chunk_variations['row'].tolist(), clean_text_column(chunk_variations['name']),
+                        chunk_variations['price_with_vat'].tolist(), chunk_variations['price_without_vat'].tolist(),
+                        clean_text_column(chunk_variations['image']))
+                ])
+        bump_catalog_version()
+        db.session.commit()
+    
+    # מספרי שורות כפי שהם בקובץ (שורה 1 היא הכותרת)
+    errors = [{'row': int(index) + 2, 'message': message} for index, message in sorted(row_errors.items())]
+    return len(products), errors
+
+@bp.route('/import-products', methods=['POST'])
 def import_products():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
@@ -1060,6 +3469,7 @@ def import_products():
     
     try:
         # קריאת הקובץ CSV
+        import pandas as pd
         df = pd.read_csv(file, encoding='utf-8-sig')
         required_columns = ['name', 'price_with_vat']
         
@@ -1071,248 +3481,415 @@ def import_products():
                 'message': f'חסרות העמודות הבאות: {", ".join(missing_columns)}'
             })
         
-        # ייבוא כל מוצר
-        for _, row in df.iterrows():
-            price_with_vat = float(row['price_with_vat'])
-            price_without_vat = price_with_vat / 1.18  # חישוב מחיר ללא מע"מ
-            
-            # שימוש ב-category_id מהקובץ אם קיים, אחרת מהטופס
-            product_category_id = row.get('category_id', category_id)
-            
-            # בדיקה שהקטגוריה קיימת
-            if product_category_id and not Category.query.get(product_category_id):
-                return jsonify({
-                    'success': False,
-                    'message': f'קטגוריה עם מזהה {product_category_id} לא קיימת'
-                })
-            
-            product = Product(
-                name=row['name'],
-                price_without_vat=price_without_vat,
-                price_with_vat=price_with_vat,
-                image=row.get('image', None),  # שימוש ב-get עם ברירת מחדל
-                category_id=product_category_id
-            )
-            db.session.add(product)
-            
-            # אם יש וריאציות, נוסיף אותן
-            variations_columns = [col for col in df.columns if col.startswith('variation_')]
-            if variations_columns:
-                variation_names = [col for col in variations_columns if col.endswith('_name')]
-                for var_name_col in variation_names:
-                    base_name = var_name_col[:-5]  # הסרת '_name'
-                    price_with_vat_col = f'{base_name}_price_with_vat'
-                    
-                    if pd.notna(row[var_name_col]):
-                        variation_price_with_vat = float(row[price_with_vat_col])
-                        variation_price_without_vat = variation_price_with_vat / 1.18  # חישוב מחיר ללא מע"מ
-                        
-                        variation = ProductVariation(
-                            name=row[var_name_col],
-                            price_without_vat=variation_price_without_vat,
-                            price_with_vat=variation_price_with_vat,
-                            image=row.get(f'{base_name}_image', None)  # תמונה לווריאציה אם קיימת
-                        )
-                        product.variations.append(variation)
+        imported, errors = import_products_frame(df, category_id)
         
-        db.session.commit()
-        return jsonify({'success': True, 'message': 'המוצרים יובאו בהצלחה'})
+        if errors and not imported:
+            return jsonify({
+                'success': False,
+                'message': f'לא יובאו מוצרים - נמצאו {len(errors)} שורות שגויות',
+                'errors': errors[:IMPORT_MAX_REPORTED_ERRORS]
+            })
+        
+        message = f'{imported} מוצרים יובאו בהצלחה'
+        if errors:
+            message += f', {len(errors)} שורות נדחו'
+        return jsonify({
+            'success': True,
+            'message': message,
+            'imported': imported,
+            'errors': errors[:IMPORT_MAX_REPORTED_ERRORS]
+        })
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': f'אירעה שגיאה בייבוא: {str(e)}'})
 
-@app.route('/export-all', methods=['GET'])
+EXPORT_TABLES = [
+    ('categories', Category, ['id', 'name', 'image']),
+    ('products', Product, ['id', 'name', 'price_with_vat', 'price_without_vat', 'image', 'category_id']),
+    ('variations', ProductVariation, ['id', 'product_id', 'name', 'price_with_vat', 'price_without_vat', 'image']),
+]
+
+@bp.route('/export-all', methods=['GET'])
 def export_all():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
     
-    try:
-        # יצירת DataFrame של קטגוריות
-        categories = Category.query.all()
-        print(f"Found {len(categories)} categories")  # לוג לבדיקה
-        categories_data = []
-        for category in categories:
-            categories_data.append({
-                'id': category.id,
-                'name': category.name,
-                'image': category.image
-            })
-        categories_df = pd.DataFrame(categories_data)
-        print(f"Categories DataFrame shape: {categories_df.shape}")  # לוג לבדיקה
-        
-        # יצירת DataFrame של מוצרים
-        products = Product.query.all()
-        print(f"Found {len(products)} products")  # לוג לבדיקה
-        products_data = []
-        for product in products:
-            products_data.append({
-                'id': product.id,
-                'name': product.name,
-                'price_with_vat': product.price_with_vat,
-                'price_without_vat': product.price_without_vat,
-                'image': product.image,
-                'category_id': product.category_id
-            })
-        products_df = pd.DataFrame(products_data)
-        print(f"Products DataFrame shape: {products_df.shape}")  # לוג לבדיקה
-        
-        # יצירת DataFrame של וריאציות
-        variations = ProductVariation.query.all()
-        print(f"Found {len(variations)} variations")  # לוג לבדיקה
-        variations_data = []
-        for variation in variations:
-            variations_data.append({
-                'id': variation.id,
-                'product_id': variation.product_id,
-                'name': variation.name,
-                'price_with_vat': variation.price_with_vat,
-                'price_without_vat': variation.price_without_vat,
-                'image': variation.image
-            })
-        variations_df = pd.DataFrame(variations_data)
-        print(f"Variations DataFrame shape: {variations_df.shape}")  # לוג לבדיקה
-        
-        # יצירת נתיב מלא לתיקיית הייצוא
-        export_dir = os.path.join(app.root_path, 'static', 'exports')
-        if not os.path.exists(export_dir):
-            os.makedirs(export_dir)
-            print(f"Created export directory: {export_dir}")  # לוג לבדיקה
-        
-        # שמירת הקבצים
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        
-        # שמירת קטגוריות
-        categories_path = os.path.join(export_dir, f'categories_{timestamp}.csv')
-        categories_df.to_csv(categories_path, index=False, encoding='utf-8-sig')
-        print(f"Saved categories to {categories_path}")  # לוג לבדיקה
-        
-        # שמירת מוצרים
-        products_path = os.path.join(export_dir, f'products_{timestamp}.csv')
-        products_df.to_csv(products_path, index=False, encoding='utf-8-sig')
-        print(f"Saved products to {products_path}")  # לוג לבדיקה
-        
-        # שמירת וריאציות
-        variations_path = os.path.join(export_dir, f'variations_{timestamp}.csv')
-        variations_df.to_csv(variations_path, index=False, encoding='utf-8-sig')
-        print(f"Saved variations to {variations_path}")  # לוג לבדיקה
-        
-        # יצירת קובץ ZIP
-        zip_path = os.path.join(export_dir, f'export_{timestamp}.zip')
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            zipf.write(categories_path, f'categories_{timestamp}.csv')
-            zipf.write(products_path, f'products_{timestamp}.csv')
-            zipf.write(variations_path, f'variations_{timestamp}.csv')
-        
-        # מחיקת קבצי ה-CSV הבודדים
-        os.remove(categories_path)
-        os.remove(products_path)
-        os.remove(variations_path)
-        
-        # החזרת קובץ ה-ZIP למשתמש
-        return send_from_directory(
-            export_dir,
-            f'export_{timestamp}.zip',
-            as_attachment=True,
-            download_name=f'export_{timestamp}.zip'
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    chunk_size = current_app.config['EXPORT_CHUNK_SIZE']
+    
+    def generate():
+        # ה-CSV נכתב ישירות לתוך ה-ZIP, וה-ZIP נשלח ללקוח תוך כדי יצירתו - בלי קבצים זמניים
+        stream = ZipStream()
+        with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for name, model, columns in EXPORT_TABLES:
+                with zipf.open(f'{name}_{timestamp}.csv', 'w') as entry:
+                    csv_file = io.TextIOWrapper(entry, encoding='utf-8-sig', newline='')
+                    writer = csv.writer(csv_file, lineterminator='\n')
+                    writer.writerow(columns)
+                    
+                    # קריאה בקבוצות מסמן בצד השרת, בלי לטעון את כל הטבלה לזיכרון
+                    result = db.session.execute(
+                        db.select(*[getattr(model, column) for column in columns])
+                        .order_by(model.id)
+                        .execution_options(yield_per=chunk_size)
+                    )
+                    for rows in result.partitions():
+                        writer.writerows(rows)
+                        csv_file.flush()
+                        yield stream.drain()
+                    csv_file.detach()
+                yield stream.drain()
+        yield stream.drain()
+    
+    response = Response(stream_with_context(generate()), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename=export_{timestamp}.zip'
+    return response
+
+# טבלאות שנטענות בייבוא הכל: (שם הקובץ בטופס, מודל, עמודות בקובץ, עמודות חובה)
+# price_without_vat לא נקרא מהקובץ - הוא מחושב מחדש מ-price_with_vat
+IMPORT_ALL_TABLES = [
+    ('categories', Category, ['id', 'name', 'image'], ['name']),
+    ('products', Product, ['id', 'name', 'price_with_vat', 'image', 'category_id'], ['name', 'price_with_vat', 'category_id']),
+    ('variations', ProductVariation, ['id', 'product_id', 'name', 'price_with_vat', 'image'], ['product_id', 'name', 'price_with_vat']),
+]
+
+# הפניות בין הטבלאות: (טבלה, עמודה, טבלת היעד)
+IMPORT_ALL_REFERENCES = [
+    ('products', 'category_id', 'categories'),
+    ('variations', 'product_id', 'products'),
+]
+
+# מפתח טבעי לזיהוי רשומה קיימת בייבוא עדכון, כשלשורה בקובץ אין id
+IMPORT_ALL_NATURAL_KEYS = {
+    'categories': ['name'],
+    'products': ['category_id', 'name'],
+    'variations': ['product_id', 'name'],
+}
+
+def create_staging_tables(conn, names):
+    """יוצר טבלאות זמניות (TEMPORARY) לכל קובץ שהועלה. הטבלאות מקומיות לחיבור בלבד."""
+    metadata = db.MetaData()
+    tables = {}
+    for name, model, columns, _ in IMPORT_ALL_TABLES:
+        if name not in names:
+            continue
+        tables[name] = db.Table(
+            f'staging_{name}', metadata,
+            db.Column('line', db.Integer, nullable=False),  # מספר השורה בקובץ
+            db.Column('parse_error', db.String(200)),
+            db.Column('target_id', db.Integer),  # הרשומה הקיימת שהשורה מעדכנת (בייבוא עדכון)
+            *[db.Column(column, model.__table__.c[column].type) for column in columns],
+            prefixes=['TEMPORARY']
         )
-        
-    except Exception as e:
-        print(f"Error in export_all: {str(e)}")  # לוג שגיאה
-        return jsonify({'success': False, 'message': f'אירעה שגיאה בייצוא: {str(e)}'})
+    metadata.create_all(conn)
+    return metadata, tables
+
+def load_staging_table(conn, table, file, model, columns):
+    """קורא קובץ CSV בקבוצות ומכניס אותו לטבלה הזמנית. מחזיר את מספר השורות."""
+    import pandas as pd
+    chunk_size = current_app.config['IMPORT_CHUNK_SIZE']
+    numeric = [column for column in columns if not isinstance(model.__table__.c[column].type, db.String)]
+    count = 0
+    for chunk in pd.read_csv(file, encoding='utf-8-sig', dtype=str, chunksize=chunk_size):
+        parse_error = pd.Series(None, index=chunk.index, dtype='object')
+        values = {}
+        for column in columns:
+            if column not in chunk.columns:
+                values[column] = [None] * len(chunk)
+                continue
+            raw = chunk[column].str.strip()
+            if column not in numeric:
+                values[column] = clean_text_column(raw.where(raw != ''))
+                continue
+            parsed = pd.to_numeric(raw, errors='coerce')
+            invalid = raw.notna() & (raw != '') & parsed.isna()
+            if isinstance(model.__table__.c[column].type, db.Integer):
+                invalid |= parsed.notna() & (parsed % 1 != 0)
+            parse_error[invalid & parse_error.isna()] = f'ערך לא תקין בעמודה {column}'
+            parsed = parsed.where(~invalid)
+            if isinstance(model.__table__.c[column].type, db.Integer):
+                values[column] = [None if pd.isna(value) else int(value) for value in parsed]
+            else:
+                values[column] = [None if pd.isna(value) else float(value) for value in parsed]
+        
+        # שורה 1 בקובץ היא הכותרת
+        lines = (chunk.index + 2).tolist()
+        rows = [
+            dict(zip(columns, row_values), line=line, parse_error=error)
+            for line, error, row_values in zip(lines, clean_text_column(parse_error), zip(*[values[c] for c in columns]))
+        ]
+        if rows:
+            conn.execute(table.insert(), rows)
+        count += len(rows)
+    return count
+
+def validate_staging_tables(conn, tables, keep_live=False):
+    """בודק את הנתונים בטבלאות הזמניות בשאילתות על כל הקבוצה. מחזיר רשימת שגיאות.
+
+    keep_live - הרשומות הקיימות שלא בקובץ נשארות (ייבוא עדכון), כך שגם הן יעד חוקי להפניות.
+    """
+    errors = []
+    
+    def collect(name, table, condition, message):
+        rows = conn.execute(
+            db.select(table.c.line).where(condition).order_by(table.c.line).limit(IMPORT_MAX_REPORTED_ERRORS)
+        )
+        errors.extend({'file': name, 'row': line, 'message': message} for line, in rows)
+    
+    live = {name: model.__table__ for name, model, _, _ in IMPORT_ALL_TABLES}
+    for name, model, columns, required in IMPORT_ALL_TABLES:
+        if name not in tables:
+            continue
+        table = tables[name]
+        collect(name, table, table.c.parse_error.isnot(None), 'ערך מספרי לא תקין')
+        for column in required:
+            if column == 'name':
+                condition = or_(table.c.name.is_(None), db.func.trim(table.c.name) == '')
+            else:
+                # ערך שלא הצליח להתפרש כבר דווח למעלה
+                condition = and_(table.c[column].is_(None), table.c.parse_error.is_(None))
+            collect(name, table, condition, f'חסר ערך בעמודה {column}')
+        if 'price_with_vat' in columns:
+            collect(name, table, table.c.price_with_vat < 0, 'מחיר לא תקין')
+        
+        duplicates = db.select(table.c.id).where(table.c.id.isnot(None)).group_by(table.c.id).having(db.func.count() > 1)
+        collect(name, table, table.c.id.in_(duplicates), 'מזהה כפול בקובץ')
+        
+        # שתי שורות שמתאימות לאותה רשומה קיימת, או שתי שורות חדשות עם אותו מפתח טבעי
+        duplicates = db.select(table.c.target_id).where(table.c.target_id.isnot(None)).group_by(table.c.target_id).having(db.func.count() > 1)
+        collect(name, table, table.c.target_id.in_(duplicates), 'כמה שורות מתאימות לאותה רשומה קיימת')
+        if keep_live:
+            keys = [table.c[key] for key in IMPORT_ALL_NATURAL_KEYS[name]]
+            duplicates = (
+                db.select(*keys).where(table.c.id.is_(None), table.c.target_id.is_(None))
+                .group_by(*keys).having(db.func.count() > 1)
+            )
+            collect(name, table, and_(table.c.id.is_(None), table.c.target_id.is_(None), db.tuple_(*keys).in_(duplicates)),
+                    'שורה כפולה בקובץ')
+    
+    def reference_exists(target, value):
+        # המזהים שיישארו ביעד: שורות הקובץ (המזהה הקיים שהן מעדכנות או המזהה מהקובץ),
+        # ובייבוא עדכון גם כל הרשומות הקיימות
+        # IN על תת-שאילתה לא מתואמת מחושב פעם אחת, במקום סריקה של היעד לכל שורה
+        conditions = []
+        if target in tables:
+            staged = tables[target]
+            surviving = db.func.coalesce(staged.c.target_id, staged.c.id)
+            conditions.append(value.in_(db.select(surviving).where(surviving.isnot(None))))
+        if keep_live or target not in tables:
+            conditions.append(value.in_(db.select(live[target].c.id)))
+        return or_(*conditions)
+    
+    for name, column, target in IMPORT_ALL_REFERENCES:
+        if name in tables:
+            table = tables[name]
+            collect(name, table, and_(table.c[column].isnot(None), ~reference_exists(target, table.c[column])),
+                    f'{column} מפנה לרשומה שלא קיימת')
+        elif target in tables and not keep_live:
+            # הטבלה המפנה לא מוחלפת - כל השורות הקיימות בה חייבות למצוא את היעד בקובץ החדש
+            table = live[name]
+            orphans = conn.execute(
+                db.select(db.func.count()).select_from(table)
+                .where(~reference_exists(target, table.c[column]))
+            ).scalar()
+            if orphans:
+                errors.append({'file': target, 'row': None,
+                               'message': f'{orphans} רשומות קיימות ב-{name} מפנות למזהים שאינם בקובץ'})
+    
+    errors.sort(key=lambda error: (error['file'], error['row'] or 0))
+    return errors
+
+def sync_id_sequence(conn, table):
+    """ב-PostgreSQL מעדכן את ה-sequence אחרי הכנסה עם מזהים מפורשים. ב-SQLite אין צורך."""
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), coalesce(max(id), 0) + 1, false) FROM {table.name}"
+        ))
+
+def delete_stale_cart_items(conn):
+    """מוחק פריטים מסלים פתוחים שמפנים למוצרים או וריאציות שכבר לא קיימים."""
+    cart_item = CartItem.__table__
+    conn.execute(db.delete(cart_item).where(or_(
+        ~db.exists().where(Product.__table__.c.id == cart_item.c.product_id),
+        and_(cart_item.c.variation_id.isnot(None),
+             ~db.exists().where(ProductVariation.__table__.c.id == cart_item.c.variation_id))
+    )))
+
+def swap_staging_tables(conn, tables):
+    """מחליף את הטבלאות החיות בתוכן הטבלאות הזמניות. רץ בתוך טרנזקציה אחת."""
+    factor = vat_factor(conn)
+    # מחיקה מהטבלה המפנה אל טבלת היעד, הכנסה בסדר ההפוך
+    for name, model, _, _ in reversed(IMPORT_ALL_TABLES):
+        if name in tables:
+            conn.execute(db.delete(model.__table__))
+    
+    for name, model, columns, _ in IMPORT_ALL_TABLES:
+        if name not in tables:
+            continue
+        table = tables[name]
+        target = model.__table__
+        selected = [table.c[column] for column in columns]
+        insert_columns = list(columns)
+        if 'price_with_vat' in columns:
+            selected.append(table.c.price_with_vat / factor)  # חישוב מחיר ללא מע"מ
+            insert_columns.append('price_without_vat')
+        
+        # שורות עם מזהה נשמרות עם אותו מזהה (כדי שההפניות בין הקבצים יישמרו), השאר מקבלות מזהה חדש
+        conn.execute(target.insert().from_select(
+            insert_columns, db.select(*selected).where(table.c.id.isnot(None)).order_by(table.c.line)
+        ))
+        sync_id_sequence(conn, target)
+        conn.execute(target.insert().from_select(
+            insert_columns[1:], db.select(*selected[1:]).where(table.c.id.is_(None)).order_by(table.c.line)
+        ))
+    
+    delete_stale_cart_items(conn)
+
+def match_staging_rows(conn, tables):
+    """ממלא target_id בכל שורה בקובץ: לפי id אם קיים, אחרת לפי המפתח הטבעי."""
+    for name, model, _, _ in IMPORT_ALL_TABLES:
+        if name not in tables:
+            continue
+        table = tables[name]
+        live = model.__table__
+        conn.execute(db.update(table).where(table.c.id.isnot(None)).values(
+            target_id=db.select(live.c.id).where(live.c.id == table.c.id).scalar_subquery()
+        ))
+        # התאמה לפי מפתח טבעי כ-UPDATE ... FROM מול טבלה מקובצת, כדי שלא תתבצע סריקה של הטבלה לכל שורה
+        keys = IMPORT_ALL_NATURAL_KEYS[name]
+        existing = (
+            db.select(db.func.min(live.c.id).label('id'), *[live.c[key] for key in keys])
+            .group_by(*[live.c[key] for key in keys])
+            .subquery()
+        )
+        conn.execute(
+            db.update(table)
+            .where(table.c.id.is_(None), *[existing.c[key] == table.c[key] for key in keys])
+            .values(target_id=existing.c.id)
+        )
+
+def upsert_staging_tables(conn, tables, delete_missing=False):
+    """מעדכן את הטבלאות החיות מתוך הטבלאות הזמניות בלי להחליף אותן.
 
-@app.route('/import-all', methods=['POST'])
+    רק שורות שתוכנן השתנה נכתבות, ומזהי הרשומות הקיימות נשמרים (כך שהפניות מהזמנות וסלים נשארות תקינות).
+    מחזיר לכל טבלה את מספר השורות שנוספו, עודכנו, לא השתנו ונמחקו.
+    """
+    counts = {name: {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0} for name in tables}
+    factor = vat_factor(conn)
+    
+    if delete_missing:
+        # מחיקה מהטבלה המפנה אל טבלת היעד
+        for name, model, _, _ in reversed(IMPORT_ALL_TABLES):
+            if name in tables:
+                live = model.__table__
+                matched = db.select(tables[name].c.target_id).where(tables[name].c.target_id.isnot(None))
+                counts[name]['deleted'] = conn.execute(db.delete(live).where(live.c.id.notin_(matched))).rowcount
+    
+    for name, model, columns, _ in IMPORT_ALL_TABLES:
+        if name not in tables:
+            continue
+        table = tables[name]
+        live = model.__table__
+        data_columns = [column for column in columns if column != 'id']
+        
+        # השוואה לפי עמודות במקום גיבוב של השורה: שורה שזהה לרשומה הקיימת לא נכתבת
+        changed = or_(*[live.c[column].is_distinct_from(table.c[column]) for column in data_columns])
+        values = {column: table.c[column] for column in data_columns}
+        if 'price_with_vat' in columns:
+            values['price_without_vat'] = table.c.price_with_vat / factor  # חישוב מחיר ללא מע"מ
+        counts[name]['updated'] = conn.execute(
+            db.update(live).where(live.c.id == table.c.target_id, changed).values(values)
+        ).rowcount
+        matched = conn.execute(db.select(db.func.count()).where(table.c.target_id.isnot(None))).scalar()
+        counts[name]['unchanged'] = matched - counts[name]['updated']
+        
+        selected = [table.c[column] for column in columns]
+        insert_columns = list(columns)
+        if 'price_with_vat' in columns:
+            selected.append(table.c.price_with_vat / factor)
+            insert_columns.append('price_without_vat')
+        new_rows = table.c.target_id.is_(None)
+        inserted = conn.execute(live.insert().from_select(
+            insert_columns, db.select(*selected).where(new_rows, table.c.id.isnot(None)).order_by(table.c.line)
+        )).rowcount
+        sync_id_sequence(conn, live)
+        inserted += conn.execute(live.insert().from_select(
+            insert_columns[1:], db.select(*selected[1:]).where(new_rows, table.c.id.is_(None)).order_by(table.c.line)
+        )).rowcount
+        counts[name]['inserted'] = inserted
+    
+    if delete_missing:
+        delete_stale_cart_items(conn)
+    return counts
+
+@bp.route('/import-all', methods=['POST'])
 def import_all():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
     
-    try:
-        # בדיקה אם יש קבצים שהועלו
-        if 'categories' not in request.files and 'products' not in request.files and 'variations' not in request.files:
-            return jsonify({'success': False, 'message': 'לא נבחרו קבצים לייבוא'})
-        
-        # ייבוא קטגוריות אם קיים
-        if 'categories' in request.files and request.files['categories'].filename:
-            categories_file = request.files['categories']
-            if categories_file.filename.endswith('.csv'):
-                categories_df = pd.read_csv(categories_file)
-                print(f"Found {len(categories_df)} categories to import")
-                
-                # מחיקת קטגוריות קיימות
-                Category.query.delete()
-                
-                # ייבוא קטגוריות חדשות
-                for _, row in categories_df.iterrows():
-                    category = Category(
-                        name=row['name'],
-                        image=row.get('image', None)  # שימוש ב-get עם ברירת מחדל
-                    )
-                    db.session.add(category)
-                db.session.commit()
-                print("Categories imported successfully")
-        
-        # ייבוא מוצרים אם קיים
-        if 'products' in request.files and request.files['products'].filename:
-            products_file = request.files['products']
-            if products_file.filename.endswith('.csv'):
-                products_df = pd.read_csv(products_file)
-                print(f"Found {len(products_df)} products to import")
-                
-                # מחיקת מוצרים קיימים
-                Product.query.delete()
-                
-                # ייבוא מוצרים חדשים
-                for _, row in products_df.iterrows():
-                    # חישוב מחיר ללא מע"מ
-                    price_with_vat = float(row['price_with_vat'])
-                    price_without_vat = price_with_vat / 1.18
-                    
-                    product = Product(
-                        name=row['name'],
-                        price_with_vat=price_with_vat,
-                        price_without_vat=price_without_vat,
-                        image=row.get('image', None),  # שימוש ב-get עם ברירת מחדל
-                        category_id=row.get('category_id', None)  # שימוש ב-get עם ברירת מחדל
-                    )
-                    db.session.add(product)
-                db.session.commit()
-                print("Products imported successfully")
-        
-        # ייבוא וריאציות אם קיים
-        if 'variations' in request.files and request.files['variations'].filename:
-            variations_file = request.files['variations']
-            if variations_file.filename.endswith('.csv'):
-                variations_df = pd.read_csv(variations_file)
-                print(f"Found {len(variations_df)} variations to import")
-                
-                # מחיקת וריאציות קיימות
-                ProductVariation.query.delete()
-                
-                # ייבוא וריאציות חדשות
-                for _, row in variations_df.iterrows():
-                    # חישוב מחיר ללא מע"מ
-                    price_with_vat = float(row['price_with_vat'])
-                    price_without_vat = price_with_vat / 1.18
-                    
-                    variation = ProductVariation(
-                        product_id=row['product_id'],
-                        name=row['name'],
-                        price_with_vat=price_with_vat,
-                        price_without_vat=price_without_vat,
-                        image=row.get('image', None)  # שימוש ב-get עם ברירת מחדל
-                    )
-                    db.session.add(variation)
-                db.session.commit()
-                print("Variations imported successfully")
-        
-        return jsonify({'success': True, 'message': 'הנתונים יובאו בהצלחה'})
-        
-    except Exception as e:
-        db.session.rollback()
-        print(f"Error in import_all: {str(e)}")
-        return jsonify({'success': False, 'message': f'אירעה שגיאה בייבוא: {str(e)}'})
+    # replace - הקבצים מחליפים את הטבלאות; upsert - רק שורות שהשתנו מתעדכנות ונוספות
+    mode = request.form.get('mode', 'replace')
+    if mode not in ('replace', 'upsert'):
+        return jsonify({'success': False, 'message': 'מצב ייבוא לא מוכר'})
+    delete_missing = request.form.get('delete_missing') in ('1', 'true', 'on')
+    
+    files = {
+        name: request.files[name]
+        for name, _, _, _ in IMPORT_ALL_TABLES
+        if name in request.files and request.files[name].filename
+    }
+    if not files:
+        return jsonify({'success': False, 'message': 'לא נבחרו קבצים לייבוא'})
+    for file in files.values():
+        if not file.filename.endswith('.csv'):
+            return jsonify({'success': False, 'message': 'נא להעלות קבצי CSV בלבד'})
+    
+    # הקבצים נטענים בקבוצות לטבלאות זמניות ונבדקים שם. הטבלאות החיות מוחלפות רק אם הכל תקין,
+    # בטרנזקציה אחת קצרה - כך שקוראים אף פעם לא רואים קטלוג חלקי וכשל באמצע לא משאיר קטלוג ריק
+    with db.engine.connect() as conn:
+        metadata, tables = create_staging_tables(conn, files)
+        try:
+            counts = {}
+            for name, model, columns, _ in IMPORT_ALL_TABLES:
+                if name in tables:
+                    counts[name] = load_staging_table(conn, tables[name], files[name], model, columns)
+            
+            if mode == 'upsert':
+                match_staging_rows(conn, tables)
+            errors = validate_staging_tables(conn, tables, keep_live=(mode == 'upsert' and not delete_missing))
+            if errors:
+                conn.rollback()
+                return jsonify({
+                    'success': False,
+                    'message': f'הייבוא בוטל - נמצאו {len(errors)} שגיאות, לא בוצע שינוי בנתונים',
+                    'errors': errors[:IMPORT_MAX_REPORTED_ERRORS]
+                })
+            
+            if mode == 'upsert':
+                counts = upsert_staging_tables(conn, tables, delete_missing)
+                bump_catalog_version(conn)
+                conn.commit()
+                summary = ', '.join(
+                    f"{name}: {c['inserted']} נוספו, {c['updated']} עודכנו, {c['unchanged']} ללא שינוי, {c['deleted']} נמחקו"
+                    for name, c in counts.items()
+                )
+                return jsonify({'success': True, 'message': f'הנתונים עודכנו בהצלחה ({summary})', 'counts': counts})
+            
+            swap_staging_tables(conn, tables)
+            bump_catalog_version(conn)
+            conn.commit()
+            return jsonify({'success': True, 'message': 'הנתונים יובאו בהצלחה', 'counts': counts})
+        
+        except Exception as e:
+            conn.rollback()
+            current_app.logger.exception('import_all failed', extra={'fields': {'mode': mode}})
+            return jsonify({'success': False, 'message': f'אירעה שגיאה בייבוא: {str(e)}'})
+        finally:
+            metadata.drop_all(conn, checkfirst=True)
+            conn.commit()
 
-@app.route('/import-categories', methods=['POST'])
+@bp.route('/import-categories', methods=['POST'])
 def import_categories():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
@@ -1330,6 +3907,7 @@ def import_categories():
     
     try:
         # קריאת הקובץ CSV
+        import pandas as pd
         df = pd.read_csv(file, encoding='utf-8-sig')
         required_columns = ['name']
         
@@ -1349,6 +3927,7 @@ def import_categories():
             )
             db.session.add(category)
         
+        bump_catalog_version()
         db.session.commit()
         return jsonify({'success': True, 'message': 'הקטגוריות יובאו בהצלחה'})
         
@@ -1356,7 +3935,7 @@ def import_categories():
         db.session.rollback()
         return jsonify({'success': False, 'message': f'אירעה שגיאה בייבוא: {str(e)}'})
 
-@app.route('/upload-logo', methods=['POST'])
+@bp.route('/upload-logo', methods=['POST'])
 def upload_logo():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'נדרשת התחברות'})
@@ -1373,17 +3952,102 @@ def upload_logo():
     
     try:
         # וידוא שתיקיית ההעלאות קיימת
-        if not os.path.exists(app.config['UPLOAD_FOLDER']):
-            os.makedirs(app.config['UPLOAD_FOLDER'])
+        if not os.path.exists(current_app.config['UPLOAD_FOLDER']):
+            os.makedirs(current_app.config['UPLOAD_FOLDER'])
         
         # שמירת הקובץ בשם קבוע
         filename = 'logo.png'
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         file.save(file_path)
+        static_files.add(file_path)
         
         return jsonify({'success': True, 'message': 'הלוגו הועלה בהצלחה'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'אירעה שגיאה בהעלאת הלוגו: {str(e)}'})
 
+def create_app(config=None):
+    """יוצר את האפליקציה. ההגדרות נקראות מהסביבה; config דורס אותן (בדיקות, בנצ'מרקים, תהליכי PDF).
+
+    אין כאן פנייה למסד הנתונים - בכל פריסה מריצים flask init-db ואחריו flask db upgrade.
+    הרצה עם gunicorn: gunicorn 'app:create_app()'
+    """
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'your-secret-key-here'
+    # מסד הנתונים נקבע מהסביבה - ברירת המחדל היא SQLite מקומי.
+    # לפריסות גדולות אפשר DATABASE_URL=postgresql://... (דורש התקנת psycopg2)
+    database_url = os.environ.get('DATABASE_URL', 'sqlite:///inventory.db')
+    if database_url.startswith('postgres://'):
+        database_url = 'postgresql://' + database_url[len('postgres://'):]
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_pre_ping': True,
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),  # שניות
+    }
+    if not database_url.startswith('sqlite'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'].update(
+            pool_size=int(os.environ.get('DB_POOL_SIZE', 5)),
+            max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+            pool_timeout=int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        )
+    # הגדרות SQLite לכל חיבור חדש. WAL מאפשר לקוראים לעבוד במקביל לכתיבה,
+    # ו-busy_timeout גורם לכותב להמתין לנעילה במקום להיכשל מיד ב-"database is locked".
+    # ערך ריק מבטל את ההגדרה
+    app.config['SQLITE_PRAGMAS'] = {
+        'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'busy_timeout': os.environ.get('SQLITE_BUSY_TIMEOUT', '5000'),  # מילישניות
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),  # בטוח עם WAL, חוסך fsync בכל commit
+        'mmap_size': os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)),
+        'cache_size': os.environ.get('SQLITE_CACHE_SIZE', '-65536'),  # שלילי = KiB, כלומר 64MB
+    }
+    app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO')
+    app.config['LOG_FORMAT'] = os.environ.get('LOG_FORMAT', 'json')  # json או text
+    app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 200))  # שאילתות איטיות מזה נרשמות בלוג
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')  # אם מוגדר, /metrics דורש Authorization: Bearer
+    app.config['UPLOAD_FOLDER'] = 'static/uploads'
+    app.config['THUMBNAIL_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'thumbs')
+    app.config['THUMBNAIL_SIZE'] = 400  # פיקסלים - הצלע הארוכה של התמונה המוקטנת
+    app.config['THUMBNAIL_WORKERS'] = 2  # threads ליצירת תמונות מוקטנות ברקע
+    app.config['UPLOAD_CACHE_MAX_AGE'] = 365 * 24 * 3600  # שניות - קבצים לפי hash לעולם לא משתנים
+    app.config['UPLOAD_GC_GRACE_SECONDS'] = 3600  # קבצים חדשים מזה לא נמחקים, גם אם אין להם הפניה
+    app.config['STATIC_MANIFEST_CHECK_SECONDS'] = float(os.environ.get('STATIC_MANIFEST_CHECK_SECONDS', 2))  # תדירות בדיקת mtime של התיקיות
+    app.config['CATALOG_PAGE_SIZE'] = 60  # מספר מוצרים בעמוד בקטלוג
+    app.config['CATALOG_MAX_PAGE_SIZE'] = 200
+    app.config['CATALOG_CACHE_SIZE'] = int(os.environ.get('CATALOG_CACHE_SIZE', 256))  # עמודי קטלוג מרונדרים בזיכרון של כל worker
+    app.config['CATALOG_CACHE_DIR'] = os.environ.get('CATALOG_CACHE_DIR')  # אם מוגדר, מטמון משותף על הדיסק לכל ה-workers
+    app.config['CATALOG_CACHE_DISK_ENTRIES'] = int(os.environ.get('CATALOG_CACHE_DISK_ENTRIES', 4096))  # מספר העמודים המרבי במטמון שעל הדיסק
+    app.config['SEARCH_PREFIX_INDEX'] = os.environ.get('SEARCH_PREFIX_INDEX', '1') != '0'  # השלמה אוטומטית מאינדקס בזיכרון
+    app.config['SEARCH_INDEX_CHECK_SECONDS'] = float(os.environ.get('SEARCH_INDEX_CHECK_SECONDS', 2))  # תדירות בדיקת שינויים מ-workers אחרים
+    app.config['BATCH_MAX_IDS'] = 500  # מספר מזהים מרבי בבקשת get-products/get-variations/get-customers
+    app.config['VAT_RATE'] = float(os.environ.get('VAT_RATE', 18))  # אחוזים - כשאין שיעור בתוקף בטבלת vat_rate
+    app.config['REPRICE_PREVIEW_ROWS'] = 20  # שורות לדוגמה בתצוגה מקדימה של שינוי מחירים
+    app.config['ORDERS_PAGE_SIZE'] = 25  # מספר הזמנות בעמוד בהיסטוריית ההזמנות
+    app.config['ORDERS_MAX_PAGE_SIZE'] = 100
+    app.config['PDF_JOB_WORKERS'] = 2  # תהליכים לרינדור PDF במצב אסינכרוני
+    app.config['PDF_JOB_MAX_PENDING'] = 20
+    app.config['PDF_JOB_TTL'] = 3600  # שניות עד שקובץ PDF מוכן נמחק
+    app.config['PDF_JOB_FOLDER'] = os.path.join(app.instance_path, 'pdf_jobs')
+    app.config['ORDER_EXPORT_CHUNK_SIZE'] = 50  # הזמנות שנטענות ומרונדרות בכל סבב בייצוא מרוכז
+    app.config['ORDER_EXPORT_PDF_MAX_ORDERS'] = int(os.environ.get('ORDER_EXPORT_PDF_MAX_ORDERS', 200))  # הזמנות בקובץ PDF מאוחד (נבנה כולו בזיכרון)
+    app.config['EXPORT_CHUNK_SIZE'] = 1000  # שורות שנקראות בכל סבב בייצוא הכל
+    app.config['IMPORT_CHUNK_SIZE'] = 1000  # שורות בכל executemany ובכל קבוצת קריאה מ-CSV בייבוא
+    app.config.update(config or {})
+
+    log_handler.setFormatter(StructuredLogFormatter(json_output=app.config['LOG_FORMAT'] == 'json'))
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(log_handler)
+    app.logger.setLevel(app.config['LOG_LEVEL'])
+
+    db.init_app(app)
+    if click.get_current_context(silent=True) is not None:
+        # flask-migrate טוען את alembic (כחמישית מזמן ה-import) - נדרש רק לפקודות flask db
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    static_files.init_app(app)
+    catalog_cache.init_app(app)
+    search_index.init_app(app)
+    app.register_blueprint(bp)
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    return app
+
 if __name__ == '__main__':
-    app.run(debug=True) 
\ No newline at end of file
+    create_app().run(debug=True)
@@ -0,0 +1,147 @@
+"""בנצ'מרק קריאה/כתיבה מקבילית על SQLite - הגדרות ברירת המחדל מול WAL והגדרות החיבור של האפליקציה.
+
+כל worker הוא תהליך נפרד עם מאגר חיבורים משלו, כמו workers של gunicorn.
+קוראים מבקשים את /products ו-/orders-history, כותבים שומרים הזמנות דרך save_new_order.
+
+הרצה מתיקיית הפרויקט:
+    python benchmarks/concurrent_rw.py --readers 6 --writers 2 --seconds 10
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from datagen import generate, load_app
+
+# ערך ריק מבטל את ה-PRAGMA, כך ש-baseline רץ עם ברירות המחדל של SQLite
+CONFIGURATIONS = {
+    'baseline': {
+        'SQLITE_JOURNAL_MODE': '', 'SQLITE_BUSY_TIMEOUT': '', 'SQLITE_SYNCHRONOUS': '',
+        'SQLITE_MMAP_SIZE': '', 'SQLITE_CACHE_SIZE': '',
+    },
+    'tuned': {},
+}
+
+
+def seed(database_path, environment, products):
+    generate(*load_app(database_path, environment), products)
+
+
+def reader(database_path, environment, seconds, results):
+    app, application = load_app(database_path, environment)
+    application.config['PROPAGATE_EXCEPTIONS'] = True
+    client = application.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session['user_id'] = 1
+    latencies, errors = [], 0
+    paths = ['/products?sort=price_asc', '/orders-history', '/products?category=3']
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            response = client.get(paths[len(latencies) % len(paths)])
+            if response.status_code != 200:
+                errors += 1
+                continue
+        except OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    results.put({'kind': 'read', 'latencies': latencies, 'errors': errors})
+
+
+def writer(database_path, environment, seconds, results):
+    app, application = load_app(database_path, environment)
+    db = app.db
+    latencies, errors = [], 0
+    with application.app_context():
+        customer = db.session.get(app.Customer, 1)
+        products = app.Product.query.limit(5).all()
+        items = [
+            {'product': product, 'quantity': 2, 'total_with_vat': product.price_with_vat * 2,
+             'total_without_vat': product.price_without_vat * 2}
+            for product in products
+        ]
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                app.save_new_order(customer, items, 100, 118)
+            except OperationalError:
+                db.session.rollback()
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+    results.put({'kind': 'write', 'latencies': latencies, 'errors': errors})
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(name, args):
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, 'bench.db')
+        environment = CONFIGURATIONS[name]
+        process = context.Process(target=seed, args=(database_path, environment, args.products))
+        process.start()
+        process.join()
+
+        results = context.Queue()
+        workers = [context.Process(target=reader, args=(database_path, environment, args.seconds, results))
+                   for _ in range(args.readers)]
+        workers += [context.Process(target=writer, args=(database_path, environment, args.seconds, results))
+                    for _ in range(args.writers)]
+        for worker in workers:
+            worker.start()
+        collected = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+
+    summary = {'configuration': name}
+    for kind in ('read', 'write'):
+        latencies = [value for result in collected if result['kind'] == kind for value in result['latencies']]
+        summary[kind] = {
+            'ops_per_second': round(len(latencies) / args.seconds, 1),
+            'errors': sum(result['errors'] for result in collected if result['kind'] == kind),
+            'p50_ms': round(statistics.median(latencies) * 1000, 2) if latencies else 0.0,
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=6)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--json', help='שמירת התוצאות לקובץ JSON')
+    args = parser.parse_args()
+
+    summaries = [run(name, args) for name in CONFIGURATIONS]
+    for summary in summaries:
+        for kind in ('read', 'write'):
+            stats = summary[kind]
+            print(f"{summary['configuration']:8} {kind:5} {stats['ops_per_second']:8.1f} ops/s  "
+                  f"p50 {stats['p50_ms']:7.2f}ms  p95 {stats['p95_ms']:7.2f}ms  p99 {stats['p99_ms']:7.2f}ms  "
+                  f"errors {stats['errors']}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as output:
+            json.dump(summaries, output, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""מחולל נתונים סינתטיים לבנצ'מרקים - קטגוריות, מוצרים, וריאציות, לקוחות והזמנות עם שמות בעברית.
+
+הנתונים דטרמיניסטיים לפי seed, כך שריצות שונות משוות את אותו מסד נתונים.
+"""
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PRODUCT_WORDS = ['שוקולד', 'גבינה', 'חלב', 'לחם', 'עוגה', 'במבה', 'ביסלי', 'קפה', 'תה', 'אורז',
+                 'פסטה', 'שמן זית', 'טחינה', 'חומוס', 'דבש', 'ריבה', 'עוגיות', 'קרקרים', 'יוגורט', 'מיץ']
+ADJECTIVES = ['מריר', 'לבן', 'מלא', 'אורגני', 'טרי', 'קלוי', 'מתוק', 'חריף', 'דל שומן', 'ביתי']
+BRANDS = ['עלית', 'תנובה', 'אסם', 'שטראוס', 'ויסוצקי', 'סוגת', 'יטבתה', 'מאפיית ברמן']
+FLAVORS = ['וניל', 'תות', 'אבטיח', 'מלון', 'לימון', 'נענע', 'קינמון', 'אגוזים', 'קרמל']
+CATEGORY_WORDS = ['מוצרי חלב', 'מאפים', 'חטיפים', 'משקאות', 'שימורים', 'תבלינים', 'קפואים', 'ירקות', 'פירות', 'ניקיון']
+FIRST_NAMES = ['משה', 'דוד', 'שרה', 'רחל', 'יוסי', 'נועה', 'אבי', 'מיכל', 'דנה', 'איתי', 'יעל', 'עומר']
+LAST_NAMES = ['כהן', 'לוי', 'מזרחי', 'פרץ', 'ביטון', 'אברהם', 'פרידמן', 'שפירא', 'דהן', 'אזולאי']
+CITIES = ['תל אביב', 'ירושלים', 'חיפה', 'באר שבע', 'נתניה', 'אשדוד', 'רחובות']
+
+# גדלי נתונים מוגדרים מראש: מוצרים, ושאר הטבלאות ביחס אליהם
+SCALES = {
+    'small': 1000,
+    'medium': 10000,
+    'large': 100000,
+}
+
+CHUNK_SIZE = 5000
+
+
+def load_app(database_path, environment=None):
+    """טוען את app.py מול מסד נתונים נפרד ויוצר בו את הטבלאות. מחזיר (המודול, האפליקציה).
+
+    יש לקרוא פעם אחת לכל תהליך - המטמונים והאינדקסים של app.py הם ברמת התהליך.
+    """
+    os.environ['DATABASE_URL'] = f'sqlite:///{database_path}'
+    os.environ.update(environment or {})
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    import app
+    application = app.create_app()
+    with application.app_context():
+        app.init_db()
+    return app, application
+
+
+def insert_chunks(db, model, rows):
+    for start in range(0, len(rows), CHUNK_SIZE):
+        db.session.execute(db.insert(model), rows[start:start + CHUNK_SIZE])
+
+
+def product_name(rng):
+    return f'{rng.choice(PRODUCT_WORDS)} {rng.choice(ADJECTIVES)} {rng.choice(BRANDS)}'
+
+
+def generate(app, application, products, categories=None, customers=None, orders=None, variation_every=3, seed=42):
+    """ממלא מסד נתונים ריק. מוצרים שמזהה שלהם מתחלק ב-variation_every מקבלים 2-3 וריאציות."""
+    rng = random.Random(seed)
+    db = app.db
+    factor = 1 + application.config['VAT_RATE'] / 100
+    categories = categories or max(5, products // 100)
+    customers = customers or max(10, products // 20)
+    orders = orders or max(10, products // 2)
+
+    with application.app_context():
+        insert_chunks(db, app.Category, [
+            {'id': i + 1, 'name': f'{CATEGORY_WORDS[i % len(CATEGORY_WORDS)]} {i // len(CATEGORY_WORDS) + 1}'}
+            for i in range(categories)
+        ])
+
+        prices = {}
+        product_rows, variation_rows = [], []
+        for product_id in range(1, products + 1):
+            price = round(rng.uniform(3, 120), 2)
+            prices[product_id] = price
+            product_rows.append({
+                'id': product_id, 'name': product_name(rng), 'price_with_vat': price,
+                'price_without_vat': price / factor, 'category_id': rng.randint(1, categories)
+            })
+            if product_id % variation_every == 0:
+                for flavor in rng.sample(FLAVORS, rng.randint(2, 3)):
+                    variation_price = round(price * rng.uniform(0.9, 1.2), 2)
+                    variation_rows.append({
+                        'product_id': product_id, 'name': flavor, 'price_with_vat': variation_price,
+                        'price_without_vat': variation_price / factor
+                    })
+        insert_chunks(db, app.Product, product_rows)
+        insert_chunks(db, app.ProductVariation, variation_rows)
+
+        insert_chunks(db, app.Customer, [
+            {'id': i + 1, 'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+             'address': f'{rng.choice(CITIES)}, רחוב {rng.randint(1, 200)}',
+             'phone': f'05{rng.randint(0, 9)}-{rng.randint(1000000, 9999999)}'}
+            for i in range(customers)
+        ])
+
+        # הזמנות פרוסות על פני שנתיים אחורה
+        start = datetime.utcnow() - timedelta(days=730)
+        order_rows, item_rows = [], []
+        for order_id in range(1, orders + 1):
+            total = 0.0
+            for _ in range(rng.randint(1, 6)):
+                product_id = rng.randint(1, products)
+                quantity = rng.randint(1, 10)
+                price = prices[product_id]
+                total += price * quantity
+                item_rows.append({
+                    'order_id': order_id, 'product_id': product_id, 'quantity': quantity,
+                    'price_with_vat': price, 'price_without_vat': price / factor,
+                    'product_name': product_rows[product_id - 1]['name']
+                })
+            order_rows.append({
+                'id': order_id, 'customer_id': rng.randint(1, customers),
+                'date': start + timedelta(minutes=rng.randint(0, 730 * 24 * 60)),
+                'total_with_vat': total, 'total_without_vat': total / factor
+            })
+        insert_chunks(db, app.Order, order_rows)
+        insert_chunks(db, app.OrderItem, item_rows)
+        db.session.commit()
+
+    return {'categories': categories, 'products': products, 'variations': len(variation_rows),
+            'customers': customers, 'orders': orders, 'order_items': len(item_rows)}
+
+
+def products_csv(rows, category_id=1, seed=7):
+    """קובץ CSV לייבוא מוצרים ב-/import-products."""
+    rng = random.Random(seed)
+    lines = ['name,price_with_vat,category_id,variation_1_name,variation_1_price_with_vat']
+    for _ in range(rows):
+        price = round(rng.uniform(3, 120), 2)
+        lines.append(f'{product_name(rng)},{price},{category_id},{rng.choice(FLAVORS)},{price + 1}')
+    return '\n'.join(lines).encode('utf-8')
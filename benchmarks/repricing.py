@@ -0,0 +1,66 @@
+"""בנצ'מרק לשינוי מחירים בכל הקטלוג - UPDATE מרוכז (apply_reprice) מול עדכון שורה-שורה דרך ה-ORM.
+
+שתי השיטות מעלות את כל המחירים ב-5% ומחשבות מחדש את המחיר ללא מע"מ, על אותו מסד נתונים.
+נמדדים זמן כולל ומספר פקודות SQL. השיטה המרוכזת כוללת גם את רישום היסטוריית המחירים.
+
+הרצה מתיקיית הפרויקט:
+    python benchmarks/repricing.py --products 20000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import datagen
+
+
+def orm_reprice(app, percent):
+    """הדרך הקודמת: טעינת כל מוצר ווריאציה ועדכון כל אחד בנפרד."""
+    factor = app.vat_factor()
+    for model in (app.Product, app.ProductVariation):
+        for row in model.query.all():
+            row.price_with_vat = round(row.price_with_vat * (1 + percent / 100), 2)
+            row.price_without_vat = row.price_with_vat / factor
+    app.bump_catalog_version()
+    app.db.session.commit()
+
+
+def set_based_reprice(app, percent):
+    spec, _ = app.parse_reprice_request({'adjustment': 'percent', 'value': percent})
+    app.apply_reprice(spec, app.vat_factor())
+    app.db.session.commit()
+
+
+def measure(app, statements, function):
+    statements[0] = 0
+    start = time.perf_counter()
+    function(app, 5)
+    return time.perf_counter() - start, statements[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=20000)
+    args = parser.parse_args()
+
+    database_path = os.path.join(tempfile.mkdtemp(prefix='repricing-'), 'bench.db')
+    app, application = datagen.load_app(database_path, {'LOG_LEVEL': 'WARNING', 'SEARCH_PREFIX_INDEX': '0'})
+    counts = datagen.generate(app, application, args.products, orders=10)
+    print(f"מוצרים: {counts['products']}, וריאציות: {counts['variations']}")
+
+    statements = [0]
+    with application.app_context():
+        @app.event.listens_for(app.db.engine, 'before_cursor_execute')
+        def count_statement(*args):
+            statements[0] += 1
+
+        for name, function in (('ORM, שורה-שורה', orm_reprice), ('UPDATE מרוכז', set_based_reprice)):
+            seconds, executed = measure(app, statements, function)
+            app.db.session.remove()
+            print(f"  {name:16} {seconds * 1000:10.1f}ms  {executed:8} פקודות SQL")
+
+
+if __name__ == '__main__':
+    main()
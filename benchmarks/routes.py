@@ -0,0 +1,196 @@
+"""בנצ'מרק לכל הנתיבים של האפליקציה, דרך ה-test client של Flask, בכמה גדלי נתונים.
+
+לכל נתיב נמדדים p50/p95/p99 של זמן התגובה, מספר שאילתות SQL לבקשה ושיא הזיכרון (tracemalloc).
+התוצאות נשמרות כ-JSON, ואפשר להשוות מול ריצה קודמת.
+
+הרצה מתיקיית הפרויקט:
+    python benchmarks/routes.py --scales small,medium
+    python benchmarks/routes.py --scales small --compare benchmarks/results/<קודם>.json
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import datagen
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def scenarios(app, counts):
+    """(שם, פונקציה שמקבלת client ומחזירה response, מספר חזרות)."""
+    product_without_variations = 1
+    product_with_variations = 3
+    variation = app.ProductVariation.query.filter_by(product_id=product_with_variations).first()
+    # כמו products.html - מחיר הווריאציה נשלח עם הבקשה
+    variation_payload = {'quantity': 1, 'variation_id': variation.id, 'price_with_vat': variation.price_with_vat,
+                         'price_without_vat': variation.price_without_vat}
+
+    def add_to_cart(client):
+        return client.post(f'/add-to-cart/{product_without_variations}', json={'quantity': 1})
+
+    def add_variation_to_cart(client):
+        return client.post(f'/add-to-cart/{product_with_variations}', json=variation_payload)
+
+    def import_products(client):
+        data = {'file': (io.BytesIO(datagen.products_csv(200)), 'products.csv'), 'category_id': '1'}
+        return client.post('/import-products', data=data, content_type='multipart/form-data')
+
+    return [
+        ('GET /', lambda client: client.get('/'), 30),
+        ('GET /products', lambda client: client.get('/products'), 30),
+        ('GET /products?search', lambda client: client.get('/products?search=שוקולד'), 30),
+        ('GET /products?category', lambda client: client.get('/products?category=2'), 30),
+        ('GET /products?sort=price_asc', lambda client: client.get('/products?sort=price_asc'), 30),
+        ('GET /products?sort=price_desc&category', lambda client: client.get('/products?sort=price_desc&category=2'), 30),
+        ('GET /search-products', lambda client: client.get('/search-products?q=שוק'), 50),
+        ('POST /add-to-cart', add_to_cart, 30),
+        ('POST /add-to-cart variation', add_variation_to_cart, 30),
+        ('GET /cart', lambda client: client.get('/cart'), 30),
+        ('GET /export-pdf', lambda client: client.get('/export-pdf?customer_id=1&type=warehouse'), 10),
+        ('GET /orders-history', lambda client: client.get('/orders-history'), 30),
+        ('GET /export-all', lambda client: client.get('/export-all'), 3),
+        ('POST /import-products (200 rows)', import_products, 5),
+    ]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def measure(client, request, iterations, queries):
+    def call():
+        response = request(client)
+        body = response.get_data()  # כולל תשובות בסטרימינג
+        return response.status_code, len(body)
+
+    status, size = call()  # חימום
+    latencies, query_counts, errors = [], [], 0
+    for _ in range(iterations):
+        queries[0] = 0
+        start = time.perf_counter()
+        status, size = call()
+        latencies.append(time.perf_counter() - start)
+        query_counts.append(queries[0])
+        errors += status >= 400
+
+    # שיא הזיכרון נמדד בקריאה נפרדת, כי tracemalloc מאט את הריצה
+    tracemalloc.start()
+    call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'queries': round(statistics.mean(query_counts), 1),
+        'peak_memory_kb': round(peak / 1024, 1),
+        'response_bytes': size,
+        'errors': errors,
+    }
+
+
+def run_scale(scale, results):
+    with tempfile.TemporaryDirectory() as directory:
+        app, application = datagen.load_app(os.path.join(directory, 'bench.db'))
+        counts = datagen.generate(app, application, datagen.SCALES[scale])
+
+        queries = [0]
+        with application.app_context():
+            engine = app.db.engine
+
+        @app.event.listens_for(engine, 'before_cursor_execute')
+        def count_query(*args):
+            queries[0] += 1
+
+        client = application.test_client()
+        with client.session_transaction() as flask_session:
+            flask_session['user_id'] = 1
+
+        routes = {}
+        with application.app_context():
+            route_scenarios = scenarios(app, counts)
+        for name, request, iterations in route_scenarios:
+            routes[name] = measure(client, request, iterations, queries)
+            print(f"{scale:7} {name:40} p50 {routes[name]['p50_ms']:9.2f}ms  p95 {routes[name]['p95_ms']:9.2f}ms  "
+                  f"queries {routes[name]['queries']:6}  peak {routes[name]['peak_memory_kb']:9.1f}KB  "
+                  f"errors {routes[name]['errors']}", flush=True)
+        results.put({'scale': scale, 'counts': counts, 'routes': routes})
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=datagen.ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, previous_path):
+    with open(previous_path, encoding='utf-8') as previous_file:
+        previous = json.load(previous_file)
+    print(f"\nהשוואה מול {previous_path} ({previous.get('revision')})")
+    for scale, result in current['scales'].items():
+        old_routes = previous['scales'].get(scale, {}).get('routes', {})
+        for name, stats in result['routes'].items():
+            if name not in old_routes:
+                continue
+            old = old_routes[name]
+            change = (stats['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100 if old['p50_ms'] else 0.0
+            print(f"{scale:7} {name:40} p50 {old['p50_ms']:9.2f} -> {stats['p50_ms']:9.2f}ms ({change:+6.1f}%)  "
+                  f"queries {old['queries']} -> {stats['queries']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', default='small', help=f"מתוך: {', '.join(datagen.SCALES)}")
+    parser.add_argument('--output', help='קובץ התוצאות (ברירת מחדל: benchmarks/results/<זמן>.json)')
+    parser.add_argument('--compare', help='קובץ תוצאות של ריצה קודמת להשוואה')
+    args = parser.parse_args()
+
+    scales = [scale.strip() for scale in args.scales.split(',') if scale.strip()]
+    unknown = [scale for scale in scales if scale not in datagen.SCALES]
+    if unknown:
+        parser.error(f"גודל לא מוכר: {', '.join(unknown)}")
+
+    # כל גודל רץ בתהליך נפרד, כי המטמונים והאינדקסים של app.py הם ברמת התהליך
+    context = multiprocessing.get_context('spawn')
+    current = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'scales': {},
+    }
+    for scale in scales:
+        results = context.Queue()
+        process = context.Process(target=run_scale, args=(scale, results))
+        process.start()
+        result = results.get()
+        process.join()
+        current['scales'][scale] = {'counts': result['counts'], 'routes': result['routes']}
+
+    output = args.output or os.path.join(RESULTS_FOLDER, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as output_file:
+        json.dump(current, output_file, ensure_ascii=False, indent=2)
+    print(f"\nהתוצאות נשמרו ב-{output}")
+
+    if args.compare:
+        compare(current, args.compare)
+
+
+if __name__ == '__main__':
+    main()
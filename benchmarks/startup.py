@@ -0,0 +1,128 @@
+"""בנצ'מרק לזמן עלייה (cold start) של האפליקציה - מה שכל worker של gunicorn וכל פקודת CLI משלמים.
+
+כל מדידה רצה בתהליך פייתון חדש מול מסד נתונים קיים: זמן ה-import, יצירת האפליקציה,
+הבקשה הראשונה (/login), שיא הזיכרון ואילו ספריות כבדות נטענו. בנוסף נמדד זמן העלייה של
+כמה workers במקביל, כמו gunicorn בלי --preload.
+עם --baseline נמדדת גם גרסה קודמת מה-git (למשל לפני המעבר ל-create_app) להשוואה.
+
+הרצה מתיקיית הפרויקט:
+    python benchmarks/startup.py
+    python benchmarks/startup.py --baseline HEAD~1 --workers 4
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ['pandas', 'numpy', 'fpdf', 'arabic_reshaper', 'bidi', 'PIL.Image']
+
+# גרסאות לפני create_app חושפות app ברמת המודול, ויוצרות את הטבלאות בזמן ה-import
+CHILD = f'''
+import json, resource, sys, time
+start = time.perf_counter()
+import app as module
+imported = time.perf_counter()
+application = module.create_app() if hasattr(module, 'create_app') else module.app
+created = time.perf_counter()
+if sys.argv[1] == 'prepare':
+    if hasattr(module, 'init_db') and hasattr(module, 'create_app'):
+        with application.app_context():
+            module.init_db()
+    sys.exit(0)
+response = application.test_client().get('/login')
+served = time.perf_counter()
+print(json.dumps({{
+    'import_ms': (imported - start) * 1000,
+    'create_ms': (created - imported) * 1000,
+    'first_request_ms': (served - created) * 1000,
+    'status': response.status_code,
+    'heavy_modules': [name for name in {HEAVY_MODULES!r} if name in sys.modules],
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}}))
+'''
+
+
+def start_child(tree, environment, mode='measure'):
+    return subprocess.Popen([sys.executable, '-c', CHILD, mode], cwd=tree, env=environment,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+
+
+def run_child(tree, environment, mode='measure'):
+    start = time.perf_counter()
+    child = start_child(tree, environment, mode)
+    output, _ = child.communicate()
+    if child.returncode != 0:
+        raise RuntimeError(f'התהליך נכשל ב-{tree} (קוד {child.returncode})')
+    result = json.loads(output) if mode == 'measure' else {}
+    result['process_ms'] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def parallel_boot(tree, environment, workers):
+    """זמן עד שכל ה-workers ענו לבקשה הראשונה, כשכולם עולים יחד."""
+    start = time.perf_counter()
+    children = [start_child(tree, environment) for _ in range(workers)]
+    for child in children:
+        child.communicate()
+    return (time.perf_counter() - start) * 1000
+
+
+def extract_revision(revision, directory):
+    archive = subprocess.run(['git', 'archive', revision], cwd=ROOT, capture_output=True, check=True).stdout
+    subprocess.run(['tar', '-x', '-C', directory], input=archive, check=True)
+    return directory
+
+
+def measure_tree(name, tree, runs, workers, scratch):
+    environment = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(scratch, f'{name}.db')}",
+                       LOG_LEVEL='WARNING', PYTHONDONTWRITEBYTECODE='1')
+    run_child(tree, environment, 'prepare')  # יצירת הטבלאות - לא חלק מהמדידה
+    run_child(tree, environment)  # חימום של מטמון הקבצים של מערכת ההפעלה
+    samples = [run_child(tree, environment) for _ in range(runs)]
+    summary = {key: statistics.median(sample[key] for sample in samples)
+               for key in ('import_ms', 'create_ms', 'first_request_ms', 'process_ms', 'max_rss_mb')}
+    summary['status'] = samples[-1]['status']
+    summary['heavy_modules'] = samples[-1]['heavy_modules']
+    summary['parallel_ms'] = statistics.median(parallel_boot(tree, environment, workers) for _ in range(runs))
+    return summary
+
+
+def report(name, summary, workers):
+    print(f"{name}:")
+    print(f"  import {summary['import_ms']:8.1f}ms  create_app {summary['create_ms']:7.1f}ms  "
+          f"בקשה ראשונה {summary['first_request_ms']:7.1f}ms  (סטטוס {summary['status']})")
+    print(f"  תהליך שלם {summary['process_ms']:8.1f}ms  שיא זיכרון {summary['max_rss_mb']:6.1f}MB")
+    print(f"  {workers} workers במקביל: {summary['parallel_ms']:8.1f}ms")
+    print(f"  ספריות כבדות שנטענו: {', '.join(summary['heavy_modules']) or 'אין'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='מדידות לכל גרסה (מוצג החציון)')
+    parser.add_argument('--workers', type=int, default=4, help='מספר ה-workers שעולים במקביל')
+    parser.add_argument('--baseline', help='גרסת git להשוואה, למשל HEAD~1')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='startup-') as scratch:
+        trees = [('נוכחי', ROOT)]
+        if args.baseline:
+            trees.insert(0, (args.baseline, extract_revision(args.baseline, tempfile.mkdtemp(dir=scratch))))
+        results = {}
+        for index, (name, tree) in enumerate(trees):
+            results[name] = measure_tree(f'tree{index}', tree, args.runs, args.workers, scratch)
+            report(name, results[name], args.workers)
+        if args.baseline:
+            before, after = results[args.baseline], results['נוכחי']
+            for key, label in (('process_ms', 'תהליך שלם'), ('parallel_ms', f'{args.workers} workers')):
+                change = (after[key] - before[key]) / before[key] * 100
+                print(f"{label}: {before[key]:.1f}ms -> {after[key]:.1f}ms ({change:+.1f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""בנצ'מרק להשלמה האוטומטית - אינדקס התחיליות בזיכרון מול חיפוש FTS במסד הנתונים.
+
+נמדדים זמן הבנייה של האינדקס, הזיכרון שהוא תופס, וזמן שאילתה (p50/p95/p99) לתחיליות באורכים שונים,
+לשאילתות של כמה מילים ולשאילתות בלי תוצאות - גם ישירות וגם דרך /search-products.
+
+הרצה מתיקיית הפרויקט (100 אלף מוצרים ועוד כ-80 אלף שמות וריאציות):
+    python benchmarks/typeahead.py --products 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import datagen
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+    return {'p50': statistics.median(ordered) * 1000, 'p95': at(0.95), 'p99': at(0.99)}
+
+
+def query_sets(rng, count):
+    """שאילתות כמו שמשתמש מקליד: תחיליות של מילה אחת, שתי מילים, ושאילתות שלא נמצאות."""
+    words = datagen.PRODUCT_WORDS + datagen.ADJECTIVES + datagen.BRANDS + datagen.FLAVORS
+    words = [word for phrase in words for word in phrase.split()]
+    sets = {}
+    for length in (2, 3, 5):
+        sets[f'prefix {length}'] = [word[:length] for word in (rng.choice(words) for _ in range(count))
+                                    if len(word) >= length]
+    sets['two words'] = [f'{rng.choice(datagen.PRODUCT_WORDS)} {rng.choice(datagen.BRANDS)[:3]}' for _ in range(count)]
+    sets['no match'] = [f'זזז{i}' for i in range(count)]
+    return sets
+
+
+def measure(function, queries):
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        function(query)
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def report(name, stats):
+    print(f"  {name:32} p50 {stats['p50']:8.3f}ms  p95 {stats['p95']:8.3f}ms  p99 {stats['p99']:8.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=500, help='שאילתות בכל קבוצה')
+    args = parser.parse_args()
+
+    database_path = os.path.join(tempfile.mkdtemp(prefix='typeahead-'), 'bench.db')
+    app, application = datagen.load_app(database_path, {'LOG_LEVEL': 'WARNING'})
+    counts = datagen.generate(app, application, args.products, orders=10)
+    print(f"מוצרים: {counts['products']}, וריאציות: {counts['variations']}")
+
+    with application.app_context():
+        tracemalloc.start()
+        start = time.perf_counter()
+        app.search_index.rebuild()
+        build_seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        index = app.search_index
+        print(f"בניית האינדקס: {build_seconds * 1000:.0f}ms, {len(index.documents)} שמות, "
+              f"{len(index.vocabulary)} מילים, שיא זיכרון {peak / 1024 / 1024:.1f}MB")
+
+        client = application.test_client()
+        with client.session_transaction() as flask_session:
+            flask_session['user_id'] = 1
+
+        for name, queries in query_sets(random.Random(1), args.queries).items():
+            print(f"{name} ({len(queries)} שאילתות):")
+            report('index', measure(lambda query: index.search(query, 5), queries))
+            report('FTS5', measure(lambda query: app.search_product_ids(query, 5), queries))
+            application.config['SEARCH_PREFIX_INDEX'] = True
+            report('GET /search-products (index)', measure(lambda query: client.get('/search-products', query_string={'q': query}), queries))
+            application.config['SEARCH_PREFIX_INDEX'] = False
+            report('GET /search-products (FTS5)', measure(lambda query: client.get('/search-products', query_string={'q': query}), queries))
+
+
+if __name__ == '__main__':
+    main()
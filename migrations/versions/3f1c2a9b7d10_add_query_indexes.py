@@ -0,0 +1,47 @@
+"""add indexes for catalog, orders and carts queries
+
+Revision ID: 3f1c2a9b7d10
+Revises: 
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9b7d10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# (שם האינדקס, טבלה, עמודות) - זהה להגדרות במודלים ב-app.py
+INDEXES = [
+    ('ix_product_category_id', 'product', ['category_id']),
+    ('ix_product_name', 'product', ['name']),
+    ('ix_product_price_with_vat', 'product', ['price_with_vat']),
+    ('ix_product_variation_product_id', 'product_variation', ['product_id']),
+    ('ix_order_date', 'order', ['date']),
+    ('ix_order_customer_id_date', 'order', ['customer_id', 'date']),
+    ('ix_order_item_order_id', 'order_item', ['order_id']),
+    ('ix_order_item_product_id', 'order_item', ['product_id']),
+    ('ix_cart_updated_at', 'cart', ['updated_at']),
+]
+
+
+def existing_indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    # מסדי נתונים שנוצרו ע"י db.create_all כבר כוללים חלק מהאינדקסים - יוצרים רק את החסרים
+    for name, table, columns in INDEXES:
+        if name not in existing_indexes(table):
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        if name in existing_indexes(table):
+            op.drop_index(name, table_name=table)
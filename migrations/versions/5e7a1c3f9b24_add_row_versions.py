@@ -0,0 +1,33 @@
+"""add row versions for json etags
+
+Revision ID: 5e7a1c3f9b24
+Revises: c4d9e2a7b813
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e7a1c3f9b24'
+down_revision = 'c4d9e2a7b813'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ['category', 'product', 'customer', 'product_variation']
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table in TABLES:
+        if 'version' not in {column['name'] for column in inspector.get_columns(table)}:
+            # שורות קיימות מקבלות גרסה '0'; כל שינוי או שורה חדשה מקבלים גרסה אקראית
+            op.add_column(table, sa.Column('version', sa.String(length=32), nullable=False, server_default='0'))
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('version')
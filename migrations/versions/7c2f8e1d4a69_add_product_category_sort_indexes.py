@@ -0,0 +1,40 @@
+"""add composite indexes for the product listing by category
+
+Revision ID: 7c2f8e1d4a69
+Revises: 9d3f5b7a2c46
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2f8e1d4a69'
+down_revision = '9d3f5b7a2c46'
+branch_labels = None
+depends_on = None
+
+
+# (שם האינדקס, טבלה, עמודות) - זהה להגדרות במודלים ב-app.py
+INDEXES = [
+    ('ix_product_category_id_name', 'product', ['category_id', 'name']),
+    ('ix_product_category_id_price_with_vat', 'product', ['category_id', 'price_with_vat']),
+]
+
+
+def existing_indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    # מסדי נתונים שנוצרו ע"י db.create_all כבר כוללים את האינדקסים
+    for name, table, columns in INDEXES:
+        if name not in existing_indexes(table):
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        if name in existing_indexes(table):
+            op.drop_index(name, table_name=table)
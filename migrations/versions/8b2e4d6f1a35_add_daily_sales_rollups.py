@@ -0,0 +1,70 @@
+"""add daily sales rollup tables
+
+Revision ID: 8b2e4d6f1a35
+Revises: 3f1c2a9b7d10
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e4d6f1a35'
+down_revision = '3f1c2a9b7d10'
+branch_labels = None
+depends_on = None
+
+
+# (טבלה, עמודת המפתח, שאילתת המילוי מההזמנות הקיימות)
+ROLLUPS = [
+    ('daily_product_sales', 'product_id', """
+        INSERT INTO daily_product_sales (day, product_id, units, revenue_without_vat, revenue_with_vat)
+        SELECT date("order".date), order_item.product_id, sum(order_item.quantity),
+               sum(order_item.price_without_vat * order_item.quantity), sum(order_item.price_with_vat * order_item.quantity)
+        FROM order_item JOIN "order" ON order_item.order_id = "order".id
+        GROUP BY date("order".date), order_item.product_id
+    """),
+    ('daily_category_sales', 'category_id', """
+        INSERT INTO daily_category_sales (day, category_id, units, revenue_without_vat, revenue_with_vat)
+        SELECT date("order".date), product.category_id, sum(order_item.quantity),
+               sum(order_item.price_without_vat * order_item.quantity), sum(order_item.price_with_vat * order_item.quantity)
+        FROM order_item JOIN "order" ON order_item.order_id = "order".id
+        JOIN product ON order_item.product_id = product.id
+        GROUP BY date("order".date), product.category_id
+    """),
+    ('daily_customer_sales', 'customer_id', """
+        INSERT INTO daily_customer_sales (day, customer_id, orders, units, revenue_without_vat, revenue_with_vat)
+        SELECT date("order".date), "order".customer_id, count(DISTINCT "order".id), sum(order_item.quantity),
+               sum(order_item.price_without_vat * order_item.quantity), sum(order_item.price_with_vat * order_item.quantity)
+        FROM order_item JOIN "order" ON order_item.order_id = "order".id
+        WHERE "order".customer_id IS NOT NULL
+        GROUP BY date("order".date), "order".customer_id
+    """),
+]
+
+
+def upgrade():
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    for table, key, backfill in ROLLUPS:
+        # db.create_all כבר יוצר את הטבלאות במסדים קיימים - ממלאים רק טבלה ריקה
+        if table not in existing:
+            columns = [
+                sa.Column('day', sa.Date(), primary_key=True),
+                sa.Column(key, sa.Integer(), primary_key=True),
+            ]
+            if table == 'daily_customer_sales':
+                columns.append(sa.Column('orders', sa.Integer(), nullable=False))
+            columns += [
+                sa.Column('units', sa.Integer(), nullable=False),
+                sa.Column('revenue_without_vat', sa.Float(), nullable=False),
+                sa.Column('revenue_with_vat', sa.Float(), nullable=False),
+            ]
+            op.create_table(table, *columns)
+        if op.get_bind().execute(sa.text(f'SELECT count(*) FROM {table}')).scalar() == 0:
+            op.execute(backfill)
+
+
+def downgrade():
+    for table, _, _ in reversed(ROLLUPS):
+        op.drop_table(table)
@@ -0,0 +1,58 @@
+"""add vat rates and price history
+
+Revision ID: 9d3f5b7a2c46
+Revises: 5e7a1c3f9b24
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3f5b7a2c46'
+down_revision = '5e7a1c3f9b24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # db.create_all (flask init-db) כבר יוצר את הטבלאות במסדים חדשים
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if 'vat_rate' not in existing:
+        op.create_table(
+            'vat_rate',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('rate', sa.Float(), nullable=False),
+            sa.Column('effective_from', sa.DateTime(), nullable=False),
+        )
+        op.create_index('ix_vat_rate_effective_from', 'vat_rate', ['effective_from'])
+    if 'price_change' not in existing:
+        op.create_table(
+            'price_change',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('effective_at', sa.DateTime(), nullable=False),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.id')),
+            sa.Column('details', sa.Text(), nullable=False),
+            sa.Column('products', sa.Integer(), nullable=False),
+            sa.Column('variations', sa.Integer(), nullable=False),
+        )
+        op.create_index('ix_price_change_effective_at', 'price_change', ['effective_at'])
+    if 'price_history' not in existing:
+        op.create_table(
+            'price_history',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('change_id', sa.Integer(), sa.ForeignKey('price_change.id'), nullable=False),
+            sa.Column('product_id', sa.Integer(), nullable=False),
+            sa.Column('variation_id', sa.Integer()),
+            sa.Column('price_with_vat', sa.Float(), nullable=False),
+            sa.Column('price_without_vat', sa.Float(), nullable=False),
+        )
+        op.create_index('ix_price_history_change_id', 'price_history', ['change_id'])
+        op.create_index('ix_price_history_product_id_change_id', 'price_history', ['product_id', 'change_id'])
+
+
+def downgrade():
+    op.drop_table('price_history')
+    op.drop_table('price_change')
+    op.drop_table('vat_rate')
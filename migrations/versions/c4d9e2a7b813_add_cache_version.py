@@ -0,0 +1,30 @@
+"""add cache version counters
+
+Revision ID: c4d9e2a7b813
+Revises: 8b2e4d6f1a35
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d9e2a7b813'
+down_revision = '8b2e4d6f1a35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # db.create_all כבר יוצר את הטבלה במסדים קיימים
+    if 'cache_version' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'cache_version',
+            sa.Column('name', sa.String(length=50), primary_key=True),
+            sa.Column('version', sa.Integer(), nullable=False),
+        )
+
+
+def downgrade():
+    op.drop_table('cache_version')
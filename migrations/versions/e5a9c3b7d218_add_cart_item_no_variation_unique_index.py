@@ -0,0 +1,56 @@
+"""add unique index for cart items without a variation
+
+Revision ID: e5a9c3b7d218
+Revises: 7c2f8e1d4a69
+Create Date: 2026-10-18 18:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a9c3b7d218'
+down_revision = '7c2f8e1d4a69'
+branch_labels = None
+depends_on = None
+
+
+INDEX = 'uq_cart_item_cart_id_product_id_no_variation'
+NO_VARIATION = sa.text('variation_id IS NULL')
+
+
+def existing_indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    # db.create_all (flask init-db) כבר יוצר את האינדקס במסדים חדשים
+    if INDEX in existing_indexes('cart_item'):
+        return
+    # UNIQUE(cart_id, product_id, variation_id) לא מנע כפילויות כש-variation_id הוא NULL -
+    # מאחדים אותן לשורה הראשונה לפני יצירת האינדקס
+    op.execute("""
+        UPDATE cart_item SET quantity = (
+            SELECT SUM(other.quantity) FROM cart_item AS other
+            WHERE other.cart_id = cart_item.cart_id AND other.product_id = cart_item.product_id
+              AND other.variation_id IS NULL
+        )
+        WHERE id IN (
+            SELECT MIN(id) FROM cart_item WHERE variation_id IS NULL
+            GROUP BY cart_id, product_id HAVING COUNT(*) > 1
+        )
+    """)
+    op.execute("""
+        DELETE FROM cart_item
+        WHERE variation_id IS NULL AND id NOT IN (
+            SELECT MIN(id) FROM cart_item WHERE variation_id IS NULL GROUP BY cart_id, product_id
+        )
+    """)
+    op.create_index(INDEX, 'cart_item', ['cart_id', 'product_id'], unique=True,
+                    sqlite_where=NO_VARIATION, postgresql_where=NO_VARIATION)
+
+
+def downgrade():
+    if INDEX in existing_indexes('cart_item'):
+        op.drop_index(INDEX, table_name='cart_item')
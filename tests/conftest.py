@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app as inventory
+
+
+@pytest.fixture
+def app(tmp_path):
+    uploads = tmp_path / 'uploads'
+    application = inventory.create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+        'UPLOAD_FOLDER': str(uploads),
+        'THUMBNAIL_FOLDER': str(uploads / 'thumbs'),
+        'PDF_JOB_FOLDER': str(tmp_path / 'pdf_jobs'),
+        'SEARCH_PREFIX_INDEX': False,
+        'LOG_LEVEL': 'WARNING',
+    })
+    # מטמון העמודים משותף לכל האפליקציות בתהליך - כל בדיקה מתחילה ממסד נתונים חדש
+    inventory.catalog_cache.entries.clear()
+    inventory.catalog_cache.version = None
+    with application.app_context():
+        inventory.init_db()
+        category = inventory.Category(name='מאפים')
+        inventory.db.session.add(category)
+        inventory.db.session.flush()
+        inventory.db.session.add(inventory.Product(name='עוגת שוקולד', price_with_vat=59, price_without_vat=50,
+                                                   category_id=category.id))
+        inventory.db.session.commit()
+    yield application
+    with application.app_context():
+        inventory.db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    return client
@@ -0,0 +1,47 @@
+import os
+import time
+
+import pytest
+
+import app as inventory
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = inventory.FragmentCache()
+    cache.max_entries = 10
+    cache.max_disk_entries = 3
+    cache.directory = str(tmp_path)
+    return cache
+
+
+def test_disk_tier_is_bounded(cache, tmp_path):
+    for page in range(6):
+        cache.set(1, ('products', page), {'catalog_html': str(page)})
+    assert len(os.listdir(tmp_path)) == 3
+
+
+def test_only_older_versions_are_purged(cache, tmp_path):
+    cache.set(5, ('products',), {'catalog_html': 'v5'})
+    (tmp_path / '4-old.json').write_text('{}')
+    (tmp_path / '9-newer.json').write_text('{}')
+    cache.get(6, ('products',))
+    assert sorted(os.listdir(tmp_path)) == ['9-newer.json']
+
+
+def test_in_progress_writes_are_left_alone(cache, tmp_path):
+    in_progress = tmp_path / '1-page.json.abc.tmp'
+    in_progress.write_text('{')
+    for page in range(6):
+        cache.set(1, ('products', page), {'catalog_html': str(page)})
+    cache.get(2, ('products',))
+    assert os.listdir(tmp_path) == [in_progress.name]
+
+
+def test_abandoned_temp_files_are_removed(cache, tmp_path):
+    abandoned = tmp_path / '1-page.json.abc.tmp'
+    abandoned.write_text('{')
+    old = time.time() - cache.TEMP_FILE_MAX_AGE - 1
+    os.utime(abandoned, (old, old))
+    cache.set(1, ('products',), {'catalog_html': 'x'})
+    assert not abandoned.exists()
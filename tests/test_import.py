@@ -0,0 +1,18 @@
+import io
+
+import app as inventory
+
+
+def test_import_attaches_variations_to_their_products(app, client):
+    app.config['IMPORT_CHUNK_SIZE'] = 7
+    rows = ['name,price_with_vat,variation_1_name,variation_1_price_with_vat']
+    rows += [f'מוצר {i},{i + 1},טעם {i},{i + 2}' for i in range(30)]
+    data = {'file': (io.BytesIO('\n'.join(rows).encode('utf-8')), 'products.csv'), 'category_id': '1'}
+    response = client.post('/import-products', data=data, content_type='multipart/form-data')
+    assert response.json['imported'] == 30
+    with app.app_context():
+        imported = inventory.Product.query.filter(inventory.Product.name.like('מוצר %')).all()
+        assert len(imported) == 30
+        for product in imported:
+            number = product.name.split()[1]
+            assert [variation.name for variation in product.variations] == [f'טעם {number}']
@@ -0,0 +1,20 @@
+from datetime import datetime
+
+import app as inventory
+
+
+def test_merged_pdf_rejects_large_ranges(app, client):
+    app.config['ORDER_EXPORT_PDF_MAX_ORDERS'] = 2
+    with app.app_context():
+        customer = inventory.Customer(name='לקוח')
+        inventory.db.session.add(customer)
+        inventory.db.session.flush()
+        inventory.db.session.add_all([
+            inventory.Order(date=datetime(2026, 3, 1, hour), customer_id=customer.id,
+                            total_without_vat=100, total_with_vat=118)
+            for hour in range(3)
+        ])
+        inventory.db.session.commit()
+    response = client.get('/export-orders-pdf?date_from=2026-03-01&date_to=2026-03-01')
+    assert response.status_code == 400
+    assert 'format=zip' in response.json['message']
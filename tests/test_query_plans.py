@@ -0,0 +1,40 @@
+import pytest
+
+import app as inventory
+
+
+def query_plans(*dropped_indexes):
+    """תוכניות השאילתות החמות על מסד נתונים זמני בגודל של קטלוג אמיתי (כמו flask check-query-plans)."""
+    application = inventory.create_app({'LOG_LEVEL': 'WARNING'})
+    with application.app_context():
+        engine = inventory.db.create_engine('sqlite://')
+        with engine.connect() as conn:
+            inventory.db.metadata.create_all(conn)
+            for name in dropped_indexes:
+                conn.exec_driver_sql(f'DROP INDEX {name}')
+            inventory.seed_query_plan_database(conn, 2000)
+            results = {name: (plan, problems) for name, plan, problems in inventory.explain_query_plans(conn)}
+        engine.dispose()
+    return results
+
+
+@pytest.fixture(scope='module')
+def plans():
+    return query_plans()
+
+
+def test_no_full_scans_or_temp_sorts(plans):
+    failures = {name: plan for name, (plan, problems) in plans.items() if problems}
+    assert failures == {}
+
+
+def test_listing_checks_come_from_the_route_query(plans):
+    plan, _ = plans['products: name + category']
+    assert any('category_1' in detail for detail in plan)  # joinedload(Product.category)
+    plan, _ = plans['products: search']
+    assert any('catalog_search' in detail for detail in plan)  # תת-השאילתה של MATCH
+
+
+def test_missing_index_is_reported():
+    _, problems = query_plans('ix_product_category_id_name')['products: name + category']
+    assert problems == ['USE TEMP B-TREE FOR ORDER BY']
@@ -0,0 +1,18 @@
+import pytest
+
+
+@pytest.mark.parametrize('path', ['/', '/products', '/categories', '/category/1', '/cart', '/orders-history'])
+def test_page_renders(client, path):
+    assert client.get(path).status_code == 200
+
+
+def test_landing_page_is_the_catalog(client):
+    page = client.get('/').get_data(as_text=True)
+    assert 'עוגת שוקולד' in page
+    assert page == client.get('/products').get_data(as_text=True)
+
+
+def test_pages_redirect_to_login(app):
+    response = app.test_client().get('/')
+    assert response.status_code == 302
+    assert '/login' in response.headers['Location']
@@ -0,0 +1,36 @@
+import pytest
+
+import app as inventory
+
+
+@pytest.fixture
+def catalog(app):
+    with app.app_context():
+        category = inventory.Category.query.first()
+        chocolate = inventory.Product(name='טבלת שוקולד', price_with_vat=12, price_without_vat=10, category_id=category.id)
+        inventory.db.session.add(chocolate)
+        inventory.db.session.flush()
+        inventory.db.session.add(inventory.ProductVariation(product_id=chocolate.id, name='מריר 70%',
+                                                            price_with_vat=14, price_without_vat=12))
+        inventory.db.session.commit()
+        return chocolate.id
+
+
+@pytest.mark.parametrize('prefix_index', [False, True])
+def test_terms_may_match_product_and_variation_names(app, client, catalog, prefix_index):
+    app.config['SEARCH_PREFIX_INDEX'] = prefix_index
+    if prefix_index:
+        with app.app_context():
+            inventory.search_index.rebuild()
+    assert [hit['id'] for hit in client.get('/search-products?q=שוקולד מריר').json] == [catalog]
+    assert [hit['id'] for hit in client.get('/search-products?q=שוק מרי').json] == [catalog]
+    assert client.get('/search-products?q=שוקולד חלב').json == []
+
+
+def test_catalog_filter_matches_across_names(app, client, catalog):
+    with app.app_context():
+        assert inventory.fts_enabled()
+        matches = inventory.Product.query.filter(inventory.search_products_filter('שוקולד מריר')).all()
+        assert [product.id for product in matches] == [catalog]
+        assert inventory.Product.query.filter(inventory.search_products_filter('עוגת מריר')).all() == []
+    assert 'טבלת שוקולד' in client.get('/products?search=שוקולד מריר').get_data(as_text=True)